@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'sales_analytics.instrumentation.QueryInstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -92,6 +93,37 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # files are seen by every worker of one host; point this alias at Redis or Memcached when they span hosts
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    },
+}
+
+# cache alias holding the catalog entries and the versions invalidating them, fronted by an in-process LRU of
+# CATALOG_LRU_SIZE entries; a system check warns when it is local to each process
+CATALOG_CACHE = 'shared'
+CATALOG_LRU_SIZE = 512
+# seconds the catalog entries and versions are kept in CATALOG_CACHE
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# cache alias holding the closed periods of the sales analytics and the version invalidating them
+ANALYTICS_CACHE = 'shared'
+
+# origin prepended to the avatar URLs (/users/avatars/<initials>/) in emails, a system check warns while it is empty
+AVATAR_BASE_URL = ''
+
+# processes hashing the passwords of bulk onboarding, one per CPU when None
+PASSWORD_HASH_WORKERS = None
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -148,6 +180,8 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_OBTAIN_SERIALIZER': 'sales_analytics.authentication.RoleTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'sales_analytics.authentication.RoleTokenRefreshSerializer',
 }
 
 TEMPLATED_EMAIL_BACKEND = 'templated_email.backends.vanilla_django.TemplateBackend'
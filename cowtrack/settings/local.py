@@ -7,6 +7,7 @@ if DEBUG:
     ]
 
 SIMPLE_JWT = {
+    **SIMPLE_JWT,
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
 }
@@ -15,6 +16,8 @@ EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = '127.0.0.1'
 EMAIL_PORT = 1025
 
+AVATAR_BASE_URL = 'http://localhost:8000'
+
 INSTALLED_APPS += [
     "debug_toolbar",
 ]
@@ -1,3 +1,34 @@
 from django.contrib import admin
 
-# Register your models here.
+from .caching import CatalogAdminMixin
+from .models import Branch, ProductCategory, Product, PaymentMethod
+from .rollups import branches_deleted
+
+
+@admin.register(Branch)
+class BranchAdmin(CatalogAdminMixin, admin.ModelAdmin):
+    list_display = ['branch_id', 'branch_name', 'phone_number', 'email', 'opening_date']
+
+    def delete_model(self, request, obj):
+        with branches_deleted([obj.pk]):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with branches_deleted(list(queryset.values_list('pk', flat=True))):
+            super().delete_queryset(request, queryset)
+
+
+@admin.register(ProductCategory)
+class ProductCategoryAdmin(CatalogAdminMixin, admin.ModelAdmin):
+    list_display = ['category_id', 'category_name']
+
+
+@admin.register(Product)
+class ProductAdmin(CatalogAdminMixin, admin.ModelAdmin):
+    list_display = ['product_id', 'product_name', 'selling_price', 'serial_number', 'category', 'branch']
+    list_select_related = ['category', 'branch']
+
+
+@admin.register(PaymentMethod)
+class PaymentMethodAdmin(CatalogAdminMixin, admin.ModelAdmin):
+    list_display = ['payment_method_id', 'method_name']
@@ -0,0 +1,149 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from rest_framework import serializers
+
+from .exports import day_start
+from .models import CompletedSale, Branch, PaymentMethod
+
+
+# dimension -> (key columns, named columns) it groups by
+DIMENSIONS = {
+    'branch': (['branch_id'], {'branch_name': F('branch__branch_name')}),
+    'payment_method': (['payment_method_id'], {'payment_method_name': F('payment_method__method_name')}),
+    'salesperson': (['salesperson_id'], {}),
+}
+
+GRANULARITIES = ['day', 'week', 'month']
+
+# periods shown when no start day is given
+DEFAULT_PERIODS = {'day': 30, 'week': 12, 'month': 12}
+
+VERSION_KEY = 'sales-analytics:version'
+
+# models whose ids and names the dimensions copy into the cached closed periods
+NAMED_MODELS = (Branch, PaymentMethod)
+
+# closed periods only change when old sales are edited, which invalidates them
+CLOSED_PERIODS_TIMEOUT = 60 * 60 * 24
+
+
+class SalesAnalyticsQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the sales analytics. start and end are inclusive
+    days in the current timezone, dimensions a comma separated list.
+    """
+    granularity = serializers.ChoiceField(choices=GRANULARITIES, default='day')
+    dimensions = serializers.CharField(required=False, default='')
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate_dimensions(self, value):
+        dimensions = [dimension.strip() for dimension in value.split(',') if dimension.strip()]
+        unknown = sorted(set(dimensions) - set(DIMENSIONS))
+        if unknown:
+            raise serializers.ValidationError(f'Unknown dimensions: {", ".join(unknown)}')
+        return sorted(set(dimensions), key=list(DIMENSIONS).index)
+
+    def validate(self, attrs):
+        attrs.setdefault('end', timezone.localdate())
+        if 'start' not in attrs:
+            attrs['start'] = period_start(attrs['granularity'], attrs['end'], DEFAULT_PERIODS[attrs['granularity']] - 1)
+        if attrs['start'] > attrs['end']:
+            raise serializers.ValidationError({'message': 'start must not be after end'})
+        return attrs
+
+
+def period_start(granularity, day, periods_back=0):
+    """
+    First day of the period containing day, moved periods_back periods into the past.
+    """
+    if granularity == 'day':
+        return day - timedelta(days=periods_back)
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday() + 7 * periods_back)
+    month = day.year * 12 + day.month - 1 - periods_back
+    return day.replace(year=month // 12, month=month % 12 + 1, day=1)
+
+
+def grouped_sales(granularity, dimensions, start, end):
+    """
+    Number and total of the sales completed in [start, end), per period and dimension values.
+    """
+    keys, names = [], {}
+    for dimension in dimensions:
+        keys += DIMENSIONS[dimension][0]
+        names.update(DIMENSIONS[dimension][1])
+
+    rows = CompletedSale.objects.filter(completed_at__gte=start, completed_at__lt=end).annotate(
+        period=Trunc('completed_at', granularity, output_field=DateField())
+        ).values(
+        'period', *keys, **names
+        ).annotate(
+        number_of_sales=Count('sale_id'),
+        total_amount=Sum('total_amount')
+        ).order_by('period', *keys)
+    return list(rows)
+
+
+AMOUNT = serializers.DecimalField(max_digits=19, decimal_places=4)
+
+
+def representation(rows):
+    return [{**row, 'total_amount': AMOUNT.to_representation(row['total_amount'])} for row in rows]
+
+
+def analytics_cache():
+    # an invalidation only reaches the other workers when this alias is shared with them, see check_shared_caches
+    return caches[getattr(settings, 'ANALYTICS_CACHE', 'default')]
+
+
+def version():
+    # a version lost with the cache starts from a fresh value, never one of the entries still cached
+    return analytics_cache().get_or_set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_closed_periods():
+    """
+    Drop the cached analytics of closed periods, after sales completed in the past were changed.
+    """
+    try:
+        analytics_cache().incr(VERSION_KEY)
+    except ValueError:
+        analytics_cache().add(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def sales_analytics(granularity, dimensions, start, end):
+    """
+    Sales per period between the start and end days.
+
+    Periods that ended before the current one are cached; on a hit only the
+    current, still open period is queried.
+    """
+    range_start, range_end = day_start(start), day_start(end + timedelta(days=1))
+    open_start = period_start(granularity, timezone.localdate())
+    open_start_at = day_start(open_start)
+
+    if range_start >= open_start_at:
+        return grouped_sales(granularity, dimensions, range_start, range_end)
+
+    closed_end = min(range_end, open_start_at)
+    key = 'sales-analytics:{}:{}:{}:{}:{}'.format(
+        version(), granularity, ','.join(dimensions), range_start.isoformat(), closed_end.isoformat())
+    closed = analytics_cache().get(key)
+
+    if closed is None:
+        # one query for the whole range, split into the closed and the open periods
+        rows = grouped_sales(granularity, dimensions, range_start, range_end)
+        closed = [row for row in rows if row['period'] < open_start]
+        analytics_cache().set(key, closed, CLOSED_PERIODS_TIMEOUT)
+        return rows
+
+    if range_end <= open_start_at:
+        return closed
+    return closed + grouped_sales(granularity, dimensions, open_start_at, range_end)
@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.db.models.signals import pre_migrate, post_migrate
 
 
 class SalesAnalyticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sales_analytics'
+
+    def ready(self):
+        from .avatars import check_avatar_base_url
+        from .caching import check_shared_caches
+        from .search_indexes import suspend_before_migrate, restore_after_migrate
+
+        checks.register(check_avatar_base_url)
+        checks.register(check_shared_caches)
+
+        # sent once per app, so only for this one
+        pre_migrate.connect(suspend_before_migrate, sender=self)
+        post_migrate.connect(restore_after_migrate, sender=self)
@@ -0,0 +1,91 @@
+from django.contrib.auth import get_user_model
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import Customer, SalesPerson, Manager
+
+
+User = get_user_model()
+
+# role -> (profile model, claim carrying the profile id)
+PROFILE_CLAIMS = {
+    User.SALESPERSON: (SalesPerson, 'sales_person_id'),
+    User.MANAGER: (Manager, 'manager_id'),
+    User.CUSTOMER: (Customer, 'customer_id'),
+}
+
+
+def add_role_claims(token, user):
+    token['username'] = user.username
+    token['role'] = user.role
+    token['is_superuser'] = user.is_superuser
+    token['is_staff'] = user.is_staff
+
+    if user.role in PROFILE_CLAIMS:
+        model, claim = PROFILE_CLAIMS[user.role]
+        token[claim] = model.objects.filter(user_id=user.pk).values_list('pk', flat=True).first()
+
+    return token
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Issues token pairs carrying the role and profile id of the user.
+    """
+    @classmethod
+    def get_token(cls, user):
+        return add_role_claims(super().get_token(user), user)
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Re-checks the user before handing out a new access token, so deactivated or
+    deleted users cannot keep refreshing, and stamps the access token with the
+    current role claims.
+    """
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        refresh = self.token_class(attrs['refresh'])
+
+        try:
+            user = User.objects.get(**{api_settings.USER_ID_FIELD: refresh[api_settings.USER_ID_CLAIM]})
+        except (KeyError, User.DoesNotExist):
+            raise AuthenticationFailed('User not found', code='user_not_found')
+
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+
+        access = add_role_claims(refresh.access_token, user)
+        data['access'] = str(access)
+        return data
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    Authenticates read-only requests from the access token claims alone.
+
+    request.user is then a TokenUser that only knows the id, role, superuser
+    and profile id claims, so only views that read nothing else off the user
+    opt in through authentication_classes; JWTAuthentication stays the default.
+    Unsafe methods, and tokens issued without role claims, still load the user
+    from the database.
+    """
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+
+        if request.method in SAFE_METHODS and 'role' in validated_token:
+            return TokenUser(validated_token), validated_token
+
+        return self.get_user(validated_token), validated_token
@@ -0,0 +1,66 @@
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.core import checks
+from django.urls import reverse
+from django.utils.html import escape
+
+
+# background colours of the avatars, picked by the initials
+PALETTE = ['#1abc9c', '#2e86c1', '#8e44ad', '#c0392b', '#d35400', '#16a085', '#2c3e50', '#7f8c8d']
+
+AVATAR_SIZE = 128
+MAX_INITIALS = 2
+
+# one entry per user and name, so a renamed user misses and gets a new URL
+AVATAR_URL_CACHE_SIZE = 4096
+
+
+def initials(first_name, last_name):
+    letters = [name.strip()[0] for name in (first_name, last_name) if name and name.strip()[:1].isalnum()]
+    return ''.join(letters).upper() or '?'
+
+
+@lru_cache(maxsize=AVATAR_URL_CACHE_SIZE)
+def user_avatar_path(user_id, first_name, last_name):
+    return reverse('avatars-detail', kwargs={'initials': initials(first_name, last_name)})
+
+
+def avatar_url(user, request=None):
+    """
+    Absolute URL of the initials avatar of a user, served by this API instead
+    of an external avatar service. Built from the request when there is one,
+    from AVATAR_BASE_URL otherwise, as for the emails.
+    """
+    path = user_avatar_path(user.pk, user.first_name, user.last_name)
+    if request is not None:
+        return request.build_absolute_uri(path)
+    return settings.AVATAR_BASE_URL + path
+
+
+def check_avatar_base_url(app_configs, **kwargs):
+    base_url = getattr(settings, 'AVATAR_BASE_URL', '')
+    if base_url.startswith(('http://', 'https://')):
+        return []
+    return [checks.Warning(
+        'AVATAR_BASE_URL should be the origin of this API, such as https://api.example.com',
+        hint='Emails have no request to build the avatar links from, so they link relative URLs until it is set.',
+        id='sales_analytics.W002',
+    )]
+
+
+@lru_cache(maxsize=1024)
+def render_avatar(initials):
+    """
+    SVG of the initials on a background chosen from them, so the same initials always render the same image.
+    """
+    background = PALETTE[int(hashlib.md5(initials.encode()).hexdigest(), 16) % len(PALETTE)]
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{AVATAR_SIZE}" height="{AVATAR_SIZE}" '
+        f'viewBox="0 0 {AVATAR_SIZE} {AVATAR_SIZE}">'
+        f'<rect width="100%" height="100%" fill="{background}"/>'
+        f'<text x="50%" y="50%" dy=".35em" text-anchor="middle" fill="#ffffff" '
+        f'font-family="Helvetica, Arial, sans-serif" font-size="{AVATAR_SIZE * 2 // 5}">{escape(initials)}</text>'
+        f'</svg>'
+    )
@@ -0,0 +1,498 @@
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from djmoney.contrib.django_rest_framework import MoneyField
+from djmoney.money import Money
+from drf_writable_nested.serializers import WritableNestedModelSerializer
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+
+from . import urls
+from .authentication import RoleTokenObtainPairSerializer
+from .caching import catalog_cache
+from .models import Customer, SalesPerson, Manager, Supplier, Branch, SalesPersonBranch, ProductCategory
+from .models import Product, PaymentMethod, Cart, Sale, CompletedSale
+from .rollups import rebuild_monthly_sales
+from .serializers import SalesPersonSerializer, CustomerSerializer, ManagerSerializer, SupplierSerializer
+from .serializers import SalesPersonReadSerializer, CustomerReadSerializer, ManagerReadSerializer, SupplierReadSerializer
+from .serializers import BranchSerializer, CartWriteSerializer, CartReadSerializer, SaleReadSerializer
+from .serializers import CompletedSaleReadSerializer, SimpleSalesPersonBranchSerializer
+
+
+User = get_user_model()
+
+# rows created per unit of scale
+DATASET = {
+    'branches': 5,
+    'categories': 10,
+    'salespersons': 20,
+    'managers': 5,
+    'suppliers': 5,
+    'customers': 100,
+    'products': 200,
+    'sales': 500,
+    'completed_sales': 200,
+}
+
+# lines put back in the basket before every timed checkout
+CHECKOUT_LINES = 20
+
+# timed requests per endpoint below which a p90 is one slow request away from failing, so it is only reported
+LATENCY_MIN_ITERATIONS = 20
+
+
+class Dataset:
+    """
+    Synthetic, reproducible dataset sized by a scale factor, plus the users
+    and objects the benchmark authenticates as and requests.
+    """
+    def __init__(self, scale=1, seed=0):
+        self.scale = scale
+        self.random = random.Random(seed)
+        self.onboarded = 0
+
+    def count(self, name):
+        return DATASET[name] * self.scale
+
+    def create_users(self, prefix, role, number):
+        password = make_password('benchmark')
+        now = timezone.now()
+        return User.objects.bulk_create([
+            User(username=f'{prefix}{i}', email=f'{prefix}{i}@cowtrack.com', first_name=prefix.title(),
+                 last_name=str(i), role=role, password=password, is_active=True,
+                 date_joined=now - timedelta(minutes=i))
+            for i in range(number)
+        ], batch_size=1000)
+
+    def build(self):
+        pick = self.random.choice
+
+        self.admin = User.objects.create_superuser(username='benchmark-admin', password='benchmark', role=User.ADMIN)
+        self.branches = Branch.objects.bulk_create([
+            Branch(branch_name=f'Branch {i}', phone_number='0700000000', email=f'branch{i}@cowtrack.com')
+            for i in range(self.count('branches'))
+        ])
+        categories = ProductCategory.objects.bulk_create([
+            ProductCategory(category_name=f'Category {i}') for i in range(self.count('categories'))
+        ])
+        self.payment_methods = PaymentMethod.objects.bulk_create([
+            PaymentMethod(method_name='M-PESA'), PaymentMethod(method_name='Cash'),
+        ])
+
+        self.salespersons = SalesPerson.objects.bulk_create([
+            SalesPerson(user=user, phone_number='0711111111')
+            for user in self.create_users('salesperson', User.SALESPERSON, self.count('salespersons'))
+        ])
+        self.managers = Manager.objects.bulk_create([
+            Manager(user=user, phone_number='0722222222')
+            for user in self.create_users('manager', User.MANAGER, self.count('managers'))
+        ])
+        Supplier.objects.bulk_create([
+            Supplier(user=user, phone_number='0733333333', kra_pin=f'S{i:09d}', contact_person='Supplier', notes='')
+            for i, user in enumerate(self.create_users('supplier', User.SUPPLIER, self.count('suppliers')))
+        ])
+        self.customers = Customer.objects.bulk_create([
+            Customer(user=user, phone_number='0744444444', kra_pin=f'C{i:09d}', contact_person='Customer', address='')
+            for i, user in enumerate(self.create_users('customer', User.CUSTOMER, self.count('customers')))
+        ], batch_size=1000)
+
+        SalesPersonBranch.objects.bulk_create([
+            SalesPersonBranch(salesperson=salesperson, branch=pick(self.branches))
+            for salesperson in self.salespersons
+        ])
+        self.products = Product.objects.bulk_create([
+            Product(product_name=f'Product {i}', cost_price=Decimal(self.random.randint(10, 900)),
+                    selling_price=Decimal(self.random.randint(1000, 2000)), category=pick(categories),
+                    branch=pick(self.branches), serial_number=f'SN{i:08d}', is_serialized=True)
+            for i in range(self.count('products'))
+        ], batch_size=1000)
+
+        carts = Cart.objects.bulk_create([
+            Cart(product=pick(self.products), customer=pick(self.customers), number_of_items=self.random.randint(1, 5))
+            for _ in range(self.count('sales'))
+        ], batch_size=1000)
+        completed_sales = CompletedSale.objects.bulk_create([
+            CompletedSale(salesperson=pick(self.salespersons), branch=pick(self.branches),
+                          payment_method=pick(self.payment_methods),
+                          total_amount=Decimal(self.random.randint(1000, 50000)))
+            for _ in range(self.count('completed_sales'))
+        ], batch_size=1000)
+        sales = Sale.objects.bulk_create([
+            Sale(salesperson=pick(self.salespersons), cart=cart, awarded_points=self.random.randint(1, 100), is_completed=1,
+                 completed_sale=pick(completed_sales))
+            for cart in carts
+        ], batch_size=1000)
+
+        # store the count and points of the lines linked to each completed sale, as checkout does
+        for sale in sales:
+            sale.completed_sale.line_count += 1
+            sale.completed_sale.awarded_points += sale.awarded_points
+
+        # spread completed sales over the last two years
+        for completed_sale in completed_sales:
+            completed_sale.completed_at = timezone.now() - timedelta(days=self.random.randint(0, 730))
+        CompletedSale.objects.bulk_update(completed_sales, ['completed_at', 'line_count', 'awarded_points'],
+                                          batch_size=1000)
+        rebuild_monthly_sales()
+
+        self.salesperson = self.salespersons[0]
+        self.customer = self.customers[0]
+        return self
+
+    def fill_basket(self):
+        carts = Cart.objects.bulk_create([
+            Cart(product=self.random.choice(self.products), customer=self.customer, number_of_items=1)
+            for _ in range(CHECKOUT_LINES)
+        ])
+        Sale.objects.bulk_create([Sale(salesperson=self.salesperson, cart=cart, awarded_points=1) for cart in carts])
+
+    def onboarding_rows(self):
+        # new emails on every request, the usernames of the last one are taken
+        self.onboarded += CHECKOUT_LINES
+        password_hash = make_password('benchmark')
+        return [
+            {'email': f'onboarded{i}@cowtrack.com', 'first_name': 'Onboarded', 'last_name': str(i),
+             'phone_number': '0755555555', 'password_hash': password_hash}
+            for i in range(self.onboarded - CHECKOUT_LINES, self.onboarded)
+        ]
+
+
+def access_token(user):
+    return str(RoleTokenObtainPairSerializer.get_token(user).access_token)
+
+
+class Endpoint:
+    """
+    One route of sales_analytics.urls with the request used to exercise it.
+    """
+    def __init__(self, pattern, dataset):
+        self.name = pattern.name
+        self.pattern = pattern
+        self.dataset = dataset
+        self.actions = getattr(pattern.callback, 'actions', None) or {'get': 'list'}
+        self.method = 'get' if 'get' in self.actions else next(iter(self.actions))
+        self.data = None
+        self.query = None
+        self.prepare = None
+
+        if self.name.endswith('complete-sale'):
+            self.method = 'post'
+            self.data = {'payment_method': dataset.payment_methods[0].pk}
+            self.prepare = dataset.fill_basket
+        elif self.name == 'directory-list':
+            self.query = {'q': 'customer 1'}
+        elif self.name == 'products-list-scan':
+            self.query = {'serial_number': dataset.products[0].serial_number}
+        elif self.name == 'onboarding-list':
+            self.query = {'role': User.SALESPERSON}
+            self.data = dataset.onboarding_rows
+        elif self.name == 'products-list-resolve':
+            self.data = {'serial_numbers': [product.serial_number for product in dataset.products[:CHECKOUT_LINES]]}
+        elif self.name.endswith('bulk'):
+            self.data = [{'product': product.pk, 'number_of_items': 1} for product in dataset.products[:CHECKOUT_LINES]]
+
+    @property
+    def user(self):
+        if self.name == 'salespersons-list-me' or self.name.startswith('salesperson-sales'):
+            return self.dataset.salesperson.user
+        if self.name == 'managers-list-me':
+            return self.dataset.managers[0].user
+        return self.dataset.admin
+
+    def url_kwargs(self):
+        kwargs = {}
+        if 'salesperson_pk' in self.pattern.pattern.regex.groupindex:
+            kwargs['salesperson_pk'] = self.dataset.salesperson.pk
+        if 'customer_pk' in self.pattern.pattern.regex.groupindex:
+            kwargs['customer_pk'] = self.dataset.customer.pk
+
+        view_class = getattr(self.pattern.callback, 'cls', None)
+        lookup_field = getattr(view_class, 'lookup_field', 'pk')
+        lookup_url_kwarg = getattr(view_class, 'lookup_url_kwarg', None) or lookup_field
+        if lookup_url_kwarg in self.pattern.pattern.regex.groupindex:
+            view = view_class(kwargs=kwargs, action='retrieve', request=None, format_kwarg=None)
+            try:
+                kwargs[lookup_url_kwarg] = view.get_queryset().values_list(lookup_field, flat=True).first()
+            except (KeyError, AttributeError):
+                # routes registered without the parent lookup their viewset needs, or without a queryset
+                kwargs[lookup_url_kwarg] = 0
+        return kwargs
+
+    def url(self):
+        url = reverse(self.name, kwargs=self.url_kwargs())
+        return f'{url}?{urlencode(self.query)}' if self.query else url
+
+
+def endpoints(dataset):
+    """
+    Every route registered in sales_analytics.urls, without the format suffix variants.
+    """
+    return [
+        Endpoint(pattern, dataset) for pattern in urls.urlpatterns
+        if 'format' not in pattern.pattern.regex.groupindex
+    ]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(endpoint, iterations, warmup=1):
+    client = Client(raise_request_exception=False, HTTP_AUTHORIZATION=f'Bearer {access_token(endpoint.user)}')
+    url = endpoint.url()
+    request = getattr(client, endpoint.method)
+
+    latencies = []
+    queries = []
+    status = None
+    for i in range(warmup + iterations):
+        if endpoint.prepare is not None:
+            endpoint.prepare()
+        data = endpoint.data() if callable(endpoint.data) else endpoint.data
+        if data is not None:
+            data = json.dumps(data)
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            if data is None:
+                response = request(url)
+            else:
+                response = request(url, data, content_type='application/json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - start
+        status = response.status_code
+        if i >= warmup:
+            latencies.append(elapsed * 1000)
+            queries.append(len(captured))
+
+    return {
+        'method': endpoint.method.upper(),
+        'url': url,
+        'status': status,
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p90_ms': round(percentile(latencies, 0.9), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'queries': max(queries),
+    }
+
+
+def run(scale=1, iterations=20, seed=0):
+    # the shared caches outlive the throwaway database, whose rows reuse the keys of earlier runs
+    for shared in caches.all():
+        shared.clear()
+    catalog_cache.clear()
+    dataset = Dataset(scale=scale, seed=seed).build()
+    return {
+        'scale': scale,
+        'iterations': iterations,
+        'endpoints': {endpoint.name: measure(endpoint, iterations) for endpoint in endpoints(dataset)},
+    }
+
+
+def check_budget(results, budget):
+    """
+    Return the regressions of results against a budget of the form
+    {endpoint name: {"p90_ms": ..., "queries": ..., "status": ...}}.
+
+    An error status is never a valid budget, the timings of a failing route
+    say nothing about the route working. Latency is only checked for runs
+    of at least LATENCY_MIN_ITERATIONS requests per endpoint.
+    """
+    latency = results['iterations'] >= LATENCY_MIN_ITERATIONS
+    regressions = []
+    for name, limits in budget.items():
+        if limits.get('status', 200) >= 400:
+            regressions.append(f'{name}: budgeted status {limits["status"]} is an error')
+            continue
+        result = results['endpoints'].get(name)
+        if result is None:
+            regressions.append(f'{name}: endpoint is no longer registered')
+            continue
+        if 'status' in limits and result['status'] != limits['status']:
+            regressions.append(f'{name}: status {result["status"]} != {limits["status"]}')
+        if 'queries' in limits and result['queries'] > limits['queries']:
+            regressions.append(f'{name}: {result["queries"]} queries > {limits["queries"]}')
+        if latency and 'p90_ms' in limits and result['p90_ms'] > limits['p90_ms']:
+            regressions.append(f'{name}: p90 {result["p90_ms"]}ms > {limits["p90_ms"]}ms')
+    return regressions
+
+
+def budget_from(results, latency_headroom=3):
+    """
+    Budget of the endpoints of results that answered without an error.
+    """
+    return {
+        name: {
+            'status': result['status'],
+            'queries': result['queries'],
+            'p90_ms': round(max(result['p90_ms'] * latency_headroom, 50)),
+        }
+        for name, result in results['endpoints'].items() if result['status'] < 400
+    }
+
+
+class Rows:
+    """
+    Unsaved, fully related model instances to serialize, so the comparison
+    measures serialization alone and needs no database.
+    """
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self.now = timezone.now()
+
+    def moment(self):
+        return self.now - timedelta(seconds=self.random.randint(0, 10 ** 8), microseconds=self.random.randint(0, 10 ** 6))
+
+    def user(self, i, role):
+        return User(id=i, username=f'{role}{i}', email=f'{role}{i}@cowtrack.com', first_name=role.title(),
+                    last_name=f'Person {i}', role=role, date_joined=self.moment(),
+                    last_login=self.moment() if i % 2 else None)
+
+    def salesperson(self, i):
+        return SalesPerson(sales_person_id=i, phone_number='0711111111', user=self.user(i, User.SALESPERSON))
+
+    def customer(self, i):
+        return Customer(customer_id=i, phone_number='0744444444', kra_pin=f'C{i:09d}', contact_person=f'Contact {i}',
+                        address=f'{i} Kenyatta Avenue', user=self.user(i, User.CUSTOMER))
+
+    def manager(self, i):
+        return Manager(manager_id=i, phone_number='0722222222', user=self.user(i, User.MANAGER))
+
+    def supplier(self, i):
+        return Supplier(supplier_id=i, phone_number='0733333333', kra_pin=f'S{i:09d}', contact_person=f'Contact {i}',
+                        notes=f'Delivers on day {i % 7}', user=self.user(i, User.SUPPLIER))
+
+    def branch(self, i):
+        return Branch(branch_id=i, branch_name=f'Branch {i}', phone_number='0700000000',
+                      email=f'branch{i}@cowtrack.com', opening_date=self.moment().date())
+
+    def cart(self, i):
+        product = Product(product_id=i, product_name=f'Product {i}', serial_number=f'SN{i}' if i % 3 else None,
+                          selling_price=Money(Decimal(self.random.randint(100, 100000)) / 100, 'KES'))
+        return Cart(cart_id=i, number_of_items=self.random.randint(1, 9), product=product, customer_id=i)
+
+    def sale(self, i):
+        return Sale(sale_id=i, transaction_date=self.moment(), transaction_id=f'CWT{i:016d}',
+                    awarded_points=self.random.randint(1, 100), is_completed=i % 2,
+                    salesperson=self.salesperson(i), cart=self.cart(i))
+
+    def completed_sale(self, i):
+        return CompletedSale(sale_id=i, completed_at=self.moment(), branch=self.branch(i),
+                             total_amount=Money(Decimal(self.random.randint(100, 10 ** 7)) / 100, 'KES'),
+                             salesperson=self.salesperson(i), payment_method_id=i % 3 or None)
+
+    def salesperson_branch(self, i):
+        return SalesPersonBranch(salesperson_branch_id=i, branch=self.branch(i), assignment_date=self.moment(),
+                                 termination_date=self.moment() if i % 2 else None)
+
+
+# The nested ModelSerializers the GET paths used before the flat read
+# serializers, kept as the baseline the flat ones must match byte for byte.
+
+class NestedSimpleProductCartSerializer(serializers.Serializer):
+    product_name = serializers.CharField(max_length=50)
+    selling_price = MoneyField(max_digits=19, decimal_places=2)
+    serial_number = serializers.CharField(max_length=50)
+
+
+class NestedCartReadSerializer(WritableNestedModelSerializer):
+    total_price = serializers.SerializerMethodField('get_total_price')
+    product = NestedSimpleProductCartSerializer(read_only=True)
+
+    class Meta:
+        model = Cart
+        fields = ['cart_id', 'number_of_items', 'product', 'total_price']
+
+    def get_total_price(self, cart):
+        return cart.number_of_items * cart.product.selling_price.amount
+
+
+class NestedSaleReadSerializer(WritableNestedModelSerializer):
+    salesperson = SalesPersonSerializer()
+    cart = CartWriteSerializer()
+    transaction_id = serializers.CharField(max_length=20, read_only=True)
+    is_completed = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = Sale
+        fields = ['sale_id', 'transaction_date', 'transaction_id', 'awarded_points', 'is_completed',
+                  'salesperson', 'cart']
+
+
+class NestedCompletedSaleReadSerializer(WritableNestedModelSerializer):
+    total_amount = MoneyField(max_digits=19, decimal_places=4, read_only=True)
+    branch = BranchSerializer(read_only=True)
+    salesperson = SalesPersonSerializer(read_only=True)
+
+    class Meta:
+        model = CompletedSale
+        fields = ['sale_id', 'completed_at', 'total_amount', 'branch', 'salesperson', 'payment_method',
+                  'line_count', 'awarded_points']
+
+
+class NestedSalesPersonBranchSerializer(WritableNestedModelSerializer):
+    branch = BranchSerializer()
+
+    class Meta:
+        model = SalesPersonBranch
+        fields = ['salesperson_branch_id', 'branch', 'assignment_date', 'termination_date']
+
+
+# (name, rows factory, serializer before, serializer after); the profiles' writable
+# serializers still render what their GET paths did before the flat ones
+SERIALIZERS = [
+    ('salesperson', Rows.salesperson, SalesPersonSerializer, SalesPersonReadSerializer),
+    ('customer', Rows.customer, CustomerSerializer, CustomerReadSerializer),
+    ('manager', Rows.manager, ManagerSerializer, ManagerReadSerializer),
+    ('supplier', Rows.supplier, SupplierSerializer, SupplierReadSerializer),
+    ('cart', Rows.cart, NestedCartReadSerializer, CartReadSerializer),
+    ('sale', Rows.sale, NestedSaleReadSerializer, SaleReadSerializer),
+    ('completed sale', Rows.completed_sale, NestedCompletedSaleReadSerializer, CompletedSaleReadSerializer),
+    ('salesperson branch', Rows.salesperson_branch, NestedSalesPersonBranchSerializer,
+     SimpleSalesPersonBranchSerializer),
+]
+
+
+def render(serializer_class, rows):
+    start = time.perf_counter()
+    content = JSONRenderer().render(serializer_class(rows, many=True).data)
+    return content, time.perf_counter() - start
+
+
+def compare_serializers(count=10000, repeat=3, seed=0, pairs=SERIALIZERS):
+    """
+    Render count rows with the serializers before and after of every pair
+    and return the best per-row cost of each and whether their JSON is identical.
+    """
+    results = {}
+    for name, factory, before, after in pairs:
+        rows_factory = Rows(seed)
+        rows = [factory(rows_factory, i) for i in range(1, count + 1)]
+        before_timings, after_timings = [], []
+        for _ in range(repeat):
+            before_content, elapsed = render(before, rows)
+            before_timings.append(elapsed)
+            after_content, elapsed = render(after, rows)
+            after_timings.append(elapsed)
+        results[name] = {
+            'rows': count,
+            'before_us': round(min(before_timings) / count * 10 ** 6, 2),
+            'after_us': round(min(after_timings) / count * 10 ** 6, 2),
+            'identical': before_content == after_content,
+        }
+    return results
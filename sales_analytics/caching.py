@@ -0,0 +1,186 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .analytics import NAMED_MODELS, invalidate_closed_periods
+
+
+class VersionedCache:
+    """
+    Read-through cache for data derived from a few models.
+
+    Entries are keyed by the current version of every model they depend on,
+    so bumping a model's version makes its entries unreachable instead of
+    deleting them. The versions live in the shared cache (settings.CATALOG_CACHE)
+    and are read on every lookup; the entries themselves are kept in an
+    in-process LRU of settings.CATALOG_LRU_SIZE entries in front of the
+    shared cache. Both expire from the shared cache after
+    settings.CATALOG_CACHE_TIMEOUT seconds, a version that expired starts
+    again from a fresh value.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    @property
+    def shared(self):
+        return caches[getattr(settings, 'CATALOG_CACHE', 'default')]
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60 * 24)
+
+    @staticmethod
+    def version_key(model):
+        return f'catalog-version:{model._meta.label_lower}'
+
+    def versions(self, models):
+        keys = [self.version_key(model) for model in models]
+        versions = self.shared.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                # start from a fresh value, so entries cached before the shared cache was cleared are never reused
+                self.shared.add(key, time.time_ns(), timeout=self.timeout)
+                versions[key] = self.shared.get(key)
+        return [versions[key] for key in keys]
+
+    def bump(self, *models):
+        for model in models:
+            try:
+                self.shared.incr(self.version_key(model))
+            except ValueError:
+                self.shared.add(self.version_key(model), time.time_ns(), timeout=self.timeout)
+
+    def digest(self, models, name):
+        """
+        Identify name at the current versions of models; the digest changes whenever one of them is bumped.
+        """
+        versions = ':'.join(str(version) for version in self.versions(models))
+        return hashlib.md5(f'{versions}:{name}'.encode()).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        value = self.shared.get(key)
+        if value is not None:
+            self.remember(key, value)
+        return value
+
+    def set(self, key, value):
+        self.shared.set(key, value, timeout=self.timeout)
+        self.remember(key, value)
+
+    def remember(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > getattr(settings, 'CATALOG_LRU_SIZE', 512):
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+catalog_cache = VersionedCache()
+
+
+def catalog_changed(model):
+    """
+    Bump the catalog version of model after a write, and drop the cached
+    analytics of closed periods when they show its ids and names.
+    """
+    catalog_cache.bump(model)
+    if model in NAMED_MODELS:
+        invalidate_closed_periods()
+
+# settings naming a cache alias whose versions every worker has to see
+SHARED_CACHE_SETTINGS = ['CATALOG_CACHE', 'ANALYTICS_CACHE']
+
+
+def check_shared_caches(app_configs, **kwargs):
+    warnings = []
+    for name in SHARED_CACHE_SETTINGS:
+        alias = getattr(settings, name, 'default')
+        backend = settings.CACHES.get(alias, {}).get('BACKEND', '')
+        if backend == 'django.core.cache.backends.locmem.LocMemCache':
+            warnings.append(checks.Warning(
+                f'{name} names the cache {alias!r}, which is local to each process',
+                hint='A version bumped in one worker never reaches the others, which keep serving stale entries. '
+                     'Use a FileBasedCache, Redis or Memcached backend for this alias.',
+                id='sales_analytics.W001',
+            ))
+    return warnings
+
+
+class CatalogCacheMixin:
+    """
+    Serves list and retrieve from catalog_cache with an ETag, answering
+    304 Not Modified without touching the database when the client's copy
+    is current. Writes through the viewset are reported to catalog_changed.
+
+    cache_models lists every model the responses depend on, the viewset's
+    own model first.
+    """
+    cache_models = ()
+
+    def cached_response(self, request, render, *args, **kwargs):
+        # the absolute URL, as the next and previous links of a cached page carry the scheme and host
+        digest = catalog_cache.digest(self.cache_models, request.build_absolute_uri())
+        key, etag = f'catalog:{digest}', f'"{digest}"'
+
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        data = catalog_cache.get(key)
+        if data is None:
+            data = render(request, *args, **kwargs).data
+            catalog_cache.set(key, data)
+        return Response(data, headers={'ETag': etag})
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        catalog_changed(self.cache_models[0])
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        catalog_changed(self.cache_models[0])
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        catalog_changed(self.cache_models[0])
+
+
+class CatalogAdminMixin:
+    """
+    Reports every admin write of the model to catalog_changed.
+    """
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        catalog_changed(self.model)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        catalog_changed(self.model)
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        catalog_changed(self.model)
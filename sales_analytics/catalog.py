@@ -0,0 +1,117 @@
+from django.db import connection
+from django.db.models import BooleanField, Case, Count, IntegerField, Q, Subquery, Value, When
+from django.db.models.expressions import RawSQL
+from rest_framework import serializers
+
+from .directory import TERM_RE, MAX_TERMS, prefix_match
+from .models import Product, ProductSearch
+
+
+# lower bounds of the selling price facet buckets, the last one is open ended
+PRICE_BUCKETS = [0, 100, 500, 1000, 5000, 10000]
+
+# facets are left out above this many matching products, counting more is not worth the wait
+FACETS_MAX_MATCHES = 5000
+
+
+class ProductSearchSerializer(serializers.Serializer):
+    """
+    Query parameters of the product list. search matches the start of the
+    words of product_name and serial_number, min_price and max_price bound
+    selling_price inclusively.
+    """
+    search = serializers.CharField(required=False, max_length=100)
+    category = serializers.IntegerField(required=False)
+    branch = serializers.IntegerField(required=False)
+    min_price = serializers.DecimalField(required=False, max_digits=19, decimal_places=4)
+    max_price = serializers.DecimalField(required=False, max_digits=19, decimal_places=4)
+    facets = serializers.BooleanField(required=False, default=False)
+
+    def validate_search(self, value):
+        return TERM_RE.findall(value)[:MAX_TERMS]
+
+    def validate(self, attrs):
+        if 'min_price' in attrs and 'max_price' in attrs and attrs['min_price'] > attrs['max_price']:
+            raise serializers.ValidationError({'message': 'min_price must not be above max_price'})
+        return attrs
+
+
+def search_products(queryset, search=None, **filters):
+    """
+    queryset narrowed down by the search terms and the filters.
+
+    On SQLite a text search returns a ProductSearch queryset instead, read
+    from the product_search FTS5 index in descending product_id order, so a
+    page of a broad search stops at its last row instead of collecting every
+    match first; products() turns its rows into products.
+    """
+    if search and connection.vendor == 'sqlite':
+        matches = ProductSearch.objects.filter(
+            RawSQL('product_search MATCH %s', [prefix_match(search)], output_field=BooleanField()))
+        return filter_products(matches, 'product__', **filters).select_related(
+            'product__branch', 'product__category').order_by('-product_id')
+
+    for term in search or []:
+        queryset = queryset.filter(
+            Q(product_name__istartswith=term) | Q(product_name__icontains=f' {term}') |
+            Q(serial_number__istartswith=term))
+    return filter_products(queryset, '', **filters)
+
+
+def filter_products(queryset, prefix, category=None, branch=None, min_price=None, max_price=None, **kwargs):
+    lookups = {'category_id': category, 'branch_id': branch, 'selling_price__gte': min_price,
+               'selling_price__lte': max_price}
+    return queryset.filter(**{prefix + lookup: value for lookup, value in lookups.items() if value is not None})
+
+
+def products(rows):
+    """
+    The products of a page of search_products rows.
+    """
+    return [row.product if isinstance(row, ProductSearch) else row for row in rows]
+
+
+def price_bucket():
+    return Case(
+        *[When(selling_price__lt=upper, then=Value(index)) for index, upper in enumerate(PRICE_BUCKETS[1:])],
+        default=Value(len(PRICE_BUCKETS) - 1), output_field=IntegerField())
+
+
+def product_facets(queryset, count=None):
+    """
+    Number of products of a search_products queryset per category, branch
+    and selling price bucket, folded from one query grouped by all three.
+
+    None when the queryset matches more than FACETS_MAX_MATCHES products.
+    Unless the caller already counted them, that is found by probing for the
+    match past that many before grouping anything.
+    """
+    matches = queryset.order_by().values('product_id')
+    if count is None:
+        too_many = matches[FACETS_MAX_MATCHES:FACETS_MAX_MATCHES + 1].exists()
+    else:
+        too_many = count > FACETS_MAX_MATCHES
+    if too_many:
+        return None
+    rows = Product.objects.filter(product_id__in=Subquery(matches)).annotate(price_bucket=price_bucket()).values(
+        'category_id', 'category__category_name', 'branch_id', 'branch__branch_name', 'price_bucket'
+        ).annotate(count=Count('product_id'))
+
+    categories, branches, prices = {}, {}, [0] * len(PRICE_BUCKETS)
+    for row in rows:
+        category = categories.setdefault(row['category_id'], {
+            'id': row['category_id'], 'name': row['category__category_name'], 'count': 0})
+        category['count'] += row['count']
+        branch = branches.setdefault(row['branch_id'], {
+            'id': row['branch_id'], 'name': row['branch__branch_name'], 'count': 0})
+        branch['count'] += row['count']
+        prices[row['price_bucket']] += row['count']
+
+    return {
+        'category': sorted(categories.values(), key=lambda facet: -facet['count']),
+        'branch': sorted(branches.values(), key=lambda facet: -facet['count']),
+        'price': [
+            {'min': lower, 'max': PRICE_BUCKETS[index + 1] if index + 1 < len(PRICE_BUCKETS) else None, 'count': count}
+            for index, (lower, count) in enumerate(zip(PRICE_BUCKETS, prices))
+        ],
+    }
@@ -0,0 +1,66 @@
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Sum
+from rest_framework.exceptions import ValidationError
+
+from .models import Sale, CompletedSale, SalesPersonBranch
+from .rollups import record_completed_sale
+
+
+LINE_TOTAL = ExpressionWrapper(
+    F('cart__number_of_items') * F('cart__product__selling_price'),
+    output_field=DecimalField(max_digits=19, decimal_places=4))
+
+
+def open_sales(salesperson_id):
+    # is_completed=0 compiles to NOT is_completed, which SQLite cannot look up in
+    # sale_salesperson_open_idx, while IN (0) can
+    return Sale.objects.filter(salesperson_id=salesperson_id, is_completed__in=[0])
+
+
+def complete_sale(salesperson_id, payment_method_id):
+    """
+    Close every open sale of a salesperson into a single CompletedSale.
+
+    The basket is totalled with one aggregate and the sales are flipped with
+    one bulk update, so the number of queries does not depend on the number
+    of lines in the basket. The same update links the sales to the
+    CompletedSale, which stores their count and points. The update only
+    matches sales still open, so when two checkouts race for the same basket
+    the second one is rolled back instead of completing the sales again.
+    """
+    with transaction.atomic():
+        basket = open_sales(salesperson_id).aggregate(
+            number_of_lines=Count('sale_id'),
+            last_sale_id=Max('sale_id'),
+            total_price=Sum(LINE_TOTAL),
+            awarded_points=Sum('awarded_points'),
+        )
+
+        if not basket['number_of_lines']:
+            raise ValidationError({"message": "Can't complete sale cart is empty"})
+
+        latest_branch = SalesPersonBranch.objects.filter(salesperson_id=salesperson_id) \
+            .order_by('-salesperson_branch_id').values('branch_id').first()
+
+        if latest_branch is None:
+            raise ValidationError({"message": "Salesperson is not assigned to a branch"})
+
+        completed_sale = CompletedSale.objects.create(
+            salesperson_id=int(salesperson_id),
+            branch_id=latest_branch['branch_id'],
+            total_amount=basket['total_price'] or 0,
+            payment_method_id=int(payment_method_id),
+            line_count=basket['number_of_lines'],
+            awarded_points=basket['awarded_points'] or 0,
+        )
+
+        # only flip the lines that were totalled above; the conditional update is the
+        # claim, a concurrent checkout that got to any of them first leaves fewer to flip
+        claimed = open_sales(salesperson_id).filter(sale_id__lte=basket['last_sale_id']).update(
+            is_completed=1, completed_sale=completed_sale)
+        if claimed != basket['number_of_lines']:
+            raise ValidationError({"message": "The cart changed during checkout, please try again"})
+
+        record_completed_sale(completed_sale)
+
+        return completed_sale
@@ -0,0 +1,91 @@
+import hashlib
+
+from django.db.models import Count, Max, OuterRef, Subquery, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .caching import catalog_cache
+from .models import Branch, SalesPersonBranch, CompletedSale, MonthlySales
+
+
+def latest(queryset, field):
+    """
+    Subquery selecting the largest value of field in queryset, read from the end of an index.
+    """
+    return Subquery(queryset.order_by(f'-{field}').values(field)[:1])
+
+
+def summary(queryset, group_by, aggregate):
+    """
+    Subquery of one aggregate over queryset, which must already be filtered on a single group_by value.
+    """
+    return Subquery(queryset.order_by().values(group_by).annotate(value=aggregate).values('value'))
+
+
+# the user columns shown with a profile; djoser, the admin and set_username change them without touching the profile
+USER_FIELDS = ('username', 'email', 'first_name', 'last_name', 'is_superuser', 'is_active', 'is_staff', 'role',
+               'date_joined', 'last_login')
+
+
+def user_state(user):
+    return tuple(getattr(user, field) for field in USER_FIELDS)
+
+
+def with_dashboard_state(salespersons):
+    """
+    Annotate salespersons with what their dashboard is derived from: the
+    latest completed sale and branch assignment and the totals of the monthly
+    rollup, so edited or deleted sales and branch reassignments are noticed too.
+    """
+    completed_sales = CompletedSale.objects.filter(salesperson=OuterRef('pk'))
+    assignments = SalesPersonBranch.objects.filter(salesperson=OuterRef('pk'))
+    rollups = MonthlySales.objects.filter(salesperson=OuterRef('pk'))
+
+    return salespersons.annotate(
+        last_sale=latest(completed_sales, 'completed_at'),
+        last_assignment=latest(assignments, 'assignment_date'),
+        last_termination=summary(assignments, 'salesperson', Max('termination_date')),
+        assignments=summary(assignments, 'salesperson', Count('pk')),
+        rollup_sales=summary(rollups, 'salesperson', Sum('number_of_sales')),
+        rollup_amount=summary(rollups, 'salesperson', Sum('total_amount')),
+        )
+
+
+def salesperson_dashboard_validators(salesperson):
+    """
+    Return (etag, last_modified) of the dashboard of a salesperson read with
+    with_dashboard_state and its user. Branch details shown on it are covered
+    by the catalog version.
+    """
+    moments = (salesperson.updated_at, salesperson.last_sale, salesperson.last_assignment, salesperson.last_termination)
+    state = (salesperson.pk, *moments, salesperson.assignments, salesperson.rollup_sales, salesperson.rollup_amount,
+             *user_state(salesperson.user), *catalog_cache.versions([Branch]))
+    return validators(state, moments)
+
+
+def manager_profile_validators(manager):
+    return validators((manager.pk, manager.updated_at, *user_state(manager.user)), (manager.updated_at,))
+
+
+def validators(state, moments):
+    etag = '"{}"'.format(hashlib.md5(repr(state).encode()).hexdigest())
+    moments = [moment for moment in moments if moment is not None]
+    last_modified = int(max(moments).timestamp()) if moments else None
+    return etag, last_modified
+
+
+def not_modified(request, etag, last_modified):
+    """
+    304 response when the request's If-None-Match matches the ETag, otherwise None.
+
+    If-Modified-Since alone never answers 304: the user row has no timestamp,
+    so Last-Modified misses the edits made to it outside of the profile.
+    """
+    return get_conditional_response(request, etag=etag)
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
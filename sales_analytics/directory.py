@@ -0,0 +1,94 @@
+import re
+
+from django.db import connection
+from django.db.models import CharField, Q, Value
+from rest_framework import serializers
+
+from .models import Customer, SalesPerson, Supervisor, Manager, Supplier
+
+
+# role -> profile model, in the order of the search results of other databases
+PROFILES = {
+    'customer': Customer,
+    'salesperson': SalesPerson,
+    'supervisor': Supervisor,
+    'manager': Manager,
+    'supplier': Supplier,
+}
+
+COLUMNS = ['user_id', 'role', 'profile_id', 'first_name', 'last_name', 'username', 'email', 'phone_number']
+
+TERM_RE = re.compile(r'\w+')
+
+MAX_TERMS = 8
+
+
+class DirectoryQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=100)
+    role = serializers.ChoiceField(choices=list(PROFILES), required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+    def validate_q(self, value):
+        terms = TERM_RE.findall(value)[:MAX_TERMS]
+        if not terms:
+            raise serializers.ValidationError('Enter a name, username, email or phone number')
+        return terms
+
+
+def prefix_match(terms):
+    """
+    FTS5 query matching rows with a word starting with each of the terms.
+    """
+    # quoted, so the terms are never read as FTS5 operators
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_people(terms, role=None, limit=20):
+    """
+    People whose name, username, email or phone number has a word starting
+    with each of the terms, best matches first, as dicts of COLUMNS.
+    """
+    if connection.vendor == 'sqlite':
+        return search_index(terms, role, limit)
+    return search_profiles(terms, role, limit)
+
+
+def search_index(terms, role, limit):
+    """
+    One query against the people_directory FTS5 table, which the triggers of
+    search_indexes.PEOPLE_DIRECTORY keep in sync with core_user and the profile tables.
+    """
+    sql = f'SELECT {", ".join(COLUMNS)} FROM people_directory WHERE people_directory MATCH %s'
+    params = [prefix_match(terms)]
+    if role is not None:
+        sql += ' AND role = %s'
+        params.append(role)
+    sql += ' ORDER BY rank LIMIT %s'
+    params.append(limit)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [dict(zip(COLUMNS, row)) for row in cursor.fetchall()]
+
+
+def search_profiles(terms, role, limit):
+    """
+    The same search as a UNION of prefix lookups on the profile tables, for databases without FTS5.
+    """
+    querysets = []
+    for name, model in PROFILES.items():
+        if role is not None and name != role:
+            continue
+        condition = Q()
+        for term in terms:
+            condition &= (
+                Q(user__first_name__istartswith=term) | Q(user__last_name__istartswith=term) |
+                Q(user__username__istartswith=term) | Q(user__email__istartswith=term) |
+                Q(phone_number__startswith=term)
+            )
+        querysets.append(model.objects.filter(condition).values_list(
+            'user_id', Value(name, output_field=CharField()), model._meta.pk.name, 'user__first_name',
+            'user__last_name', 'user__username', 'user__email', 'phone_number'))
+
+    rows = querysets[0].union(*querysets[1:], all=True) if len(querysets) > 1 else querysets[0]
+    return [dict(zip(COLUMNS, row)) for row in rows[:limit]]
@@ -0,0 +1,112 @@
+import csv
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import CompletedSale
+
+
+# (column in the export, lookup read with values_list)
+COMPLETED_SALE_COLUMNS = [
+    ('sale_id', 'sale_id'),
+    ('completed_at', 'completed_at'),
+    ('total_amount', 'total_amount'),
+    ('currency', 'total_amount_currency'),
+    ('branch_id', 'branch_id'),
+    ('branch_name', 'branch__branch_name'),
+    ('salesperson_id', 'salesperson_id'),
+    ('salesperson_first_name', 'salesperson__user__first_name'),
+    ('salesperson_last_name', 'salesperson__user__last_name'),
+    ('payment_method_id', 'payment_method_id'),
+    ('payment_method', 'payment_method__method_name'),
+]
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class CompletedSaleExportSerializer(serializers.Serializer):
+    """
+    Query parameters of the completed sales export. start and end are
+    inclusive days in the current timezone.
+    """
+    output = serializers.ChoiceField(choices=['csv', 'ndjson'], default='csv')
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    branch = serializers.IntegerField(required=False)
+    salesperson = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        if 'start' in attrs and 'end' in attrs and attrs['start'] > attrs['end']:
+            raise serializers.ValidationError({'message': 'start must not be after end'})
+        return attrs
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time()))
+
+
+def completed_sales_for_export(start=None, end=None, branch=None, salesperson=None):
+    queryset = CompletedSale.objects.all()
+    if start is not None:
+        queryset = queryset.filter(completed_at__gte=day_start(start))
+    if end is not None:
+        queryset = queryset.filter(completed_at__lt=day_start(end + timedelta(days=1)))
+    if branch is not None:
+        queryset = queryset.filter(branch_id=branch)
+    if salesperson is not None:
+        queryset = queryset.filter(salesperson_id=salesperson)
+    return queryset.order_by('completed_at', 'sale_id')
+
+
+def export_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the export columns of every row, fetched chunk_size rows at a time.
+    """
+    lookups = [lookup for _, lookup in COMPLETED_SALE_COLUMNS]
+    for row in queryset.values_list(*lookups).iterator(chunk_size=chunk_size):
+        completed_at = row[1]
+        yield (row[0], timezone.localtime(completed_at).isoformat()) + row[2:]
+
+
+class Echo:
+    """
+    File-like object handing back what csv.writer writes to it.
+    """
+    def write(self, value):
+        return value
+
+
+def csv_stream(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    writer = csv.writer(Echo())
+    yield writer.writerow([column for column, _ in COMPLETED_SALE_COLUMNS])
+
+    lines = []
+    for row in rows:
+        lines.append(writer.writerow(row))
+        if len(lines) == chunk_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def ndjson_stream(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    columns = [column for column, _ in COMPLETED_SALE_COLUMNS]
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(dict(zip(columns, row))) + '\n')
+        if len(lines) == chunk_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+EXPORT_FORMATS = {
+    'csv': (csv_stream, 'text/csv'),
+    'ndjson': (ndjson_stream, 'application/x-ndjson'),
+}
@@ -0,0 +1,64 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+
+# stored responses older than this are purged by purge_idempotency_keys
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+
+
+def request_hash(request):
+    """
+    Fingerprint of the method, path and body of a request, to refuse a key reused for a different request.
+    """
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.md5(f'{request.method}:{request.path}:{body}'.encode()).hexdigest()
+
+
+def idempotent_response(request, key, perform):
+    """
+    Run perform() at most once per user and key and return its response;
+    retries get the stored response back with an Idempotent-Replayed header.
+
+    The key is claimed by inserting its row in the same transaction as the
+    work, so a concurrent retry waits on the unique constraint and replays the
+    response once the first request commits. A request failing with an error
+    rolls the claim back and may be retried.
+    """
+    fingerprint = request_hash(request)
+
+    stored = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+    if stored is None:
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    stored = IdempotencyKey.objects.create(user=request.user, key=key, request_hash=fingerprint)
+            except IntegrityError:
+                stored = None
+
+            if stored is not None:
+                response = perform()
+                stored.status_code, stored.response = response.status_code, response.data
+                stored.save(update_fields=['status_code', 'response'])
+                return response
+
+        stored = IdempotencyKey.objects.get(user=request.user, key=key)
+
+    if stored.request_hash != fingerprint:
+        raise ValidationError({"message": "Idempotency key was already used for a different request"})
+    return Response(stored.response, status=stored.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def purge_idempotency_keys(older_than=IDEMPOTENCY_KEY_TTL):
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=timezone.now() - older_than).delete()
+    return deleted
@@ -0,0 +1,199 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+# a fingerprint seen this many times in one request is reported as an N+1 pattern
+DUPLICATE_THRESHOLD = 3
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def fingerprint(sql):
+    """
+    Reduce a statement to its shape, so queries differing only in their
+    parameters or the length of an IN list are counted together.
+    """
+    return LITERAL_RE.sub('?', IN_LIST_RE.sub('IN (...)', sql))
+
+
+class QueryRecorder:
+    """
+    execute_wrapper counting the statements of one request and the time spent in the database.
+
+    Only the raw SQL is kept per query; fingerprints are computed once per
+    distinct statement when the request is done.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+
+    def duplicates(self):
+        """
+        Return {fingerprint: executions} of the shapes repeated at least DUPLICATE_THRESHOLD times.
+        """
+        shapes = Counter()
+        for sql, executions in self.statements.items():
+            shapes[fingerprint(sql)] += executions
+        return {shape: executions for shape, executions in shapes.items() if executions >= DUPLICATE_THRESHOLD}
+
+
+class ViewStats:
+    """
+    Per-view aggregates of the instrumented requests, kept in the memory of
+    the worker process that served them.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, queries, db_time, total_time, duplicates):
+        with self.lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = {
+                    'requests': 0, 'queries': 0, 'max_queries': 0, 'db_time': 0.0, 'total_time': 0.0,
+                    'duplicate_requests': 0, 'duplicates': Counter(),
+                }
+            stats['requests'] += 1
+            stats['queries'] += queries
+            stats['max_queries'] = max(stats['max_queries'], queries)
+            stats['db_time'] += db_time
+            stats['total_time'] += total_time
+            if duplicates:
+                stats['duplicate_requests'] += 1
+                stats['duplicates'].update(duplicates.keys())
+
+    def snapshot(self):
+        """
+        Return the aggregates as a list of plain dicts, the views spending the most time in the database first.
+        """
+        with self.lock:
+            rows = [
+                {
+                    'view': view,
+                    'requests': stats['requests'],
+                    'queries': stats['queries'],
+                    'avg_queries': round(stats['queries'] / stats['requests'], 2),
+                    'max_queries': stats['max_queries'],
+                    'db_ms': round(stats['db_time'] * 1000, 3),
+                    'avg_db_ms': round(stats['db_time'] * 1000 / stats['requests'], 3),
+                    'avg_total_ms': round(stats['total_time'] * 1000 / stats['requests'], 3),
+                    'duplicate_requests': stats['duplicate_requests'],
+                    'duplicates': [
+                        {'fingerprint': shape, 'requests': requests}
+                        for shape, requests in stats['duplicates'].most_common(5)
+                    ],
+                }
+                for view, stats in self.views.items()
+            ]
+        return sorted(rows, key=lambda row: row['db_ms'], reverse=True)
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+
+view_stats = ViewStats()
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Counts the queries, database time and repeated query shapes of every
+    request, reports them in a log line and adds them to the per-view
+    aggregates served at /users/query-stats/. Staff users, and everyone
+    while DEBUG is on, also get them in a Server-Timing header.
+
+    The body of a streaming response, such as an export, runs its queries
+    after the view returned. Those are recorded while the body is sent, so
+    the log line and the aggregates cover them; the headers are already gone
+    by then, so its Server-Timing header only describes the view.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with recording(recorder):
+            response = self.get_response(request)
+
+        if response.streaming and not getattr(response, 'is_async', False):
+            if shows_timing(request):
+                response['Server-Timing'] = server_timing(
+                    recorder, recorder.duplicates(), time.perf_counter() - start, streamed=True)
+            response.streaming_content = self.measured(response.streaming_content, request, response, recorder, start)
+            return response
+
+        total_time = time.perf_counter() - start
+        duplicates = recorder.duplicates()
+        if shows_timing(request):
+            response['Server-Timing'] = server_timing(recorder, duplicates, total_time)
+        self.report(request, response, recorder, duplicates, total_time)
+        return response
+
+    def measured(self, content, request, response, recorder, start):
+        try:
+            with recording(recorder):
+                yield from content
+        finally:
+            self.report(request, response, recorder, recorder.duplicates(), time.perf_counter() - start)
+
+    def report(self, request, response, recorder, duplicates, total_time):
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unresolved'
+        view_stats.record(view, recorder.count, recorder.duration, total_time, duplicates)
+
+        extra = {
+            'view': view, 'method': request.method, 'path': request.path, 'status': response.status_code,
+            'queries': recorder.count, 'db_ms': round(recorder.duration * 1000, 3),
+            'total_ms': round(total_time * 1000, 3), 'duplicates': duplicates,
+        }
+        logger.info('%s %s %s view=%s queries=%d db_ms=%.1f total_ms=%.1f', request.method, request.path,
+                    response.status_code, view, recorder.count, extra['db_ms'], extra['total_ms'], extra=extra)
+        for shape, executions in duplicates.items():
+            logger.warning('%s %s ran %d times: %s', request.method, request.path, executions, shape, extra=extra)
+
+
+@contextmanager
+def recording(recorder):
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield
+
+
+def shows_timing(request):
+    # the query counts and database time tell outsiders which requests are expensive
+    user = getattr(request, 'user', None)
+    return settings.DEBUG or bool(user is not None and user.is_staff)
+
+
+def server_timing(recorder, duplicates, total_time, streamed=False):
+    metrics = [
+        f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries"',
+        f'dup;desc="{sum(duplicates.values())} repeated queries"',
+        f'total;dur={total_time * 1000:.1f}',
+    ]
+    if streamed:
+        metrics.append('stream;desc="body not included, see the query stats"')
+    return ', '.join(metrics)
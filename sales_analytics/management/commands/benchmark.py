@@ -0,0 +1,63 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from sales_analytics.benchmark import LATENCY_MIN_ITERATIONS, run, check_budget, budget_from
+
+
+class Command(BaseCommand):
+    help = ('Seed a synthetic dataset in a throwaway database, drive every sales_analytics route '
+            'and report latency percentiles and query counts per endpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=1, help='Multiplier for the size of the synthetic dataset')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per endpoint')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic dataset')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--budget', help='Fail when an endpoint exceeds the limits in this JSON file')
+        parser.add_argument('--update-budget', action='store_true', help='Rewrite the --budget file from this run')
+
+    def handle(self, *args, **options):
+        if options['update_budget'] and options['iterations'] < LATENCY_MIN_ITERATIONS:
+            raise CommandError(f'--update-budget needs at least {LATENCY_MIN_ITERATIONS} iterations')
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = run(scale=options['scale'], iterations=options['iterations'], seed=options['seed'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for name, result in results['endpoints'].items():
+            self.stdout.write(
+                f'{result["method"]:4} {name:35} {result["status"]} p50={result["p50_ms"]:.1f}ms '
+                f'p90={result["p90_ms"]:.1f}ms p99={result["p99_ms"]:.1f}ms queries={result["queries"]}')
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2) + '\n')
+
+        if not options['budget']:
+            return
+
+        budget_file = Path(options['budget'])
+        if options['update_budget']:
+            budget = budget_from(results)
+            budget_file.write_text(json.dumps(budget, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Wrote budget to {budget_file}'))
+            failing = sorted(set(results['endpoints']) - set(budget))
+            if failing:
+                self.stdout.write(self.style.WARNING('Left out the endpoints answering an error: ' + ', '.join(failing)))
+            return
+
+        regressions = check_budget(results, json.loads(budget_file.read_text()))
+        if regressions:
+            raise CommandError('Budget exceeded:\n' + '\n'.join(regressions))
+        if options['iterations'] < LATENCY_MIN_ITERATIONS:
+            self.stdout.write(self.style.WARNING(
+                f'Latency is reported but not checked below {LATENCY_MIN_ITERATIONS} iterations'))
+        self.stdout.write(self.style.SUCCESS('All endpoints within budget'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sales_analytics.benchmark import compare_serializers
+
+
+class Command(BaseCommand):
+    help = ('Compare the per-row cost of the nested and the flat read serializers '
+            'and check that both render the same JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Rows rendered per serializer')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per serializer, the fastest is kept')
+
+    def handle(self, *args, **options):
+        results = compare_serializers(count=options['rows'], repeat=options['repeat'])
+
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:20} before={result["before_us"]:.1f}us/row after={result["after_us"]:.1f}us/row '
+                f'speedup={result["before_us"] / result["after_us"]:.1f}x identical={result["identical"]}')
+
+        different = [name for name, result in results.items() if not result['identical']]
+        if different:
+            raise CommandError(f'Flat serializers render different JSON for: {", ".join(different)}')
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sales_analytics.analytics import invalidate_closed_periods
+from sales_analytics.caching import catalog_cache
+from sales_analytics.models import Branch, ProductCategory, Product, PaymentMethod
+from sales_analytics.rollups import rebuild_monthly_sales
+from sales_analytics.seed import SeedError, load_seed
+
+
+class Command(BaseCommand):
+    help = 'Bulk load the SQL fixtures in data/, optionally scaled up to rehearse larger datasets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=['data'], help='Fixture files or directories of .sql files')
+        parser.add_argument('--scale', type=int, default=1, help='Number of disjoint copies of the fixtures to insert')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT batch')
+        parser.add_argument('--flush', action='store_true', help='Delete existing rows of the seeded tables first, and the users the seed replaces')
+
+    def handle(self, *args, **options):
+        if options['scale'] < 1:
+            raise CommandError('--scale must be at least 1')
+
+        try:
+            inserted, report = load_seed(
+                options['paths'], scale=options['scale'], batch_size=options['batch_size'], flush=options['flush'])
+        except SeedError as exc:
+            raise CommandError(exc)
+
+        rebuild_monthly_sales()
+        invalidate_closed_periods()
+        catalog_cache.bump(Branch, ProductCategory, Product, PaymentMethod)
+
+        for message, count in sorted(report.items()):
+            self.stdout.write(f'{message}: {count}')
+        for table, count in inserted.items():
+            self.stdout.write(f'{table}: {count} rows')
+        self.stdout.write(self.style.SUCCESS(f'Loaded {sum(inserted.values())} rows'))
@@ -0,0 +1,26 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales_analytics.onboarding import ROLES, onboard, read_csv
+
+
+class Command(BaseCommand):
+    help = 'Create the users and profiles of one role from a CSV or JSON file of rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('role', choices=list(ROLES), help='Role of every row')
+        parser.add_argument('path', help='CSV file with a header line, or JSON list of rows')
+        parser.add_argument('--workers', type=int, help='Processes hashing the passwords, one per CPU by default')
+
+    def handle(self, *args, **options):
+        with open(options['path'], encoding='utf-8', newline='') as file:
+            rows = json.load(file) if options['path'].endswith('.json') else read_csv(file)
+
+        profiles, errors = onboard(options['role'], rows, hash_workers=options['workers'])
+        if errors:
+            for error in errors:
+                self.stderr.write(f'row {error["row"] + 1}: {json.dumps(error["errors"])}')
+            raise CommandError(f'{len(errors)} invalid rows, nothing was created')
+
+        self.stdout.write(self.style.SUCCESS(f'Created {len(profiles)} {options["role"]} accounts'))
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from sales_analytics.idempotency import IDEMPOTENCY_KEY_TTL, purge_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = 'Delete the stored responses of idempotent requests older than the retry window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=IDEMPOTENCY_KEY_TTL.total_seconds() / 3600,
+                            help='Keep the responses of the last hours')
+
+    def handle(self, *args, **options):
+        deleted = purge_idempotency_keys(timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} idempotency keys'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from sales_analytics.rollups import rebuild_monthly_sales
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly sales rollup from the completed sales history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--salesperson', type=int, help='Only rebuild the rollup of this salesperson')
+
+    def handle(self, *args, **options):
+        rows = rebuild_monthly_sales(salesperson_id=options['salesperson'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} monthly sales rows'))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sales_analytics.outbox import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Send the templated emails waiting in the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Emails sent per SMTP connection')
+        parser.add_argument('--max-attempts', type=int, default=5, help='Attempts before an email is marked as failed')
+        parser.add_argument('--retry-delay', type=int, default=60, help='Seconds before the first retry, doubled on each attempt')
+        parser.add_argument('--lease', type=int, default=300,
+                            help='Seconds a batch stays claimed by this worker before another one may retry it')
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox instead of exiting when it is drained')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait between polls with --loop')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            sent = send_queued_emails(
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+                retry_delay=options['retry_delay'],
+                lease=options['lease'],
+            )
+            total += sent
+
+            if sent:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Sent {total} emails'))
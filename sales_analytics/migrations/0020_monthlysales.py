@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:09
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractYear, ExtractMonth
+import django.db.models.deletion
+
+
+def populate_monthly_sales(apps, schema_editor):
+    CompletedSale = apps.get_model('sales_analytics', 'CompletedSale')
+    MonthlySales = apps.get_model('sales_analytics', 'MonthlySales')
+
+    rows = CompletedSale.objects.filter(salesperson__isnull=False).annotate(
+        year=ExtractYear('completed_at'),
+        month=ExtractMonth('completed_at')
+        ).values(
+        'salesperson_id', 'branch_id', 'year', 'month'
+        ).annotate(
+        number_of_sales=Count('sale_id'),
+        total_amount=Sum('total_amount')
+        ).order_by()
+
+    MonthlySales.objects.bulk_create([MonthlySales(**row) for row in rows], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_analytics', '0019_add_payment_method_to_completed_sale'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySales',
+            fields=[
+                ('monthly_sales_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField()),
+                ('number_of_sales', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=4, default=0, max_digits=19)),
+                ('branch', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='sales_analytics.branch')),
+                ('salesperson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sales_analytics.salesperson')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='monthlysales',
+            constraint=models.UniqueConstraint(fields=('salesperson', 'branch', 'year', 'month'), name='unique_monthly_sales'),
+        ),
+        migrations.RunPython(populate_monthly_sales, migrations.RunPython.noop),
+    ]
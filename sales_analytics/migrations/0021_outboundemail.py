@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:11
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_analytics', '0020_monthlysales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundEmail',
+            fields=[
+                ('outbound_email_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('template_name', models.CharField(max_length=50)),
+                ('from_email', models.CharField(max_length=50)),
+                ('recipient_list', models.JSONField()),
+                ('context', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:13
+
+from django.db import migrations, models
+import sales_analytics.models
+
+
+def deduplicate_transaction_ids(apps, schema_editor):
+    """
+    Give a fresh id to every sale with a blank transaction id or one already
+    used by an earlier sale.
+    """
+    Sale = apps.get_model('sales_analytics', 'Sale')
+
+    taken = set(Sale.objects.values_list('transaction_id', flat=True))
+    seen = set()
+    renamed = []
+    for sale in Sale.objects.order_by('sale_id').only('sale_id', 'transaction_id').iterator(chunk_size=2000):
+        if not sale.transaction_id or sale.transaction_id in seen:
+            transaction_id = sales_analytics.models.generate_transaction_id()
+            while transaction_id in taken:
+                transaction_id = sales_analytics.models.generate_transaction_id()
+            sale.transaction_id = transaction_id
+            taken.add(transaction_id)
+            renamed.append(sale)
+        seen.add(sale.transaction_id)
+
+    Sale.objects.bulk_update(renamed, ['transaction_id'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_analytics', '0021_outboundemail'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_transaction_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='sale',
+            name='transaction_id',
+            field=models.CharField(blank=True, default=sales_analytics.models.generate_transaction_id, max_length=20, unique=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_analytics', '0022_unique_sale_transaction_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['customer', 'cart_id'], name='cart_customer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='completedsale',
+            index=models.Index(fields=['salesperson', 'completed_at'], name='completedsale_salesperson_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['branch', 'category'], name='product_branch_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['salesperson', 'is_completed', 'transaction_date'], name='sale_salesperson_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salespersonbranch',
+            index=models.Index(fields=['salesperson', 'assignment_date'], name='spb_salesperson_assigned_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_analytics', '0023_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='completedsale',
+            index=models.Index(fields=['completed_at', 'sale_id'], name='completedsale_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['salesperson', 'transaction_date', 'sale_id'], name='sale_salesperson_keyset_idx'),
+        ),
+    ]
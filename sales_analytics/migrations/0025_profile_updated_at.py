@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_analytics', '0024_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='manager',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='salesperson',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
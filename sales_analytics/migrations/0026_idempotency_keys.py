@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:37
+
+from django.conf import settings
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('sales_analytics', '0025_profile_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('idempotency_key_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('key', models.CharField(max_length=255)),
+                ('request_hash', models.CharField(max_length=32)),
+                ('status_code', models.IntegerField(null=True)),
+                ('response', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='idempotency_key_created_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencykey',
+            constraint=models.UniqueConstraint(fields=('user', 'key'), name='unique_idempotency_key'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_analytics', '0026_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='completedsale',
+            name='awarded_points',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='completedsale',
+            name='line_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='completed_sale',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='lines', to='sales_analytics.completedsale'),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations
+
+from sales_analytics.search_indexes import PEOPLE_DIRECTORY, run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_alter_user_role'),
+        ('sales_analytics', '0027_completed_sale_lines'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(PEOPLE_DIRECTORY.forward()), run(PEOPLE_DIRECTORY.backward())),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+from sales_analytics.search_indexes import PRODUCT_SEARCH, run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_analytics', '0028_people_directory'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['selling_price'], name='product_price_idx'),
+        ),
+        migrations.RunPython(run(PRODUCT_SEARCH.forward()), run(PRODUCT_SEARCH.backward())),
+    ]
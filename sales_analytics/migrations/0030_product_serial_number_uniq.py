@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+def check_duplicate_serials(apps, schema_editor):
+    # fail with the offending serial numbers instead of a bare IntegrityError
+    Product = apps.get_model('sales_analytics', 'Product')
+    duplicates = list(Product.objects.filter(is_serialized=True, serial_number__isnull=False)
+                      .values('serial_number').annotate(count=models.Count('product_id'))
+                      .filter(count__gt=1).values_list('serial_number', flat=True)[:20])
+    if duplicates:
+        raise RuntimeError(
+            'Serialized products share serial numbers, resolve them before migrating: ' + ', '.join(duplicates))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_analytics', '0029_product_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_serials, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_serialized', True)),
+                                               fields=('serial_number',), name='product_serial_number_uniq'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_analytics', '0030_product_serial_number_uniq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearch',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to='sales_analytics.product')),
+                ('product_name', models.CharField(max_length=50)),
+                ('serial_number', models.CharField(max_length=50, null=True)),
+            ],
+            options={
+                'db_table': 'product_search',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_analytics', '0031_product_search_model'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboundemail',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+    ]
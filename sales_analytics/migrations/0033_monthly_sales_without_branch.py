@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:17
+
+from django.db import migrations, models
+
+
+def merge_rollups_without_branch(apps, schema_editor):
+    # NULL branches never clashed before, so the rollup may hold several rows for one month
+    MonthlySales = apps.get_model('sales_analytics', 'MonthlySales')
+    duplicates = (MonthlySales.objects.filter(branch__isnull=True)
+                  .values('salesperson_id', 'year', 'month')
+                  .annotate(count=models.Count('monthly_sales_id'), number_of_sales=models.Sum('number_of_sales'),
+                            total_amount=models.Sum('total_amount'), keep=models.Min('monthly_sales_id'))
+                  .filter(count__gt=1))
+    for row in duplicates:
+        MonthlySales.objects.filter(
+            branch__isnull=True, salesperson_id=row['salesperson_id'], year=row['year'], month=row['month']
+            ).exclude(pk=row['keep']).delete()
+        MonthlySales.objects.filter(pk=row['keep']).update(
+            number_of_sales=row['number_of_sales'], total_amount=row['total_amount'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_analytics', '0032_outbound_email_sending'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_rollups_without_branch, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='monthlysales',
+            constraint=models.UniqueConstraint(condition=models.Q(('branch__isnull', True)),
+                                               fields=('salesperson', 'year', 'month'),
+                                               name='unique_monthly_sales_without_branch'),
+        ),
+    ]
@@ -1,8 +1,13 @@
-import random
+import os
+import secrets
 import string
+import threading
+import time
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 from djmoney.models.fields import MoneyField
 
 
@@ -25,6 +30,7 @@ class SalesPerson(models.Model):
     phone_number = models.CharField(max_length=15)
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self) -> str:
         return f"{self.user.first_name} {self.user.last_name}"
@@ -45,6 +51,7 @@ class Manager(models.Model):
     phone_number = models.CharField(max_length=15)
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self) -> str:
         return f"{self.user.first_name} {self.user.last_name}"
@@ -81,6 +88,11 @@ class SalesPersonBranch(models.Model):
     assignment_date = models.DateTimeField(auto_now_add=True)
     termination_date = models.DateTimeField(null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['salesperson', 'assignment_date'], name='spb_salesperson_assigned_idx'),
+        ]
+
 
 class ProductCategory(models.Model):
     category_id = models.BigAutoField(primary_key=True)
@@ -104,10 +116,36 @@ class Product(models.Model):
     branch = models.ForeignKey(
         Branch, on_delete=models.SET_NULL, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['branch', 'category'], name='product_branch_category_idx'),
+            models.Index(fields=['selling_price'], name='product_price_idx'),
+        ]
+        constraints = [
+            # a serial number identifies one physical item, so it can be sold only once
+            models.UniqueConstraint(fields=['serial_number'], condition=models.Q(is_serialized=True),
+                                    name='product_serial_number_uniq'),
+        ]
+
     def __str__(self) -> str:
         return self.product_name
 
 
+class ProductSearch(models.Model):
+    """
+    A row of the product_search FTS5 index that search_indexes keeps on
+    SQLite, whose rowid is the product_id of the product it indexes.
+    """
+    product = models.OneToOneField(
+        Product, primary_key=True, db_column='rowid', on_delete=models.DO_NOTHING, related_name='+')
+    product_name = models.CharField(max_length=50)
+    serial_number = models.CharField(max_length=50, null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'product_search'
+
+
 class PaymentMethod(models.Model):
     payment_method_id = models.BigAutoField(primary_key=True)
     method_name = models.CharField(max_length=50)
@@ -116,6 +154,18 @@ class PaymentMethod(models.Model):
         return self.method_name
 
 
+class CartQuerySet(models.QuerySet):
+    line_total = models.ExpressionWrapper(
+        models.F('number_of_items') * models.F('product__selling_price'),
+        output_field=models.DecimalField(max_digits=19, decimal_places=4))
+
+    def with_total_price(self):
+        return self.annotate(total_price=self.line_total)
+
+    def total_price(self):
+        return self.aggregate(price=models.Sum(self.line_total))['price'] or 0
+
+
 class Cart(models.Model):
     cart_id = models.BigAutoField(primary_key=True)
     number_of_items = models.IntegerField()
@@ -124,25 +174,121 @@ class Cart(models.Model):
     customer = models.ForeignKey(
         Customer, on_delete=models.SET_NULL, null=True)
 
+    objects = CartQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'cart_id'], name='cart_customer_idx'),
+        ]
+
     def __str__(self) -> str:
         return str(self.cart_id)
 
 
+class TransactionIdGenerator:
+    """
+    Builds CWT transaction ids of the form CWT + 7 digit minute + 4 letter node + 5 digit sequence.
+
+    The minute counts from TRANSACTION_ID_EPOCH so ids sort roughly by time, the
+    node is picked at random per process and the sequence is unique within a
+    minute of that process. When a process runs out of sequence numbers in a
+    minute it borrows the next minute rather than reuse an id. Two processes
+    may still draw the same node, so inserts retry with a fresh id when the
+    unique index rejects theirs.
+    """
+    EPOCH = 1672531200  # 2023-01-01T00:00:00Z
+    MAX_SEQUENCE = 100000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._node = ''.join(secrets.choice(string.ascii_uppercase) for _ in range(4))
+        self._minute = -1
+        self._sequence = 0
+
+    def __call__(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+
+            minute = max(int(time.time() - self.EPOCH) // 60, self._minute)
+            if minute == self._minute:
+                self._sequence += 1
+                if self._sequence == self.MAX_SEQUENCE:
+                    minute += 1
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._minute = minute
+
+            return f'CWT{minute:07d}{self._node}{self._sequence:05d}'
+
+
+_transaction_id_generator = TransactionIdGenerator()
+
+
+def generate_transaction_id():
+    return _transaction_id_generator()
+
+
+# inserts given up after this many transaction id clashes in a row
+TRANSACTION_ID_ATTEMPTS = 5
+
+
+def retry_transaction_id_clashes(insert, sales):
+    """
+    Run insert in a savepoint, giving sales fresh transaction ids when it
+    clashes with an id another process generated.
+    """
+    for attempt in range(TRANSACTION_ID_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return insert()
+        except IntegrityError as exc:
+            if attempt + 1 == TRANSACTION_ID_ATTEMPTS or 'transaction_id' not in str(exc):
+                raise
+            for sale in sales:
+                sale.transaction_id = generate_transaction_id()
+
+
+class SaleQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        return retry_transaction_id_clashes(lambda: super(SaleQuerySet, self).bulk_create(objs, *args, **kwargs), objs)
+
+
 class Sale(models.Model):
     sale_id = models.BigAutoField(primary_key=True)
     transaction_date = models.DateTimeField(auto_now_add=True)
     awarded_points = models.IntegerField()
-    transaction_id = models.CharField(max_length=20, blank=True)
+    transaction_id = models.CharField(
+        max_length=20, blank=True, unique=True, default=generate_transaction_id)
     salesperson = models.ForeignKey(
         SalesPerson, on_delete=models.SET_NULL, null=True)
     cart = models.ForeignKey(
         Cart, on_delete=models.SET_NULL, null=True)
     is_completed = models.BooleanField(default=0)
+    completed_sale = models.ForeignKey(
+        'CompletedSale', on_delete=models.SET_NULL, null=True, related_name='lines')
+
+    objects = SaleQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['salesperson', 'is_completed', 'transaction_date'], name='sale_salesperson_open_idx'),
+            models.Index(fields=['salesperson', 'transaction_date', 'sale_id'], name='sale_salesperson_keyset_idx'),
+        ]
 
     def save(self, *args, **kwargs):
        if not self.transaction_id:
-           self.transaction_id = 'CWT' + ''.join(random.choices(string.digits, k=7)) + ''.join(random.choices(string.ascii_uppercase, k=4)) + ''.join(random.choices(string.digits, k=5))
-       super(Sale, self).save(*args, **kwargs)
+           self.transaction_id = generate_transaction_id()
+       if not self._state.adding:
+           return super(Sale, self).save(*args, **kwargs)
+       # transaction ids are assigned by the server, a clash is never the client's
+       retry_transaction_id_clashes(lambda: super(Sale, self).save(*args, **kwargs), [self])
 
 
 class CompletedSale(models.Model):
@@ -155,4 +301,93 @@ class CompletedSale(models.Model):
     salesperson = models.ForeignKey(
         SalesPerson, on_delete=models.SET_NULL, null=True)
     payment_method = models.ForeignKey(
-        PaymentMethod, on_delete=models.SET_NULL, null=True)
\ No newline at end of file
+        PaymentMethod, on_delete=models.SET_NULL, null=True)
+    # totals of the lines, stored when the sale is completed
+    line_count = models.IntegerField(default=0)
+    awarded_points = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['salesperson', 'completed_at'], name='completedsale_salesperson_idx'),
+            models.Index(fields=['completed_at', 'sale_id'], name='completedsale_keyset_idx'),
+        ]
+
+
+class MonthlySales(models.Model):
+    """
+    Completed sales of a salesperson rolled up per branch and calendar month.
+    """
+    monthly_sales_id = models.BigAutoField(primary_key=True)
+    salesperson = models.ForeignKey(SalesPerson, on_delete=models.CASCADE)
+    branch = models.ForeignKey(
+        Branch, on_delete=models.SET_NULL, null=True)
+    year = models.IntegerField()
+    month = models.IntegerField()
+    number_of_sales = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=19, decimal_places=4, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['salesperson', 'branch', 'year', 'month'], name='unique_monthly_sales'),
+            # NULLs are distinct in the constraint above, so sales of deleted branches need their own
+            models.UniqueConstraint(
+                fields=['salesperson', 'year', 'month'], condition=models.Q(branch__isnull=True),
+                name='unique_monthly_sales_without_branch'),
+        ]
+
+
+class OutboundEmail(models.Model):
+    """
+    Templated email waiting to be sent by the send_queued_emails worker.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    outbound_email_id = models.BigAutoField(primary_key=True)
+    template_name = models.CharField(max_length=50)
+    from_email = models.CharField(max_length=50)
+    recipient_list = models.JSONField()
+    context = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_due_idx'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """
+    Response of a request sent with an Idempotency-Key header, replayed when
+    the client retries with the same key.
+    """
+    idempotency_key_id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=32)
+    status_code = models.IntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_key_created_idx'),
+        ]
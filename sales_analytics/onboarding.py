@@ -0,0 +1,197 @@
+import codecs
+import csv
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from rest_framework import serializers
+from rest_framework.parsers import BaseParser
+
+from .models import Customer, SalesPerson, Manager, Supplier
+from .passwords import hash_passwords
+
+
+User = get_user_model()
+
+# rows looked up per query when checking for existing usernames and KRA pins
+LOOKUP_CHUNK_SIZE = 500
+
+
+class OnboardingRowSerializer(serializers.Serializer):
+    """
+    One person to onboard. password is hashed with the configured hasher,
+    password_hash is stored as given; without either the account gets an
+    unusable password and has to go through the password reset.
+    """
+    email = serializers.EmailField(max_length=50)
+    first_name = serializers.CharField(max_length=150)
+    last_name = serializers.CharField(max_length=150)
+    password = serializers.CharField(required=False, allow_blank=True, trim_whitespace=False)
+    password_hash = serializers.CharField(required=False, allow_blank=True)
+    phone_number = serializers.CharField(max_length=15)
+
+    def validate_password_hash(self, value):
+        if value:
+            try:
+                identify_hasher(value)
+            except ValueError:
+                raise serializers.ValidationError('Unknown password hash format')
+        return value
+
+    def validate(self, attrs):
+        if attrs.get('password') and attrs.get('password_hash'):
+            raise serializers.ValidationError({'message': 'Give either password or password_hash'})
+        if attrs.get('password'):
+            user = User(username=self.username(attrs), email=attrs.get('email'),
+                        first_name=attrs['first_name'], last_name=attrs['last_name'])
+            try:
+                validate_password(attrs['password'], user)
+            except DjangoValidationError as exc:
+                raise serializers.ValidationError({'password': list(exc.messages)})
+        return attrs
+
+    @staticmethod
+    def username(attrs):
+        return attrs['email']
+
+
+class SalesPersonRowSerializer(OnboardingRowSerializer):
+    pass
+
+
+class ManagerRowSerializer(OnboardingRowSerializer):
+    pass
+
+
+class SupplierRowSerializer(OnboardingRowSerializer):
+    kra_pin = serializers.CharField(max_length=20)
+    contact_person = serializers.CharField(max_length=15)
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+
+
+class CustomerRowSerializer(OnboardingRowSerializer):
+    email = serializers.EmailField(max_length=50, required=False, allow_null=True, default=None)
+    kra_pin = serializers.CharField(max_length=20)
+    contact_person = serializers.CharField(max_length=15)
+    address = serializers.CharField(max_length=200)
+
+    @staticmethod
+    def username(attrs):
+        return attrs['phone_number']
+
+
+# role -> (profile model, row serializer)
+ROLES = {
+    User.SALESPERSON: (SalesPerson, SalesPersonRowSerializer),
+    User.MANAGER: (Manager, ManagerRowSerializer),
+    User.SUPPLIER: (Supplier, SupplierRowSerializer),
+    User.CUSTOMER: (Customer, CustomerRowSerializer),
+}
+
+
+def existing(model, field, values):
+    """
+    The values of field already taken in model, looked up LOOKUP_CHUNK_SIZE at a time.
+    """
+    values = list(values)
+    taken = set()
+    for start in range(0, len(values), LOOKUP_CHUNK_SIZE):
+        chunk = values[start:start + LOOKUP_CHUNK_SIZE]
+        taken.update(model.objects.filter(**{f'{field}__in': chunk}).values_list(field, flat=True))
+    return taken
+
+
+def add_error(errors, row, field, message):
+    errors.setdefault(row, {}).setdefault(field, []).append(message)
+
+
+def validate_rows(role, rows):
+    """
+    Validate every row, including the uniqueness of usernames and KRA pins
+    against the database and the other rows. Return (validated rows, {row index: errors}).
+    """
+    _, row_serializer = ROLES[role]
+    validated, errors = [], {}
+    for index, row in enumerate(rows):
+        serializer = row_serializer(data=row)
+        if serializer.is_valid():
+            validated.append((index, serializer.validated_data))
+        else:
+            errors[index] = serializer.errors
+
+    unique = [('username', User, 'username', row_serializer.username)]
+    if 'kra_pin' in row_serializer._declared_fields:
+        unique.append(('kra_pin', ROLES[role][0], 'kra_pin', lambda attrs: attrs['kra_pin']))
+
+    for field, model, column, value_of in unique:
+        taken = existing(model, column, {value_of(attrs) for _, attrs in validated})
+        seen = set()
+        for index, attrs in validated:
+            value = value_of(attrs)
+            if value in taken:
+                add_error(errors, index, field, f'{value} is already registered')
+            elif value in seen:
+                add_error(errors, index, field, f'{value} appears more than once')
+            seen.add(value)
+
+    return [attrs for index, attrs in validated if index not in errors], errors
+
+
+def onboard(role, rows, hash_workers=None):
+    """
+    Create the users and profiles of rows in one transaction, with one
+    bulk insert for the users and one for the profiles.
+
+    Return (created profiles, [{'row': row index, 'errors': ...}]); nothing is created when any row is invalid.
+    """
+    profile_model, _ = ROLES[role]
+    validated, errors = validate_rows(role, rows)
+    if errors:
+        return [], [{'row': index, 'errors': errors[index]} for index in sorted(errors)]
+
+    to_hash = [attrs['password'] for attrs in validated if attrs.get('password')]
+    hashes = iter(hash_passwords(to_hash, workers=hash_workers))
+
+    users, profiles = [], []
+    for attrs in validated:
+        attrs = dict(attrs)
+        password, password_hash = attrs.pop('password', ''), attrs.pop('password_hash', '')
+        if password:
+            password_hash = next(hashes)
+        elif not password_hash:
+            password_hash = make_password(None)
+
+        users.append(User(
+            username=ROLES[role][1].username(attrs), email=attrs.pop('email'), first_name=attrs.pop('first_name'),
+            last_name=attrs.pop('last_name'), password=password_hash, role=role, is_active=True))
+        profiles.append(profile_model(**attrs))
+
+    with transaction.atomic():
+        users = User.objects.bulk_create(users, batch_size=LOOKUP_CHUNK_SIZE)
+        if users and users[0].pk is None:
+            # backends that cannot return the ids of bulk inserted rows
+            usernames = [user.username for user in users]
+            ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'pk'))
+            for user in users:
+                user.pk = ids[user.username]
+        for user, profile in zip(users, profiles):
+            profile.user = user
+        profiles = profile_model.objects.bulk_create(profiles, batch_size=LOOKUP_CHUNK_SIZE)
+    return profiles, []
+
+
+def read_csv(stream):
+    """
+    Rows of a CSV file with a header line, blank cells left out so they count as missing.
+    """
+    return [{key: value for key, value in row.items() if value not in ('', None)} for row in csv.DictReader(stream)]
+
+
+class CSVParser(BaseParser):
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        return read_csv(codecs.getreader(encoding)(stream))
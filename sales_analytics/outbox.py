@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.formats import date_format
+from templated_email import get_templated_mail
+
+from .models import OutboundEmail
+
+
+def serialize_context(context):
+    # render datetimes the way the template would, so the stored context stays plain JSON
+    return {
+        key: date_format(timezone.localtime(value), 'DATETIME_FORMAT') if isinstance(value, datetime) else value
+        for key, value in context.items()
+    }
+
+
+def queue_templated_mail(template_name, from_email, recipient_list, context):
+    """
+    Store a templated email in the outbox instead of sending it inline.
+
+    Called inside the caller's transaction, the email is only queued when the
+    surrounding writes are committed.
+    """
+    return OutboundEmail.objects.create(
+        template_name=template_name,
+        from_email=from_email,
+        recipient_list=list(recipient_list),
+        context=serialize_context(context),
+    )
+
+
+def claim_due_emails(batch_size, lease=300):
+    """
+    Mark a batch of due emails as sending, leased to this worker for lease seconds.
+
+    The rows are marked inside the transaction that locked them, so another
+    worker skips them after the commit as well. Emails of a worker that died
+    while sending are claimed again once their lease runs out.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[OutboundEmail.PENDING, OutboundEmail.SENDING], next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'outbound_email_id')[:batch_size]
+        )
+        leased_until = now + timedelta(seconds=lease)
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            status=OutboundEmail.SENDING, next_attempt_at=leased_until, attempts=F('attempts') + 1)
+    for email in emails:
+        email.status, email.next_attempt_at, email.attempts = OutboundEmail.SENDING, leased_until, email.attempts + 1
+    return emails
+
+
+def record_failure(email, exc, max_attempts, retry_delay):
+    email.last_error = str(exc)
+    if email.attempts >= max_attempts:
+        email.status = OutboundEmail.FAILED
+    else:
+        email.status = OutboundEmail.PENDING
+        email.next_attempt_at = timezone.now() + timedelta(seconds=retry_delay * 2 ** (email.attempts - 1))
+
+
+def send_queued_emails(batch_size=100, max_attempts=5, retry_delay=60, lease=300):
+    """
+    Send one batch of due emails over a single SMTP connection.
+
+    Failed emails, including those of a batch whose connection could not be
+    opened, are retried with an exponential backoff and marked as failed
+    after max_attempts. Returns the number of emails sent.
+    """
+    emails = claim_due_emails(batch_size, lease)
+    if not emails:
+        return 0
+
+    sent = 0
+    try:
+        connection = get_connection()
+        connection.open()
+    except Exception as exc:
+        for email in emails:
+            record_failure(email, exc, max_attempts, retry_delay)
+    else:
+        with connection:
+            for email in emails:
+                try:
+                    message = get_templated_mail(
+                        template_name=email.template_name,
+                        context=email.context,
+                        from_email=email.from_email,
+                        to=email.recipient_list,
+                    )
+                    message.connection = connection
+                    message.send()
+                except Exception as exc:
+                    record_failure(email, exc, max_attempts, retry_delay)
+                else:
+                    email.status = OutboundEmail.SENT
+                    email.sent_at = timezone.now()
+                    email.last_error = ''
+                    sent += 1
+
+    OutboundEmail.objects.bulk_update(
+        emails, ['status', 'last_error', 'next_attempt_at', 'sent_at'])
+
+    return sent
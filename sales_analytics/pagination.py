@@ -0,0 +1,129 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Page number pagination, or keyset pagination when the request carries a
+    cursor parameter (empty for the first page) or the view sets keyset_only
+    for requests whose rows cost too much to count.
+
+    Keyset pages filter on the position of the last row seen instead of
+    counting rows and skipping an OFFSET, so every page costs the same.
+    The view's keyset_ordering is used, with the primary key appended as a
+    tiebreaker when it is not already part of it.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    keyset = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params and not getattr(view, 'keyset_only', False):
+            self.keyset = False
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        self.display_page_controls = False
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset, view)
+        self.fields = [queryset.model._meta.get_field(name) for name, _ in self.ordering]
+
+        position, reverse = self.decode_cursor(request)
+
+        ordering = [(name, descending != reverse) for name, descending in self.ordering]
+        queryset = queryset.order_by(*[f'-{name}' if descending else name for name, descending in ordering])
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        # moving forward there is a previous page unless this is the first one,
+        # moving backward there is always the next page we came from
+        self.has_next = has_more if not reverse else True
+        self.has_previous = position is not None if not reverse else has_more
+        self.first = rows[0] if rows else None
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def get_ordering(self, queryset, view):
+        ordering = getattr(view, 'keyset_ordering', None) or queryset.query.order_by
+        ordering = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+        pk = queryset.model._meta.pk
+        if not any(name in ('pk', pk.name, pk.attname) for name, _ in ordering):
+            ordering.append((pk.name, ordering[-1][1] if ordering else False))
+        return [(pk.name if name == 'pk' else name, descending) for name, descending in ordering]
+
+    @staticmethod
+    def after(ordering, position):
+        """
+        Q matching the rows that come after position in ordering.
+        """
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(ordering, position):
+            lookup = 'lt' if descending else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            values = cursor['p']
+            if len(values) != len(self.fields):
+                raise ValueError
+            position = [field.to_python(value) for field, value in zip(self.fields, values)]
+            return position, bool(cursor.get('r'))
+        except (BinasciiError, UnicodeError, ValueError, KeyError, TypeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        cursor = {'p': [field.value_to_string(row) for field in self.fields]}
+        if reverse:
+            cursor['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode()).decode('ascii')
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next or self.last is None:
+            return None
+        return self.encode_cursor(self.last, reverse=False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if not self.has_previous or self.first is None:
+            return None
+        return self.encode_cursor(self.first, reverse=True)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
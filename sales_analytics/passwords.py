@@ -0,0 +1,33 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+
+
+# below this many passwords hashing inline is cheaper than starting a pool
+MIN_POOL_PASSWORDS = 16
+
+
+def encode_password(hasher, password, salt):
+    return hasher.encode(password, salt)
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    Hash passwords with the configured default hasher, spread over a pool of worker processes.
+
+    The hasher and the salts are picked here so the workers only run the
+    key derivation and never need Django settings or the database.
+    """
+    hasher = get_hasher('default')
+    salts = [hasher.salt() for _ in passwords]
+    if workers is None:
+        workers = settings.PASSWORD_HASH_WORKERS or os.cpu_count() or 1
+
+    if workers < 2 or len(passwords) < MIN_POOL_PASSWORDS:
+        return [encode_password(hasher, password, salt) for password, salt in zip(passwords, salts)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(passwords) // (workers * 4))
+        return list(executor.map(encode_password, [hasher] * len(passwords), passwords, salts, chunksize=chunksize))
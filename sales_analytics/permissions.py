@@ -1,10 +1,17 @@
-from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
 from rest_framework import permissions
 
 
 User = get_user_model()
 
+
+def has_role(user, *roles):
+    """
+    Checks the role carried by the authenticated user without going back to the database.
+    """
+    return bool(user and user.is_authenticated and getattr(user, 'role', None) in roles)
+
+
 class IsSuperUser(permissions.BasePermission):
    """
    Allows access only to superusers.
@@ -18,8 +25,7 @@ class IsSalesperson(permissions.BasePermission):
     Allows access only to salespersons.
     """
     def has_permission(self, request, view):
-        user = get_object_or_404(User, username=request.user)
-        return user.role == 'salesperson'
+        return has_role(request.user, User.SALESPERSON)
 
 
 class IsManager(permissions.BasePermission):
@@ -27,8 +33,15 @@ class IsManager(permissions.BasePermission):
     Allows access only to managers.
     """
     def has_permission(self, request, view):
-        user = get_object_or_404(User, username=request.user)
-        return user.role == 'manager'
+        return has_role(request.user, User.MANAGER)
+
+
+class IsManagerOrSuperUser(permissions.BasePermission):
+    """
+    Allows access only to managers and superusers.
+    """
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_superuser) or has_role(request.user, User.MANAGER)
 
 
 class IsSuperUserOrReadOnly(permissions.BasePermission):
@@ -46,5 +59,5 @@ class CanCRUDCart(permissions.BasePermission):
     Give read write access to superusers, managers, salespersons, supervisors
     """
     def has_permission(self, request, view):
-        return request.user and (request.user.is_superuser or request.user.role.manager or \
-                                 request.user.role.salesperson or request.user.role.supervisor)
\ No newline at end of file
+        return bool(request.user and request.user.is_superuser) or \
+            has_role(request.user, User.MANAGER, User.SALESPERSON, User.SUPERVISOR)
@@ -0,0 +1,110 @@
+from contextlib import contextmanager
+
+from django.db import transaction, IntegrityError
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractYear, ExtractMonth
+from django.utils import timezone
+
+from .models import CompletedSale, MonthlySales
+
+
+def record_completed_sale(completed_sale):
+    """
+    Add a freshly created CompletedSale to its monthly rollup row.
+    """
+    apply_to_rollup(completed_sale, 1)
+
+
+def withdraw_completed_sale(completed_sale):
+    """
+    Take a CompletedSale about to be changed or deleted out of its monthly rollup row.
+    """
+    apply_to_rollup(completed_sale, -1)
+
+
+def apply_to_rollup(completed_sale, sign):
+    # like monthly_sales_from_history, sales without a salesperson are not rolled up
+    if completed_sale.salesperson_id is None:
+        return
+
+    completed_at = timezone.localtime(completed_sale.completed_at)
+    key = {
+        'salesperson_id': completed_sale.salesperson_id,
+        'branch_id': completed_sale.branch_id,
+        'year': completed_at.year,
+        'month': completed_at.month,
+    }
+    amount = completed_sale.total_amount.amount * sign
+
+    with transaction.atomic():
+        updated = MonthlySales.objects.filter(**key).update(
+            number_of_sales=F('number_of_sales') + sign,
+            total_amount=F('total_amount') + amount,
+        )
+        if sign < 0:
+            # a rebuild has no row for a month without sales either
+            MonthlySales.objects.filter(number_of_sales__lte=0, **key).delete()
+        if updated or sign < 0:
+            return
+
+        try:
+            with transaction.atomic():
+                MonthlySales.objects.create(number_of_sales=1, total_amount=amount, **key)
+        except IntegrityError:
+            # another checkout created the row first
+            MonthlySales.objects.filter(**key).update(
+                number_of_sales=F('number_of_sales') + 1,
+                total_amount=F('total_amount') + amount,
+            )
+
+
+def monthly_sales_from_history(completed_sales=None):
+    if completed_sales is None:
+        completed_sales = CompletedSale.objects.all()
+
+    return completed_sales.filter(salesperson__isnull=False).annotate(
+        year=ExtractYear('completed_at'),
+        month=ExtractMonth('completed_at')
+        ).values(
+        'salesperson_id', 'branch_id', 'year', 'month'
+        ).annotate(
+        number_of_sales=Count('sale_id'),
+        total_amount=Sum('total_amount')
+        ).order_by()
+
+
+def rebuild_monthly_sales(salesperson_id=None):
+    """
+    Recompute the monthly rollup from the CompletedSale table.
+    """
+    completed_sales = CompletedSale.objects.all()
+    rollups = MonthlySales.objects.all()
+
+    if salesperson_id is not None:
+        completed_sales = completed_sales.filter(salesperson_id=salesperson_id)
+        rollups = rollups.filter(salesperson_id=salesperson_id)
+
+    with transaction.atomic():
+        rollups.delete()
+        return len(MonthlySales.objects.bulk_create(
+            [MonthlySales(**row) for row in monthly_sales_from_history(completed_sales)],
+            batch_size=500,
+        ))
+
+
+@contextmanager
+def branches_deleted(branch_ids):
+    """
+    Fold the monthly rollup rows of branches deleted inside the block into
+    the rows of sales without a branch, where their completed sales end up.
+    """
+    with transaction.atomic():
+        rollups = MonthlySales.objects.filter(branch_id__in=branch_ids)
+        salesperson_ids = set(rollups.values_list('salesperson_id', flat=True))
+        # rows left for SET_NULL would collide with the rows that have no branch already
+        rollups.delete()
+        yield
+        MonthlySales.objects.filter(salesperson_id__in=salesperson_ids, branch__isnull=True).delete()
+        completed_sales = CompletedSale.objects.filter(salesperson_id__in=salesperson_ids, branch__isnull=True)
+        MonthlySales.objects.bulk_create(
+            [MonthlySales(**row) for row in monthly_sales_from_history(completed_sales)], batch_size=500)
@@ -0,0 +1,215 @@
+from contextlib import contextmanager
+
+from django.db import connections
+
+
+class SearchIndex:
+    """
+    An SQLite FTS5 table, the triggers keeping it in sync with the tables it
+    indexes and the statements filling it from them.
+
+    Django's SQLite schema editor alters a column by copying the table into a
+    new one, dropping the old one and renaming the copy. Triggers naming a
+    remade table are lost with it, and triggers on other tables that refer to
+    it make the rename fail, so the triggers are dropped for the length of
+    every migrate run and recreated, and the index rebuilt, afterwards.
+    """
+    def __init__(self, table, create, triggers, fill):
+        self.table = table
+        self.create = create
+        # trigger name -> CREATE TRIGGER IF NOT EXISTS statement
+        self.triggers = triggers
+        self.fill = fill
+
+    def forward(self):
+        return [self.create, *self.triggers.values(), *self.fill]
+
+    def backward(self):
+        return [f'DROP TRIGGER IF EXISTS {name}' for name in self.triggers] + [f'DROP TABLE IF EXISTS {self.table}']
+
+    def exists(self, cursor):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table])
+        return cursor.fetchone() is not None
+
+    def drop_triggers(self, cursor):
+        for name in self.triggers:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+    def create_triggers(self, cursor):
+        for statement in self.triggers.values():
+            cursor.execute(statement)
+
+    def rebuild(self, cursor):
+        for statement in self.fill:
+            cursor.execute(statement)
+
+
+# profile table -> (primary key, role, code); a directory row's rowid is primary key * 8 + code
+PROFILES = {
+    'sales_analytics_customer': ('customer_id', 'customer', 1),
+    'sales_analytics_salesperson': ('sales_person_id', 'salesperson', 2),
+    'sales_analytics_supervisor': ('supervisor_id', 'supervisor', 3),
+    'sales_analytics_manager': ('manager_id', 'manager', 4),
+    'sales_analytics_supplier': ('supplier_id', 'supplier', 5),
+}
+
+INSERT_PERSON = """
+INSERT INTO people_directory (rowid, user_id, role, profile_id, first_name, last_name, username, email, phone_number)
+SELECT {profile}.{pk} * 8 + {code}, u.id, '{role}', {profile}.{pk}, u.first_name, u.last_name, u.username, u.email,
+       {profile}.phone_number
+FROM core_user u
+"""
+
+
+def profile_triggers(table, pk, role, code):
+    insert = INSERT_PERSON.format(profile='NEW', pk=pk, role=role, code=code) + 'WHERE u.id = NEW.user_id;'
+    return {
+        f'people_directory_{role}_insert':
+            f'CREATE TRIGGER IF NOT EXISTS people_directory_{role}_insert AFTER INSERT ON {table} BEGIN {insert} END',
+        f'people_directory_{role}_update':
+            f'CREATE TRIGGER IF NOT EXISTS people_directory_{role}_update AFTER UPDATE ON {table} BEGIN '
+            f'DELETE FROM people_directory WHERE rowid = OLD.{pk} * 8 + {code}; {insert} END',
+        f'people_directory_{role}_delete':
+            f'CREATE TRIGGER IF NOT EXISTS people_directory_{role}_delete AFTER DELETE ON {table} BEGIN '
+            f'DELETE FROM people_directory WHERE rowid = OLD.{pk} * 8 + {code}; END',
+    }
+
+
+def user_rowids(user):
+    return ' UNION ALL '.join(
+        f'SELECT {pk} * 8 + {code} FROM {table} WHERE user_id = {user}.id'
+        for table, (pk, _, code) in PROFILES.items()
+    )
+
+
+PEOPLE_DIRECTORY = SearchIndex(
+    table='people_directory',
+    create="""
+    CREATE VIRTUAL TABLE people_directory USING fts5(
+        user_id UNINDEXED, role UNINDEXED, profile_id UNINDEXED,
+        first_name, last_name, username, email, phone_number,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    triggers={
+        **{
+            name: sql for table, (pk, role, code) in PROFILES.items()
+            for name, sql in profile_triggers(table, pk, role, code).items()
+        },
+        # last_login is written on every login and is not searched, so only these columns are watched
+        'people_directory_user_update':
+            'CREATE TRIGGER IF NOT EXISTS people_directory_user_update '
+            'AFTER UPDATE OF first_name, last_name, username, email ON core_user BEGIN '
+            'UPDATE people_directory SET first_name = NEW.first_name, last_name = NEW.last_name, '
+            f'username = NEW.username, email = NEW.email WHERE rowid IN ({user_rowids("NEW")}); END',
+        'people_directory_user_delete':
+            'CREATE TRIGGER IF NOT EXISTS people_directory_user_delete AFTER DELETE ON core_user BEGIN '
+            f'DELETE FROM people_directory WHERE rowid IN ({user_rowids("OLD")}); END',
+    },
+    fill=['DELETE FROM people_directory'] + [
+        INSERT_PERSON.format(profile='p', pk=pk, role=role, code=code) + f'JOIN {table} p ON p.user_id = u.id'
+        for table, (pk, role, code) in PROFILES.items()
+    ],
+)
+
+# the FTS5 index reads product_name and serial_number from the product table itself
+PRODUCT_SEARCH = SearchIndex(
+    table='product_search',
+    create="""
+    CREATE VIRTUAL TABLE product_search USING fts5(
+        product_name, serial_number,
+        content = 'sales_analytics_product', content_rowid = 'product_id',
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    triggers={
+        'product_search_insert': """
+        CREATE TRIGGER IF NOT EXISTS product_search_insert AFTER INSERT ON sales_analytics_product BEGIN
+            INSERT INTO product_search (rowid, product_name, serial_number)
+            VALUES (NEW.product_id, NEW.product_name, NEW.serial_number);
+        END
+        """,
+        'product_search_delete': """
+        CREATE TRIGGER IF NOT EXISTS product_search_delete AFTER DELETE ON sales_analytics_product BEGIN
+            INSERT INTO product_search (product_search, rowid, product_name, serial_number)
+            VALUES ('delete', OLD.product_id, OLD.product_name, OLD.serial_number);
+        END
+        """,
+        # price and stock edits leave the indexed columns alone
+        'product_search_update': """
+        CREATE TRIGGER IF NOT EXISTS product_search_update
+        AFTER UPDATE OF product_name, serial_number ON sales_analytics_product BEGIN
+            INSERT INTO product_search (product_search, rowid, product_name, serial_number)
+            VALUES ('delete', OLD.product_id, OLD.product_name, OLD.serial_number);
+            INSERT INTO product_search (rowid, product_name, serial_number)
+            VALUES (NEW.product_id, NEW.product_name, NEW.serial_number);
+        END
+        """,
+    },
+    fill=["INSERT INTO product_search (product_search) VALUES ('rebuild')"],
+)
+
+SEARCH_INDEXES = [PEOPLE_DIRECTORY, PRODUCT_SEARCH]
+
+
+def run(statements):
+    """
+    RunPython operation executing statements on SQLite; other databases search the tables directly.
+    """
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+def drop_triggers(connection):
+    """
+    Drop the triggers of the existing search indexes, return those indexes.
+    """
+    if connection.vendor != 'sqlite':
+        return []
+    with connection.cursor() as cursor:
+        indexes = [index for index in SEARCH_INDEXES if index.exists(cursor)]
+        for index in indexes:
+            index.drop_triggers(cursor)
+    return indexes
+
+
+def restore_triggers(connection, rebuild=True):
+    """
+    Recreate the missing triggers of the existing search indexes and refill them from their tables.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for index in SEARCH_INDEXES:
+            if index.exists(cursor):
+                index.create_triggers(cursor)
+                if rebuild:
+                    index.rebuild(cursor)
+
+
+@contextmanager
+def triggers_suspended(connection):
+    """
+    Drop the search index triggers around schema changes made outside of
+    migrate, such as a schema_editor().alter_field() on a profile, user or
+    product table, then recreate them and rebuild the indexes.
+    """
+    drop_triggers(connection)
+    try:
+        yield
+    finally:
+        restore_triggers(connection)
+
+
+def suspend_before_migrate(sender, using, plan=None, **kwargs):
+    if plan:
+        drop_triggers(connections[using])
+
+
+def restore_after_migrate(sender, using, plan=None, **kwargs):
+    # also repairs the triggers after a migrate run that failed half way
+    restore_triggers(connections[using], rebuild=bool(plan))
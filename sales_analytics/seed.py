@@ -0,0 +1,409 @@
+import re
+from collections import defaultdict
+from datetime import datetime, time
+from decimal import Decimal
+from pathlib import Path
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.db import connection, models, transaction
+from django.db.models import Q
+from django.utils import timezone
+from djmoney.models.fields import CurrencyField
+
+from .models import generate_transaction_id
+
+
+INSERT_RE = re.compile(r'insert\s+into\s+(\w+)\s*\(([^)]*)\)\s*values\s*', re.IGNORECASE)
+NUMBER_RE = re.compile(r'-?\d+(\.\d+)?')
+DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y')
+
+# columns renamed since the fixtures were dumped, per table
+LEGACY_COLUMNS = {
+    'sales_analytics_sale': {'sales_person_id': 'salesperson_id'},
+}
+
+# values for columns the fixtures predate, per table
+LEGACY_DEFAULTS = {
+    # legacy sales carried their own amount and payment method, i.e. they were already paid
+    'sales_analytics_sale': {'is_completed': True},
+}
+
+LEGACY_CURRENCIES = {'KSH': 'KES'}
+
+# unique string columns that get a per-copy prefix when the seed is scaled up
+SCALED_PREFIX = 's{copy}-'
+
+# primary keys per DELETE when flushing the seeded users, below SQLite's parameter limit
+FLUSH_BATCH_SIZE = 900
+
+
+class SeedError(Exception):
+    pass
+
+
+def parse_value(text, pos):
+    """
+    Parse one SQL literal starting at pos and return (value, next position).
+    """
+    if text[pos] == "'":
+        chunks = []
+        pos += 1
+        while True:
+            end = text.index("'", pos)
+            chunks.append(text[pos:end])
+            if text.startswith("''", end):
+                chunks.append("'")
+                pos = end + 2
+            else:
+                return ''.join(chunks), end + 1
+
+    if text[pos:pos + 4].upper() == 'NULL':
+        return None, pos + 4
+
+    match = NUMBER_RE.match(text, pos)
+    if match is None:
+        raise SeedError(f'Unexpected SQL literal at {text[pos:pos + 20]!r}')
+    number = match.group()
+    return (Decimal(number) if match.group(1) else int(number)), match.end()
+
+
+def parse_statements(text):
+    """
+    Yield (table, columns, values) for every row of every INSERT statement in text.
+    """
+    pos = 0
+    while True:
+        match = INSERT_RE.search(text, pos)
+        if match is None:
+            return
+        table = match.group(1)
+        columns = [column.strip().strip('"`') for column in match.group(2).split(',')]
+        pos = match.end()
+
+        # one or more parenthesised rows separated by commas
+        while True:
+            pos = text.index('(', pos) + 1
+            values = []
+            while True:
+                while text[pos].isspace():
+                    pos += 1
+                value, pos = parse_value(text, pos)
+                values.append(value)
+                while text[pos].isspace():
+                    pos += 1
+                if text[pos] == ')':
+                    pos += 1
+                    break
+                pos += 1  # comma
+
+            if len(values) != len(columns):
+                raise SeedError(f'{table}: {len(columns)} columns but {len(values)} values')
+            yield table, columns, values
+
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+            if pos < len(text) and text[pos] == ',':
+                continue
+            break
+
+
+def parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise SeedError(f'Unrecognised date {value!r}')
+
+
+def convert(field, value):
+    if value is None:
+        return None
+    if isinstance(field, models.DateTimeField):
+        if ':' in value:
+            value = datetime.fromisoformat(value)
+        else:
+            value = datetime.combine(parse_date(value), time())
+        return value if timezone.is_aware(value) else timezone.make_aware(value)
+    if isinstance(field, models.DateField):
+        return parse_date(value)
+    if isinstance(field, CurrencyField):
+        return LEGACY_CURRENCIES.get(value, value)
+    return value
+
+
+class Table:
+    """
+    Rows of one model read from the fixtures, keyed by primary key.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.fields = [field for field in model._meta.concrete_fields]
+        self.columns = {field.column: field for field in self.fields}
+        self.rows = {}
+        self.duplicates = 0
+        self.dropped_columns = set()
+
+    @property
+    def db_table(self):
+        return self.model._meta.db_table
+
+    def add(self, columns, values):
+        renames = LEGACY_COLUMNS.get(self.db_table, {})
+        row = {}
+        for column, value in zip(columns, values):
+            column = renames.get(column, column)
+            field = self.columns.get(column)
+            if field is None:
+                self.dropped_columns.add(column)
+                continue
+            row[field.attname] = convert(field, value)
+
+        for attname, value in LEGACY_DEFAULTS.get(self.db_table, {}).items():
+            row.setdefault(attname, value)
+
+        pk = row[self.model._meta.pk.attname]
+        if pk in self.rows:
+            self.duplicates += 1
+            return
+        self.rows[pk] = row
+
+    def complete(self, row):
+        now = timezone.now()
+        for field in self.fields:
+            if field.attname in row:
+                continue
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                row[field.attname] = now
+            else:
+                row[field.attname] = field.get_default()
+        return row
+
+
+def read_fixtures(paths):
+    models_by_table = {model._meta.db_table: model for model in apps.get_models()}
+    tables = {}
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob('*.sql')) if path.is_dir() else [path])
+
+    for file in files:
+        for table_name, columns, values in parse_statements(file.read_text()):
+            model = models_by_table.get(table_name)
+            if model is None:
+                raise SeedError(f'{file.name}: unknown table {table_name}')
+            if model not in tables:
+                tables[model] = Table(model)
+            tables[model].add(columns, values)
+
+    return tables
+
+
+def dependency_order(tables):
+    """
+    Order tables so every table comes after the tables its foreign keys point to.
+    """
+    ordered = []
+    visiting = set()
+
+    def visit(model):
+        if model in ordered or model in visiting:
+            return
+        visiting.add(model)
+        for field in model._meta.concrete_fields:
+            if field.is_relation and field.related_model in tables:
+                visit(field.related_model)
+        visiting.discard(model)
+        ordered.append(model)
+
+    for model in tables:
+        visit(model)
+    return [tables[model] for model in ordered]
+
+
+def drop_dangling_references(tables):
+    """
+    Null out nullable foreign keys that point at rows missing from the fixtures
+    and drop rows whose required foreign key is missing.
+    """
+    report = defaultdict(int)
+    for table in dependency_order(tables):
+        for field in table.fields:
+            if not field.is_relation:
+                continue
+            if field.related_model in tables:
+                parent_pks = tables[field.related_model].rows.keys()
+            else:
+                parent_pks = set(field.related_model._base_manager.values_list('pk', flat=True))
+
+            for pk, row in list(table.rows.items()):
+                value = row.get(field.attname)
+                if value is None or value in parent_pks:
+                    continue
+                if field.null:
+                    row[field.attname] = None
+                    report[f'{table.db_table}.{field.column} set to NULL'] += 1
+                else:
+                    del table.rows[pk]
+                    report[f'{table.db_table} rows dropped for missing {field.column}'] += 1
+    return report
+
+
+def unique_fields(table):
+    """
+    The non primary key fields of table holding unique values, each with the
+    field values a row must have for the uniqueness to apply, from a
+    conditional UniqueConstraint such as product_serial_number_uniq.
+    """
+    fields = [(field, {}) for field in table.fields if field.unique and not field.primary_key]
+    for constraint in table.model._meta.constraints:
+        if isinstance(constraint, models.UniqueConstraint) and len(constraint.fields) == 1:
+            condition = dict(constraint.condition.children) if constraint.condition else {}
+            fields.append((table.model._meta.get_field(constraint.fields[0]), condition))
+    return fields
+
+
+def applies(row, condition):
+    return all(row.get(name) == value for name, value in condition.items())
+
+
+def drop_unique_conflicts(tables, report):
+    """
+    Regenerate clashing transaction ids and drop rows repeating another unique value.
+    """
+    for table in tables.values():
+        for field, condition in unique_fields(table):
+            seen = set()
+            for pk, row in list(table.rows.items()):
+                if not applies(row, condition):
+                    continue
+                value = row.get(field.attname)
+                if field.attname == 'transaction_id' and (not value or value in seen):
+                    row[field.attname] = value = generate_transaction_id()
+                    report[f'{table.db_table}.{field.column} regenerated'] += 1
+                elif value is not None and value in seen:
+                    del table.rows[pk]
+                    report[f'{table.db_table} rows dropped for duplicate {field.column}'] += 1
+                    continue
+                seen.add(value)
+
+
+def scaled_rows(table, copy, offsets):
+    """
+    Yield the rows of a table for one synthetic copy of the seed.
+
+    Primary and foreign keys are shifted by the size of the table they point
+    at and unique text columns are prefixed, so every copy is a disjoint,
+    internally consistent replica of the original data.
+    """
+    pk = table.model._meta.pk
+    prefix = SCALED_PREFIX.format(copy=copy)
+    unique_text = [
+        (field, condition) for field, condition in unique_fields(table) if isinstance(field, models.CharField)
+    ]
+
+    for row in table.rows.values():
+        row = dict(row)
+        if copy:
+            row[pk.attname] += offsets[table.model] * copy
+            for field in table.fields:
+                if field.is_relation and row.get(field.attname) is not None and field.related_model in offsets:
+                    row[field.attname] += offsets[field.related_model] * copy
+            for field, condition in unique_text:
+                if not applies(row, condition):
+                    continue
+                if field.attname == 'transaction_id':
+                    row[field.attname] = generate_transaction_id()
+                elif row.get(field.attname):
+                    row[field.attname] = prefix + row[field.attname]
+        yield row
+
+
+def insert_rows(table, rows, batch_size):
+    fields = table.fields
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        connection.ops.quote_name(table.db_table),
+        ', '.join(connection.ops.quote_name(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    inserted = 0
+    batch = []
+    with connection.cursor() as cursor:
+        for row in rows:
+            row = table.complete(row)
+            batch.append([field.get_db_prep_save(row[field.attname], connection) for field in fields])
+            if len(batch) == batch_size:
+                cursor.executemany(sql, batch)
+                inserted += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            inserted += len(batch)
+    return inserted
+
+
+def seeded_pks(table, scale, offsets):
+    return sorted(pk + offsets[table.model] * copy for pk in table.rows for copy in range(scale))
+
+
+def flush_tables(ordered, scale, offsets):
+    """
+    Delete the rows the seed replaces through the ORM, so rows of other
+    tables pointing at them are cascaded or set to NULL.
+
+    Every row of the seeded tables goes, except in the user table, where
+    only the users at the primary keys of the seed are deleted. Staff and
+    superuser accounts are never deleted; one standing at such a key stops the load.
+    """
+    User = get_user_model()
+    for table in reversed(ordered):
+        if table.model is not User:
+            table.model._base_manager.all().delete()
+            continue
+
+        pks = seeded_pks(table, scale, offsets)
+        for start in range(0, len(pks), FLUSH_BATCH_SIZE):
+            users = User._base_manager.filter(pk__in=pks[start:start + FLUSH_BATCH_SIZE])
+            staff = list(users.filter(Q(is_staff=True) | Q(is_superuser=True)).values_list('username', flat=True))
+            if staff:
+                raise SeedError(f'{table.db_table}: the seed would replace the staff accounts {", ".join(staff)}')
+            users.delete()
+
+
+def load_seed(paths, scale=1, batch_size=5000, flush=False):
+    """
+    Load the SQL fixtures in paths, scaled up scale times, in one transaction.
+
+    Foreign key checks are disabled while inserting and verified once all
+    tables are loaded. Returns (inserted rows per table, cleanup report).
+    """
+    tables = read_fixtures(paths)
+    report = drop_dangling_references(tables)
+    drop_unique_conflicts(tables, report)
+    ordered = dependency_order(tables)
+    offsets = {table.model: max(table.rows, default=0) for table in ordered}
+    inserted = {}
+
+    for table in ordered:
+        if table.duplicates:
+            report[f'{table.db_table} duplicate rows skipped'] = table.duplicates
+        for column in sorted(table.dropped_columns):
+            report[f'{table.db_table}.{column} ignored'] = len(table.rows)
+
+    with connection.constraint_checks_disabled(), transaction.atomic():
+        if flush:
+            flush_tables(ordered, scale, offsets)
+        else:
+            for table in ordered:
+                if table.model._base_manager.exists():
+                    raise SeedError(f'{table.db_table} is not empty, use --flush to replace its rows')
+
+        for table in ordered:
+            inserted[table.db_table] = sum(
+                insert_rows(table, scaled_rows(table, copy, offsets), batch_size) for copy in range(scale)
+            )
+
+        connection.check_constraints()
+
+    return inserted, dict(report)
@@ -1,22 +1,91 @@
+from operator import attrgetter
+
 from django.utils import timezone
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password
-from rest_framework import serializers
+from rest_framework import serializers, ISO_8601
+from rest_framework.settings import api_settings
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 from drf_writable_nested.serializers import WritableNestedModelSerializer
 from djoser.serializers import UserSerializer as BaseUserSerializer, UserCreateSerializer
 from djmoney.contrib.django_rest_framework import MoneyField
-from templated_email import send_templated_mail
 
 from .models import Customer, SalesPerson, Branch, SalesPersonBranch, Manager, Supplier
-from .models import ProductCategory, Product, PaymentMethod, Cart, Sale, CompletedSale
+from .models import ProductCategory, Product, PaymentMethod, Cart, Sale, CompletedSale, MonthlySales
+from .outbox import queue_templated_mail
+from .avatars import avatar_url
 
 
 User = get_user_model()
 
 
+class FlatReadSerializer(serializers.Serializer):
+    """
+    Read-only serializer for the GET paths.
+
+    The fields are compiled once per serializer instance into
+    (name, getter, representation) steps, so rendering a row skips DRF's
+    generic attribute lookup, SkipField handling and OrderedDict building.
+    """
+    # field types whose representation is a plain type conversion
+    CONVERSIONS = {
+        serializers.IntegerField: int,
+        serializers.CharField: str,
+        serializers.EmailField: str,
+    }
+
+    def compile(self):
+        steps = []
+        for field in self._readable_fields:
+            if isinstance(field, serializers.SerializerMethodField):
+                steps.append((field.field_name, None, getattr(self, field.method_name)))
+            elif isinstance(field, serializers.PrimaryKeyRelatedField):
+                # the foreign key column already holds the representation
+                steps.append((field.field_name, attrgetter(f'{field.source}_id'), None))
+            elif isinstance(field, serializers.DateTimeField):
+                steps.append((field.field_name, attrgetter(field.source), self.datetime_representation(field)))
+            else:
+                representation = self.CONVERSIONS.get(type(field), field.to_representation)
+                steps.append((field.field_name, attrgetter(field.source), representation))
+        return steps
+
+    @staticmethod
+    def datetime_representation(field):
+        """
+        DateTimeField.to_representation with the output timezone looked up once
+        instead of on every value.
+        """
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+            return field.to_representation
+
+        def representation(value):
+            if isinstance(value, str) or timezone.is_naive(value):
+                return field.to_representation(value)
+            value = value.astimezone(field_timezone).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+        return representation
+
+    def to_representation(self, instance):
+        try:
+            steps = self._steps
+        except AttributeError:
+            steps = self._steps = self.compile()
+
+        row = {}
+        for name, getter, representation in steps:
+            if getter is None:
+                row[name] = representation(instance)
+                continue
+            value = getter(instance)
+            row[name] = value if value is None or representation is None else representation(value)
+        return row
+
+
 class UserSerializer(WritableNestedModelSerializer, BaseUserSerializer, UserCreateSerializer):
     class Meta(BaseUserSerializer.Meta):
         extra_fields = ("first_name", "last_name",
@@ -28,6 +97,20 @@ class UserSerializer(WritableNestedModelSerializer, BaseUserSerializer, UserCrea
         BaseUserSerializer.Meta.read_only_fields = tuple(read_only_fields)
 
 
+class UserReadSerializer(FlatReadSerializer):
+    email = serializers.CharField()
+    id = serializers.IntegerField()
+    username = serializers.CharField()
+    first_name = serializers.CharField()
+    last_name = serializers.CharField()
+    is_superuser = serializers.BooleanField()
+    is_active = serializers.BooleanField()
+    is_staff = serializers.BooleanField()
+    role = serializers.CharField()
+    date_joined = serializers.DateTimeField()
+    last_login = serializers.DateTimeField()
+
+
 
 class CustomerSerializer(WritableNestedModelSerializer):
     image = serializers.SerializerMethodField('get_image')
@@ -39,7 +122,7 @@ class CustomerSerializer(WritableNestedModelSerializer):
                   'kra_pin', 'contact_person', 'address', 'image', 'user']
 
     def get_image(self, manager):
-        return f"https://ui-avatars.com/api/?name={manager.user.first_name}+{manager.user.last_name}"
+        return avatar_url(manager.user, self.context.get('request'))
 
     def create(self, validated_data):
         user_data = validated_data.pop('user')
@@ -51,6 +134,19 @@ class CustomerSerializer(WritableNestedModelSerializer):
         return Customer.objects.create(user=user, **validated_data)
 
 
+class CustomerReadSerializer(FlatReadSerializer):
+    customer_id = serializers.IntegerField()
+    phone_number = serializers.CharField()
+    kra_pin = serializers.CharField()
+    contact_person = serializers.CharField()
+    address = serializers.CharField()
+    image = serializers.SerializerMethodField('get_image')
+    user = UserReadSerializer()
+
+    def get_image(self, customer):
+        return avatar_url(customer.user, self.context.get('request'))
+
+
 class SalesPersonSerializer(WritableNestedModelSerializer):
     image = serializers.SerializerMethodField('get_image')
     user = UserSerializer()
@@ -60,7 +156,7 @@ class SalesPersonSerializer(WritableNestedModelSerializer):
         fields = ['sales_person_id', 'phone_number', 'image', 'user']
    
     def get_image(self, salesperson):
-        return f"https://ui-avatars.com/api/?name={salesperson.user.first_name}+{salesperson.user.last_name}"
+        return avatar_url(salesperson.user, self.context.get('request'))
     
     def update(self, instance, validated_data):
        instance.user.last_login = timezone.now()
@@ -80,17 +176,35 @@ class SalesPersonSerializer(WritableNestedModelSerializer):
         return SalesPerson.objects.create(user=user, **validated_data)
 
 
+class SalesPersonReadSerializer(FlatReadSerializer):
+    sales_person_id = serializers.IntegerField()
+    phone_number = serializers.CharField()
+    image = serializers.SerializerMethodField('get_image')
+    user = UserReadSerializer()
+
+    def get_image(self, salesperson):
+        return avatar_url(salesperson.user, self.context.get('request'))
+
+
 class BranchSerializer(WritableNestedModelSerializer):
     class Meta:
         model = Branch
         fields = ['branch_id', 'branch_name', 'phone_number', 'email', 'opening_date',]
 
 
-class SimpleSalesPersonBranchSerializer(WritableNestedModelSerializer):
-    branch = BranchSerializer()
-    class Meta:
-        model = SalesPersonBranch
-        fields = ['salesperson_branch_id', 'branch', 'assignment_date', 'termination_date']
+class BranchReadSerializer(FlatReadSerializer):
+    branch_id = serializers.IntegerField()
+    branch_name = serializers.CharField()
+    phone_number = serializers.CharField()
+    email = serializers.EmailField()
+    opening_date = serializers.DateField()
+
+
+class SimpleSalesPersonBranchSerializer(FlatReadSerializer):
+    salesperson_branch_id = serializers.IntegerField()
+    branch = BranchReadSerializer()
+    assignment_date = serializers.DateTimeField()
+    termination_date = serializers.DateTimeField()
 
 
 
@@ -104,7 +218,7 @@ class SalesPersonBranchSerializer(WritableNestedModelSerializer):
 
     def assign_salesperson_to_branch(self, **kwargs):
         spb = SalesPersonBranch.objects.create(**kwargs["validated_data"])
-        send_templated_mail(
+        queue_templated_mail(
             template_name='assignment',
             from_email='admin@cowtrack.com',
             recipient_list=[spb.salesperson.user.email],
@@ -112,24 +226,25 @@ class SalesPersonBranchSerializer(WritableNestedModelSerializer):
                 'salesperson_name': f'{spb.salesperson.user.first_name} {spb.salesperson.user.last_name}',
                 'assignment_date': spb.assignment_date,
                 'branch_name': spb.branch.branch_name,
-                'image': f"https://ui-avatars.com/api/?name={spb.salesperson.user.first_name}+{spb.salesperson.user.last_name}"
+                'image': avatar_url(spb.salesperson.user)
             },
         )
 
         return spb
  
+    @transaction.atomic
     def create(self, validated_data):
         validated_data['salesperson_id'] = self.context['salesperson_pk']
         salesperson_pk = validated_data.get('salesperson_id')
 
         try:
-            spb = SalesPersonBranch.objects.filter(salesperson_id=salesperson_pk).order_by('-assignment_date').first()
+            spb = SalesPersonBranch.objects.filter(salesperson_id=salesperson_pk).latest('assignment_date')
             # if salesperson has not been removed from the current branch, then remove the salesperson
             if not spb.termination_date and (spb.branch_id != validated_data["branch"].branch_id):
                 spb.termination_date = timezone.now()
                 spb.save()
 
-                send_templated_mail(
+                queue_templated_mail(
                     template_name='termination',
                     from_email='admin@cowtrack.com',
                     recipient_list=[spb.salesperson.user.email],
@@ -137,7 +252,7 @@ class SalesPersonBranchSerializer(WritableNestedModelSerializer):
                         'salesperson_name': f'{spb.salesperson.user.first_name} {spb.salesperson.user.last_name}',
                         'termination_date': spb.termination_date,
                         'branch_name': spb.branch.branch_name,
-                        'image': f"https://ui-avatars.com/api/?name={spb.salesperson.user.first_name}+{spb.salesperson.user.last_name}"
+                        'image': avatar_url(spb.salesperson.user)
                     },
                 )
             
@@ -166,7 +281,7 @@ class ManagerSerializer(WritableNestedModelSerializer):
         fields = ['manager_id', 'phone_number', 'image', 'user']
 
     def get_image(self, manager):
-        return f"https://ui-avatars.com/api/?name={manager.user.first_name}+{manager.user.last_name}"
+        return avatar_url(manager.user, self.context.get('request'))
     
     def update(self, instance, validated_data):
        instance.user.last_login = timezone.now()
@@ -185,6 +300,16 @@ class ManagerSerializer(WritableNestedModelSerializer):
         return Manager.objects.create(user=user, **validated_data)
 
 
+class ManagerReadSerializer(FlatReadSerializer):
+    manager_id = serializers.IntegerField()
+    phone_number = serializers.CharField()
+    image = serializers.SerializerMethodField('get_image')
+    user = UserReadSerializer()
+
+    def get_image(self, manager):
+        return avatar_url(manager.user, self.context.get('request'))
+
+
 class SupplierSerializer(WritableNestedModelSerializer):
     image = serializers.SerializerMethodField('get_image')
     user = UserSerializer()
@@ -194,7 +319,7 @@ class SupplierSerializer(WritableNestedModelSerializer):
         fields = ['supplier_id', 'phone_number', 'kra_pin', 'contact_person', 'notes', 'image', 'user']
 
     def get_image(self, supplier):
-        return f"https://ui-avatars.com/api/?name={supplier.user.first_name}+{supplier.user.last_name}"
+        return avatar_url(supplier.user, self.context.get('request'))
     
     def update(self, instance, validated_data):
        instance.user.last_login = timezone.now()
@@ -213,6 +338,19 @@ class SupplierSerializer(WritableNestedModelSerializer):
         return Supplier.objects.create(user=user, **validated_data)
 
 
+class SupplierReadSerializer(FlatReadSerializer):
+    supplier_id = serializers.IntegerField()
+    phone_number = serializers.CharField()
+    kra_pin = serializers.CharField()
+    contact_person = serializers.CharField()
+    notes = serializers.CharField()
+    image = serializers.SerializerMethodField('get_image')
+    user = UserReadSerializer()
+
+    def get_image(self, supplier):
+        return avatar_url(supplier.user, self.context.get('request'))
+
+
 class ProductCategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductCategory
@@ -229,11 +367,34 @@ class ProductSerializer(WritableNestedModelSerializer):
         fields = ['product_id', 'product_name', 'cost_price_currency', 'cost_price', 'selling_price_currency', 'selling_price', 'is_serialized',
                   'serial_number', 'category', 'branch']
 
-    def create(self, validated_data):
-        serial_number = validated_data.get('serial_number')
+    serial_number_taken_message = 'A serialized product with this serial number already exists'
+
+    def validate(self, attrs):
+        serial_number = attrs.get('serial_number')
         if serial_number is not None:
-            validated_data['is_serialized'] = 1
-        return super().create(validated_data)
+            attrs['is_serialized'] = 1
+            taken = Product.objects.filter(is_serialized=True, serial_number=serial_number)
+            if self.instance is not None:
+                taken = taken.exclude(pk=self.instance.pk)
+            if taken.exists():
+                raise ValidationError({'serial_number': [self.serial_number_taken_message]})
+        return attrs
+
+    def save(self, **kwargs):
+        # product_serial_number_uniq catches a concurrent write of the same serial number
+        try:
+            with transaction.atomic():
+                return super().save(**kwargs)
+        except IntegrityError as exc:
+            if not self.is_serial_number_clash(exc):
+                raise
+            raise ValidationError({'serial_number': [self.serial_number_taken_message]})
+
+    @staticmethod
+    def is_serial_number_clash(error):
+        # PostgreSQL names the violated constraint, SQLite the columns of the partial unique index
+        message = str(error)
+        return 'product_serial_number_uniq' in message or 'sales_analytics_product.serial_number' in message
 
 
 class PaymentMethodSerializer(serializers.ModelSerializer):
@@ -242,21 +403,21 @@ class PaymentMethodSerializer(serializers.ModelSerializer):
         fields = ['payment_method_id', 'method_name']
 
 
-class SimpleProductCartSerializer(serializers.Serializer):
+class SimpleProductCartSerializer(FlatReadSerializer):
     product_name = serializers.CharField(max_length=50)
     selling_price = MoneyField(max_digits=19, decimal_places=2)
     serial_number = serializers.CharField(max_length=50)
 
 
-class CartReadSerializer(WritableNestedModelSerializer):
+class CartReadSerializer(FlatReadSerializer):
+    cart_id = serializers.IntegerField()
+    number_of_items = serializers.IntegerField()
+    product = SimpleProductCartSerializer()
     total_price = serializers.SerializerMethodField('get_total_price')
-    product = SimpleProductCartSerializer(read_only=True)
-
-    class Meta:
-        model = Cart
-        fields = ['cart_id', 'number_of_items', 'product', 'total_price']
 
     def get_total_price(self, cart):
+        if hasattr(cart, 'total_price'):
+            return cart.total_price
         return cart.number_of_items * cart.product.selling_price.amount
     
 
@@ -280,16 +441,30 @@ class CartWriteSerializer(WritableNestedModelSerializer):
         return cart.number_of_items * cart.product.selling_price.amount
 
 
-class SaleReadSerializer(WritableNestedModelSerializer):
-    salesperson = SalesPersonSerializer()
-    cart = CartWriteSerializer()
-    transaction_id = serializers.CharField(max_length=20, read_only=True)
-    is_completed = serializers.BooleanField(read_only=True)
+class CartLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    number_of_items = serializers.IntegerField(min_value=1)
 
-    class Meta:
-        model = Sale
-        fields = ['sale_id', 'transaction_date', 'transaction_id', 'awarded_points', 'is_completed',
-                  'salesperson', 'cart']
+
+class SaleCartReadSerializer(FlatReadSerializer):
+    cart_id = serializers.IntegerField()
+    number_of_items = serializers.IntegerField()
+    product = serializers.PrimaryKeyRelatedField(read_only=True)
+    customer = serializers.PrimaryKeyRelatedField(read_only=True)
+    total_price = serializers.SerializerMethodField('get_total_price')
+
+    def get_total_price(self, cart):
+        return cart.number_of_items * cart.product.selling_price.amount
+
+
+class SaleReadSerializer(FlatReadSerializer):
+    sale_id = serializers.IntegerField()
+    transaction_date = serializers.DateTimeField()
+    transaction_id = serializers.CharField()
+    awarded_points = serializers.IntegerField()
+    is_completed = serializers.BooleanField()
+    salesperson = SalesPersonReadSerializer()
+    cart = SaleCartReadSerializer()
 
 
 class SaleWriteSerializer(WritableNestedModelSerializer):
@@ -303,31 +478,50 @@ class SaleWriteSerializer(WritableNestedModelSerializer):
                   'salesperson', 'cart']
 
 
-class CompletedSaleReadSerializer(WritableNestedModelSerializer):
-    total_amount = MoneyField(max_digits=19, decimal_places=4, read_only=True)
-    branch = BranchSerializer(read_only=True)
-    salesperson = SalesPersonSerializer(read_only=True)
+class CompletedSaleReadSerializer(FlatReadSerializer):
+    sale_id = serializers.IntegerField()
+    completed_at = serializers.DateTimeField()
+    total_amount = MoneyField(max_digits=19, decimal_places=4)
+    branch = BranchReadSerializer()
+    salesperson = SalesPersonReadSerializer()
+    payment_method = serializers.PrimaryKeyRelatedField(read_only=True)
+    line_count = serializers.IntegerField()
+    awarded_points = serializers.IntegerField()
 
-    class Meta:
-        model = CompletedSale
-        fields = ['sale_id', 'completed_at', 'total_amount', 'branch', 'salesperson', 'payment_method']
+
+class ReceiptCartSerializer(FlatReadSerializer):
+    cart_id = serializers.IntegerField()
+    number_of_items = serializers.IntegerField()
+    product = SimpleProductCartSerializer()
+    customer = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
+class ReceiptLineSerializer(FlatReadSerializer):
+    sale_id = serializers.IntegerField()
+    transaction_id = serializers.CharField()
+    transaction_date = serializers.DateTimeField()
+    awarded_points = serializers.IntegerField()
+    cart = ReceiptCartSerializer()
+    line_total = serializers.DecimalField(max_digits=19, decimal_places=4)
 
 
 class CompletedSaleWriteSerializer(WritableNestedModelSerializer):
     total_amount = MoneyField(max_digits=19, decimal_places=4)
+    line_count = serializers.IntegerField(read_only=True)
+    awarded_points = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = CompletedSale
-        fields = ['sale_id', 'completed_at', 'total_amount', 'branch', 'salesperson', 'payment_method']
+        fields = ['sale_id', 'completed_at', 'total_amount', 'branch', 'salesperson', 'payment_method',
+                  'line_count', 'awarded_points']
 
 
 class CompletedSalePaymentSerializer(serializers.Serializer):
     method_name = serializers.CharField(max_length=50)
 
 
-class MonthlySalesSerializer(serializers.Serializer):
-    year = serializers.IntegerField()
-    month = serializers.IntegerField()
-    number_of_sales = serializers.IntegerField()
-    total_amount = serializers.DecimalField(max_digits=19, decimal_places=4)
+class MonthlySalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MonthlySales
+        fields = ['year', 'month', 'number_of_sales', 'total_amount']
     # branches = serializers.ListField(child=serializers.CharField())
@@ -0,0 +1,68 @@
+from django.db.models import Exists, OuterRef, Subquery
+from djmoney.contrib.django_rest_framework import MoneyField
+from rest_framework import serializers
+
+from .models import Product, Cart, Sale
+from .serializers import FlatReadSerializer, BranchReadSerializer
+
+
+# serial numbers resolved per request, looked up in a single query
+MAX_SERIALS = 500
+
+
+class ScanQuerySerializer(serializers.Serializer):
+    serial_number = serializers.CharField(max_length=50)
+
+
+class ResolveSerialsSerializer(serializers.Serializer):
+    serial_numbers = serializers.ListField(
+        child=serializers.CharField(max_length=50), allow_empty=False, max_length=MAX_SERIALS)
+
+
+class ScannedProductSerializer(FlatReadSerializer):
+    product_id = serializers.IntegerField()
+    product_name = serializers.CharField()
+    serial_number = serializers.CharField()
+    selling_price = MoneyField(max_digits=19, decimal_places=4)
+    category = serializers.PrimaryKeyRelatedField(read_only=True)
+    branch = BranchReadSerializer()
+    in_open_cart = serializers.BooleanField()
+    sold = serializers.BooleanField()
+    completed_sale = serializers.IntegerField(source='completed_sale_id')
+
+
+def serialized_products():
+    """
+    Serialized products with their branch and whether they sit in a cart
+    that has not been sold yet, were sold, and the CompletedSale they were sold in.
+    """
+    completed = Sale.objects.filter(cart__product=OuterRef('pk'), is_completed__in=[1])
+    open_carts = Cart.objects.filter(product=OuterRef('pk')).exclude(
+        Exists(Sale.objects.filter(cart=OuterRef('pk'), is_completed__in=[1])))
+    return Product.objects.filter(is_serialized=True).select_related('branch').annotate(
+        in_open_cart=Exists(open_carts),
+        sold=Exists(completed),
+        completed_sale_id=Subquery(
+            completed.filter(completed_sale__isnull=False).order_by('-sale_id').values('completed_sale_id')[:1]),
+    )
+
+
+def scan(serial_number):
+    """
+    The serialized product carrying serial_number, or None; one lookup in product_serial_number_uniq.
+    """
+    return serialized_products().filter(serial_number=serial_number).first()
+
+
+def resolve(serial_numbers):
+    """
+    Resolve many serial numbers in one query. Return (products in the order
+    of serial_numbers, serial numbers no serialized product carries).
+    """
+    serial_numbers = list(dict.fromkeys(serial_numbers))
+    products = {product.serial_number: product for product in serialized_products().filter(
+        serial_number__in=serial_numbers)}
+    return (
+        [products[serial] for serial in serial_numbers if serial in products],
+        [serial for serial in serial_numbers if serial not in products],
+    )
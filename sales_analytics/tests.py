@@ -1,3 +1,1739 @@
-from django.test import TestCase
+import csv
+import json
+import logging
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin import site
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import caches
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction, IntegrityError
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import analytics, avatars, benchmark, caching, checkout, directory, onboarding, passwords, rollups, search_indexes, urls
+from .authentication import StatelessJWTAuthentication
+from .instrumentation import QueryInstrumentationMiddleware, fingerprint, view_stats
+from .models import Customer, SalesPerson, Manager, Branch, SalesPersonBranch, PaymentMethod, ProductCategory
+from .models import Product, Cart, Sale, CompletedSale, MonthlySales, OutboundEmail
+from .models import TransactionIdGenerator, generate_transaction_id, IdempotencyKey
+from .outbox import claim_due_emails, send_queued_emails
+from .admin import PaymentMethodAdmin
+from .analytics import invalidate_closed_periods
+from .caching import catalog_cache
+from .avatars import avatar_url
+from .catalog import search_products
+from .rollups import monthly_sales_from_history
+from .permissions import IsSalesperson, IsManager, CanCRUDCart
+from .serializers import ProductSerializer
+
+
+User = get_user_model()
+
+
+class SalesTestCase(TestCase):
+    """
+    Builds a salesperson assigned to a branch, a customer and a payment method.
+    """
+    def setUp(self):
+        for shared in caches.all():
+            shared.clear()
+        catalog_cache.clear()
+        self.user = User.objects.create_user(
+            username='jdoe@cowtrack.com', email='jdoe@cowtrack.com', password='secret',
+            first_name='John', last_name='Doe', role='salesperson')
+        self.salesperson = SalesPerson.objects.create(user=self.user, phone_number='0700000000')
+        self.branch = Branch.objects.create(
+            branch_name='Nairobi', phone_number='0711111111', email='nairobi@cowtrack.com')
+        SalesPersonBranch.objects.create(salesperson=self.salesperson, branch=self.branch)
+        customer_user = User.objects.create_user(
+            username='0722222222', password='secret', first_name='Jane', last_name='Roe', role='customer')
+        self.customer = Customer.objects.create(
+            user=customer_user, phone_number='0722222222', kra_pin='A000000001X',
+            contact_person='Jane', address='Nairobi')
+        self.payment_method = PaymentMethod.objects.create(method_name='Cash')
+        self.product = Product.objects.create(
+            product_name='Milk', cost_price=Decimal('40'), selling_price=Decimal('55.50'), branch=self.branch)
+
+    def add_lines(self, number_of_lines, number_of_items=2):
+        carts = Cart.objects.bulk_create([
+            Cart(product=self.product, customer=self.customer, number_of_items=number_of_items)
+            for _ in range(number_of_lines)
+        ])
+        Sale.objects.bulk_create([
+            Sale(salesperson=self.salesperson, cart=cart, awarded_points=1) for cart in carts
+        ])
+
+
+class CheckoutTests(SalesTestCase):
+    def test_totals_and_completes_open_sales(self):
+        self.add_lines(3)
+
+        completed_sale = checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+
+        self.assertEqual(completed_sale.total_amount.amount, Decimal('333.0000'))
+        self.assertEqual(completed_sale.branch_id, self.branch.pk)
+        self.assertFalse(checkout.open_sales(self.salesperson.pk).exists())
+
+    def test_empty_basket_is_rejected(self):
+        with self.assertRaises(checkout.ValidationError):
+            checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+        self.assertFalse(CompletedSale.objects.exists())
+
+    def test_query_count_does_not_grow_with_basket_size(self):
+        # the first checkout of the month also creates the monthly rollup row
+        self.add_lines(1)
+        checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+
+        query_counts = []
+        for number_of_lines in (1, 40, 500):
+            self.add_lines(number_of_lines)
+            with CaptureQueriesContext(connection) as queries:
+                checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+            query_counts.append(len(queries))
+
+        self.assertEqual(len(set(query_counts)), 1, query_counts)
+
+    def test_complete_sale_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = f'/users/salespersons/{self.salesperson.pk}/sales/complete_sale/'
+        self.add_lines(1)
+        checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+
+        query_counts = []
+        for number_of_lines in (1, 500):
+            self.add_lines(number_of_lines)
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post(url, {'payment_method': self.payment_method.pk}, format='json')
+            self.assertEqual(response.status_code, 200, response.data)
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(response.data['total_amount'], '55500.0000')
+
+
+class ReceiptTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_checkout_links_the_lines(self):
+        self.add_lines(1)
+        checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+        self.add_lines(3, number_of_items=1)
+        Sale.objects.filter(completed_sale__isnull=True).update(awarded_points=5)
+
+        completed_sale = checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+
+        self.assertEqual(completed_sale.line_count, 3)
+        self.assertEqual(completed_sale.awarded_points, 15)
+        self.assertEqual(completed_sale.lines.count(), 3)
+
+    def test_receipt_in_two_queries(self):
+        self.add_lines(4)
+        completed_sale = checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/users/completed-sales/{completed_sale.pk}/receipt/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['line_count'], 4)
+        self.assertEqual(len(response.data['lines']), 4)
+        line = response.data['lines'][0]
+        self.assertEqual(line['line_total'], '111.0000')
+        self.assertEqual(line['cart']['product']['product_name'], 'Milk')
+
+    def test_salespersons_only_get_their_own_receipts(self):
+        other_user = User.objects.create_user(username='other', password='secret', role='salesperson')
+        other = SalesPerson.objects.create(user=other_user, phone_number='0755555555')
+        completed_sale = CompletedSale.objects.create(
+            salesperson=other, branch=self.branch, total_amount=Decimal('10'), payment_method=self.payment_method)
+
+        response = self.client.get(f'/users/completed-sales/{completed_sale.pk}/receipt/')
+        self.assertEqual(response.status_code, 404)
+
+
+class IdempotentCheckoutTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/users/salespersons/{self.salesperson.pk}/sales/complete_sale/'
+
+    def checkout(self, key, payment_method=None):
+        return self.client.post(self.url, {'payment_method': payment_method or self.payment_method.pk},
+                                format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_response(self):
+        self.add_lines(2)
+        first = self.checkout('pos-1')
+        self.assertEqual(first.status_code, 200, first.data)
+
+        self.add_lines(1)
+        with self.assertNumQueries(1):
+            retry = self.checkout('pos-1')
+
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(CompletedSale.objects.count(), 1)
+        self.assertTrue(checkout.open_sales(self.salesperson.pk).exists())
+
+    def test_key_reused_for_another_request(self):
+        self.add_lines(1)
+        self.checkout('pos-1')
+
+        response = self.checkout('pos-1', payment_method=PaymentMethod.objects.create(method_name='Card').pk)
+        self.assertEqual(response.status_code, 400)
+
+    def test_failed_request_releases_the_key(self):
+        self.assertEqual(self.checkout('pos-1').status_code, 400)
+
+        self.add_lines(1)
+        self.assertEqual(self.checkout('pos-1').status_code, 200)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 200)
+
+    def test_concurrent_checkout_is_rolled_back(self):
+        self.add_lines(2)
+        open_sales = checkout.open_sales
+        calls = []
+
+        def racing(salesperson_id):
+            calls.append(salesperson_id)
+            if len(calls) == 2:
+                # another checkout claims the basket between the total and the update
+                Sale.objects.update(is_completed=1)
+            return open_sales(salesperson_id)
+
+        with mock.patch.object(checkout, 'open_sales', racing):
+            with self.assertRaises(checkout.ValidationError):
+                checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+        self.assertFalse(CompletedSale.objects.exists())
+
+    def test_purge(self):
+        self.add_lines(1)
+        self.checkout('pos-1')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+
+        call_command('purge_idempotency_keys', stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class MonthlySalesTests(SalesTestCase):
+    def test_checkout_updates_rollup(self):
+        for _ in range(2):
+            self.add_lines(2)
+            checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+
+        rollup = MonthlySales.objects.get(salesperson=self.salesperson)
+        self.assertEqual(rollup.number_of_sales, 2)
+        self.assertEqual(rollup.total_amount, Decimal('444.0000'))
+        self.assertEqual(rollup.branch_id, self.branch.pk)
+
+    def test_rebuild_matches_history(self):
+        self.add_lines(3)
+        checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+        CompletedSale.objects.create(
+            salesperson=self.salesperson, branch=self.branch, total_amount=Decimal('10'),
+            payment_method=self.payment_method)
+        MonthlySales.objects.update(number_of_sales=0, total_amount=0)
+
+        call_command('rebuild_monthly_sales', stdout=StringIO())
+
+        rollup = MonthlySales.objects.get(salesperson=self.salesperson)
+        self.assertEqual(rollup.number_of_sales, 2)
+        self.assertEqual(rollup.total_amount, Decimal('343.0000'))
+
+    def test_admin_edits_follow_the_rollup(self):
+        admin = User.objects.create_superuser(username='admin', password='secret', role='admin')
+        client = APIClient()
+        client.force_authenticate(admin)
+        other_branch = Branch.objects.create(
+            branch_name='Mombasa', phone_number='0733333333', email='mombasa@cowtrack.com')
+        sale = {'total_amount': '100.00', 'total_amount_currency': 'KES', 'branch': self.branch.pk,
+                'salesperson': self.salesperson.pk, 'payment_method': self.payment_method.pk}
+
+        created = client.post('/users/completed-sales/', sale, format='json')
+        self.assertEqual(created.status_code, 201, created.data)
+        client.post('/users/completed-sales/', {**sale, 'total_amount': '50.00'}, format='json')
+        self.assertEqual(
+            list(MonthlySales.objects.values_list('branch_id', 'number_of_sales', 'total_amount')),
+            [(self.branch.pk, 2, Decimal('150.0000'))])
+
+        client.patch(f'/users/completed-sales/{created.data["sale_id"]}/',
+                     {'total_amount': '70.00', 'total_amount_currency': 'KES', 'branch': other_branch.pk}, format='json')
+        self.assertEqual(
+            list(MonthlySales.objects.order_by('branch_id').values_list('branch_id', 'number_of_sales', 'total_amount')),
+            [(self.branch.pk, 1, Decimal('50.0000')), (other_branch.pk, 1, Decimal('70.0000'))])
+
+        client.delete(f'/users/completed-sales/{created.data["sale_id"]}/')
+        self.assertEqual(
+            list(MonthlySales.objects.values_list('branch_id', 'number_of_sales', 'total_amount')),
+            [(self.branch.pk, 1, Decimal('50.0000'))])
+        self.assert_matches_history()
+
+    def test_deleted_branches_share_one_rollup_row(self):
+        other_branch = Branch.objects.create(
+            branch_name='Mombasa', phone_number='0733333333', email='mombasa@cowtrack.com')
+        for branch in (self.branch, other_branch):
+            completed_sale = CompletedSale.objects.create(
+                salesperson=self.salesperson, branch=branch, total_amount=Decimal('10'),
+                payment_method=self.payment_method)
+            rollups.record_completed_sale(completed_sale)
+
+        admin = User.objects.create_superuser(username='admin', password='secret', role='admin')
+        client = APIClient()
+        client.force_authenticate(admin)
+        for branch in (self.branch, other_branch):
+            self.assertEqual(client.delete(f'/users/branches/{branch.pk}/').status_code, 204)
+
+        self.assertEqual(
+            list(MonthlySales.objects.values_list('branch_id', 'number_of_sales', 'total_amount')),
+            [(None, 2, Decimal('20.0000'))])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            MonthlySales.objects.create(salesperson=self.salesperson, year=2020, month=1)
+            MonthlySales.objects.create(salesperson=self.salesperson, year=2020, month=1)
+
+    def assert_matches_history(self):
+        self.assertEqual(
+            sorted(MonthlySales.objects.values_list('salesperson_id', 'branch_id', 'year', 'month', 'number_of_sales',
+                                                    'total_amount')),
+            sorted((row['salesperson_id'], row['branch_id'], row['year'], row['month'], row['number_of_sales'],
+                    row['total_amount']) for row in monthly_sales_from_history()))
+
+    def test_me_reads_monthly_sales(self):
+        self.add_lines(1)
+        checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get('/users/salespersons/me/')
+
+        self.assertEqual(response.status_code, 200)
+        [monthly_sales] = response.data['monthly_sales']
+        self.assertEqual(monthly_sales['number_of_sales'], 1)
+        self.assertEqual(monthly_sales['total_amount'], '111.0000')
+
+
+class PermissionTests(SalesTestCase):
+    def request_for(self, user, method='GET'):
+        request = APIRequestFactory().generic(method, '/')
+        request.user = user
+        return request
+
+    def test_role_checks_cost_no_queries(self):
+        request = self.request_for(User.objects.get(pk=self.user.pk))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(IsSalesperson().has_permission(request, None))
+            self.assertFalse(IsManager().has_permission(request, None))
+            self.assertTrue(CanCRUDCart().has_permission(request, None))
+
+    def test_cart_access_by_role(self):
+        self.assertFalse(CanCRUDCart().has_permission(self.request_for(self.customer.user), None))
+        self.assertFalse(CanCRUDCart().has_permission(self.request_for(AnonymousUser()), None))
+        self.assertFalse(IsSalesperson().has_permission(self.request_for(AnonymousUser()), None))
+
+
+class TokenAuthenticationTests(SalesTestCase):
+    def obtain_tokens(self):
+        response = APIClient().post(
+            '/auth/jwt/create/', {'username': self.user.username, 'password': 'secret'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_access_token_carries_role_claims(self):
+        access = AccessToken(self.obtain_tokens()['access'])
+
+        self.assertEqual(access['role'], 'salesperson')
+        self.assertEqual(access['sales_person_id'], self.salesperson.pk)
+        self.assertFalse(access['is_superuser'])
+
+    def test_read_only_requests_authenticate_without_queries(self):
+        access = self.obtain_tokens()['access']
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {access}')
+
+        with self.assertNumQueries(0):
+            request.user, _ = StatelessJWTAuthentication().authenticate(request)
+            self.assertTrue(IsSalesperson().has_permission(request, None))
+        self.assertEqual(request.user.pk, self.user.pk)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(client.get('/users/salespersons/me/').status_code, 200)
+
+    def test_views_outside_the_opt_in_get_the_user_row(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.obtain_tokens()["access"]}')
+
+        response = client.get('/auth/users/me/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['email'], 'jdoe@cowtrack.com')
+
+    def test_write_requests_load_the_user(self):
+        access = self.obtain_tokens()['access']
+        request = APIRequestFactory().post('/', HTTP_AUTHORIZATION=f'Bearer {access}')
+
+        user, _ = StatelessJWTAuthentication().authenticate(request)
+
+        self.assertIsInstance(user, User)
+
+    def test_refresh_is_refused_for_inactive_users(self):
+        refresh = self.obtain_tokens()['refresh']
+        client = APIClient()
+
+        self.assertEqual(client.post('/auth/jwt/refresh/', {'refresh': refresh}, format='json').status_code, 200)
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(client.post('/auth/jwt/refresh/', {'refresh': refresh}, format='json').status_code, 401)
+
+    def test_refresh_restamps_current_role(self):
+        refresh = self.obtain_tokens()['refresh']
+        User.objects.filter(pk=self.user.pk).update(role='manager')
+
+        response = APIClient().post('/auth/jwt/refresh/', {'refresh': refresh}, format='json')
+
+        self.assertEqual(AccessToken(response.data['access'])['role'], 'manager')
+
+
+class OutboxTests(SalesTestCase):
+    def reassign(self):
+        admin = User.objects.create_superuser(username='admin', password='secret', role='admin')
+        other_branch = Branch.objects.create(
+            branch_name='Mombasa', phone_number='0733333333', email='mombasa@cowtrack.com')
+        client = APIClient()
+        client.force_authenticate(admin)
+        return client.post(
+            f'/users/salespersons/{self.salesperson.pk}/branches/', {'branch': other_branch.pk}, format='json')
+
+    def test_reassignment_queues_emails_without_sending(self):
+        response = self.reassign()
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            list(OutboundEmail.objects.order_by('outbound_email_id').values_list('template_name', flat=True)),
+            ['termination', 'assignment'])
+
+    def test_worker_sends_queued_emails(self):
+        self.reassign()
+
+        call_command('send_queued_emails', stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].to, ['jdoe@cowtrack.com'])
+        self.assertIn('Mombasa', mail.outbox[1].body)
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENT).exists())
+
+    def test_failed_sends_are_retried_then_given_up(self):
+        self.reassign()
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            self.assertEqual(send_queued_emails(max_attempts=2, retry_delay=0), 0)
+            self.assertEqual(OutboundEmail.objects.filter(status=OutboundEmail.PENDING).count(), 2)
+            send_queued_emails(max_attempts=2, retry_delay=0)
+
+        self.assertEqual(OutboundEmail.objects.filter(status=OutboundEmail.FAILED, attempts=2).count(), 2)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_claimed_emails_are_leased_to_one_worker(self):
+        self.reassign()
+
+        claimed = claim_due_emails(batch_size=10, lease=60)
+
+        self.assertEqual(len(claimed), 2)
+        self.assertEqual(claim_due_emails(batch_size=10), [])
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENDING).exists())
+
+        # the worker died, once the lease runs out another one takes the emails over
+        OutboundEmail.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(send_queued_emails(), 2)
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENT).exists())
+
+    def test_connection_failure_is_recorded_as_an_attempt(self):
+        self.reassign()
+
+        with mock.patch('sales_analytics.outbox.get_connection', side_effect=OSError('smtp down')):
+            self.assertEqual(send_queued_emails(retry_delay=0), 0)
+
+        self.assertEqual(
+            list(OutboundEmail.objects.values_list('status', 'attempts', 'last_error')),
+            [(OutboundEmail.PENDING, 1, 'smtp down')] * 2)
+        self.assertEqual(send_queued_emails(), 2)
+
+
+class CartTotalsTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/users/customers/{self.customer.pk}/cart/'
+
+    def test_list_totals_lines_and_basket(self):
+        self.add_lines(3)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(response.data['results'][0]['total_price'], Decimal('111.0000'))
+        self.assertEqual(response.data['price'], Decimal('333.0000'))
+
+    def test_list_query_count_does_not_grow_with_cart_size(self):
+        query_counts = []
+        for number_of_lines in (1, 200):
+            self.add_lines(number_of_lines)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(self.url)
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_paginated_list_keeps_grand_total(self):
+        self.add_lines(15)
+
+        response = self.client.get(self.url, {'page': 2})
+
+        self.assertEqual(response.data['count'], 15)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(response.data['price'], Decimal('1665.0000'))
+
+
+class BulkCartTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/users/customers/{self.customer.pk}/cart/bulk/'
+        self.bread = Product.objects.create(
+            product_name='Bread', cost_price=Decimal('50'), selling_price=Decimal('65'), branch=self.branch)
+
+    def test_adds_all_lines_and_returns_basket_total(self):
+        self.add_lines(1)
+        lines = [
+            {'product': self.product.pk, 'number_of_items': 1},
+            {'product': self.bread.pk, 'number_of_items': 3},
+        ]
+
+        response = self.client.post(self.url, lines, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual([line['total_price'] for line in response.data['results']],
+                         [Decimal('55.5000'), Decimal('195.0000')])
+        self.assertEqual(response.data['price'], Decimal('361.5000'))
+        self.assertEqual(Cart.objects.filter(customer=self.customer).count(), 3)
+
+    def test_query_count_does_not_grow_with_number_of_lines(self):
+        query_counts = []
+        for number_of_lines in (1, 60):
+            lines = [{'product': self.bread.pk, 'number_of_items': 1}] * number_of_lines
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(self.url, lines, format='json')
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_reports_errors_per_line_and_inserts_nothing(self):
+        lines = [
+            {'product': self.product.pk, 'number_of_items': 1},
+            {'product': 999999, 'number_of_items': 1},
+            {'product': self.bread.pk, 'number_of_items': 0},
+        ]
+
+        response = self.client.post(self.url, lines, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('number_of_items', response.data[2])
+        self.assertFalse(Cart.objects.exists())
+
+        response = self.client.post(self.url, lines[:2], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product', response.data[1])
+        self.assertFalse(Cart.objects.exists())
+
+
+class TransactionIdTests(SalesTestCase):
+    def test_ids_keep_the_cwt_shape_and_are_unique(self):
+        transaction_ids = [generate_transaction_id() for _ in range(1000)]
+
+        self.assertEqual(len(set(transaction_ids)), 1000)
+        self.assertEqual(transaction_ids, sorted(transaction_ids))
+        for transaction_id in transaction_ids[:10]:
+            self.assertRegex(transaction_id, r'^CWT\d{7}[A-Z]{4}\d{5}$')
+
+    def test_sequence_overflow_borrows_next_minute(self):
+        generator = TransactionIdGenerator()
+        generator()
+        generator._sequence = TransactionIdGenerator.MAX_SEQUENCE - 1
+        minute = generator._minute
+
+        generator()
+
+        self.assertEqual(generator._minute, minute + 1)
+        self.assertEqual(generator._sequence, 0)
+
+    def test_clashing_ids_are_drawn_again(self):
+        # another process that drew the same node and minute took the id first
+        self.add_lines(1)
+        taken = Sale.objects.get().transaction_id
+        carts = Cart.objects.bulk_create([Cart(product=self.product, customer=self.customer, number_of_items=1)] * 3)
+
+        sale = Sale(salesperson=self.salesperson, cart=carts[0], awarded_points=1, transaction_id=taken)
+        sale.save()
+        Sale.objects.bulk_create([
+            Sale(salesperson=self.salesperson, cart=cart, awarded_points=1, transaction_id=taken) for cart in carts[1:]
+        ])
+
+        self.assertNotEqual(sale.transaction_id, taken)
+        self.assertEqual(Sale.objects.values('transaction_id').distinct().count(), 4)
+
+    def test_other_integrity_errors_are_not_retried(self):
+        with mock.patch('sales_analytics.models.generate_transaction_id') as generate:
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                Sale(salesperson=self.salesperson, awarded_points=None).save()
+
+        generate.assert_not_called()
+
+    def test_bulk_created_sales_get_distinct_ids(self):
+        self.add_lines(50)
+
+        self.assertEqual(Sale.objects.values('transaction_id').distinct().count(), 50)
+
+    def test_lookup_by_transaction_id(self):
+        admin = User.objects.create_superuser(username='admin', password='secret', role='admin')
+        self.add_lines(3)
+        sale = Sale.objects.order_by('sale_id')[1]
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        with self.assertNumQueries(1):
+            response = client.get(f'/users/transactions/{sale.transaction_id}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['sale_id'], sale.sale_id)
+
+
+def explain(sql, params=()):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def is_table_scan(detail):
+    # SCAN <table> with no index; SCAN ... USING (COVERING) INDEX still walks an index
+    return detail.startswith('SCAN ') and ' USING ' not in detail and not detail.startswith('SCAN CONSTANT')
+
+
+class QueryPlanTests(SalesTestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every SELECT issued by the hot endpoints and
+    fails if SQLite would read a whole table to answer it.
+
+    Unfiltered listings are allowed to walk their own table, which they page
+    through anyway, but every join and filter must still be index backed.
+    """
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(username='admin', password='secret', role='admin')
+        self.add_lines(3)
+
+    def plans_for(self, user, method, url, data=None):
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 400, response.data)
+        return [
+            (query['sql'], explain(query['sql']))
+            for query in queries.captured_queries if query['sql'].startswith('SELECT')
+        ]
+
+    def assertNoTableScans(self, user, method, url, data=None, scans_allowed=0):
+        for sql, plan in self.plans_for(user, method, url, data):
+            scans = [detail for detail in plan if is_table_scan(detail)]
+            self.assertLessEqual(len(scans), scans_allowed, f'{url}\n{sql}\n{plan}')
+
+    def test_nested_routes_use_indexes(self):
+        salesperson_pk = self.salesperson.pk
+        self.assertNoTableScans(self.admin, 'get', f'/users/salespersons/{salesperson_pk}/branches/')
+        self.assertNoTableScans(self.user, 'get', f'/users/salespersons/{salesperson_pk}/sales/')
+        self.assertNoTableScans(self.user, 'get', f'/users/customers/{self.customer.pk}/cart/')
+
+    def test_dashboard_and_checkout_use_indexes(self):
+        self.assertNoTableScans(self.user, 'get', '/users/salespersons/me/')
+        self.assertNoTableScans(
+            self.user, 'post', f'/users/salespersons/{self.salesperson.pk}/sales/complete_sale/',
+            {'payment_method': self.payment_method.pk})
+
+    def assertQuerysetUsesIndexes(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        plan = explain(sql, params)
+        self.assertFalse([detail for detail in plan if is_table_scan(detail)], f'{sql}\n{plan}')
+
+    def test_monthly_sales_history_uses_indexes(self):
+        self.assertQuerysetUsesIndexes(monthly_sales_from_history(
+            CompletedSale.objects.filter(salesperson_id=self.salesperson.pk)))
+
+    def test_open_sales_use_composite_index(self):
+        plan = explain(*checkout.open_sales(self.salesperson.pk).query.sql_with_params())
+        self.assertIn('sale_salesperson_open_idx', plan[0])
+
+    def test_product_filters_use_indexes(self):
+        self.assertQuerysetUsesIndexes(Product.objects.filter(branch_id=self.branch.pk, category_id=1))
+
+    def test_listings_only_walk_their_own_table(self):
+        for url in ('/users/customers/', '/users/all-users/', '/users/salespersons/', '/users/managers/',
+                    '/users/suppliers/', '/users/branches/', '/users/products/', '/users/product-categories/',
+                    '/users/payment-methods/', '/users/completed-sales/'):
+            self.assertNoTableScans(self.admin, 'get', url, scans_allowed=1)
+
+
+class KeysetPaginationTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='secret'))
+
+        completed_sales = CompletedSale.objects.bulk_create([
+            CompletedSale(salesperson=self.salesperson, branch=self.branch, total_amount=Decimal(i))
+            for i in range(25)
+        ])
+        # groups of three sales completed at the same instant exercise the tiebreaker
+        start = timezone.now()
+        for i, completed_sale in enumerate(completed_sales):
+            completed_sale.completed_at = start - timedelta(minutes=i // 3)
+        CompletedSale.objects.bulk_update(completed_sales, ['completed_at'])
+        self.expected = list(CompletedSale.objects.order_by('-completed_at', '-sale_id').values_list('pk', flat=True))
+
+    def walk(self, url, link):
+        pages = []
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertNotIn('count', response.data)
+            pages.append([row['sale_id'] for row in response.data['results']])
+            url = response.data[link]
+        return pages
+
+    def test_walks_forward_and_back(self):
+        pages = self.walk('/users/completed-sales/?cursor=', 'next')
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), self.expected)
+
+        last_page = self.client.get('/users/completed-sales/?cursor=').data
+        for _ in range(2):
+            last_page = self.client.get(last_page['next']).data
+        backwards = self.walk(last_page['previous'], 'previous')
+        self.assertEqual(backwards, [pages[1], pages[0]])
+
+    def test_page_numbers_without_cursor(self):
+        response = self.client.get('/users/completed-sales/?page=2')
+
+        self.assertEqual(response.data['count'], 25)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/users/completed-sales/?cursor=bm9wZQ').status_code, 404)
+
+    def test_pages_are_read_from_an_index(self):
+        self.add_lines(15)
+        Product.objects.bulk_create([Product(product_name=f'Product {i}', cost_price=1, selling_price=2) for i in range(15)])
+        salesperson_client = APIClient()
+        salesperson_client.force_authenticate(self.user)
+
+        for client, url in ((self.client, '/users/completed-sales/?cursor='),
+                            (self.client, '/users/products/?cursor='),
+                            (salesperson_client, f'/users/salespersons/{self.salesperson.pk}/sales/?cursor=')):
+            second_page = client.get(url).data['next']
+            with CaptureQueriesContext(connection) as queries:
+                client.get(second_page)
+            [query] = queries.captured_queries
+            plan = explain(query['sql'])
+            self.assertFalse([detail for detail in plan if is_table_scan(detail) or 'TEMP B-TREE' in detail],
+                             f'{url}\n{query["sql"]}\n{plan}')
+
+
+class CompletedSaleExportTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='secret'))
+        self.other_branch = Branch.objects.create(
+            branch_name='Mombasa', phone_number='0733333333', email='mombasa@cowtrack.com')
+
+        self.sales = CompletedSale.objects.bulk_create([
+            CompletedSale(salesperson=self.salesperson, branch=branch, payment_method=self.payment_method,
+                          total_amount=Decimal('111.00'))
+            for branch in (self.branch, self.branch, self.other_branch)
+        ])
+        for days, completed_sale in zip((10, 2, 2), self.sales):
+            completed_sale.completed_at = timezone.now() - timedelta(days=days)
+        CompletedSale.objects.bulk_update(self.sales, ['completed_at'])
+
+    def export(self, query):
+        response = self.client.get(f'/users/completed-sales/export/?{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        with self.assertNumQueries(1):
+            return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_filtered_by_branch_and_days(self):
+        since = (timezone.localdate() - timedelta(days=3)).isoformat()
+        response, content = self.export(f'branch={self.branch.pk}&start={since}')
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        header, *rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(header[:4], ['sale_id', 'completed_at', 'total_amount', 'currency'])
+        self.assertEqual([row[0] for row in rows], [str(self.sales[1].pk)])
+        self.assertEqual(rows[0][2:4], ['111.0000', 'KES'])
+        self.assertEqual(rows[0][5:], ['Nairobi', str(self.salesperson.pk), 'John', 'Doe',
+                                       str(self.payment_method.pk), 'Cash'])
+
+    def test_ndjson_in_completion_order(self):
+        response, content = self.export(f'output=ndjson&salesperson={self.salesperson.pk}')
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row['sale_id'] for row in rows], [sale.pk for sale in self.sales])
+        self.assertEqual(rows[2]['branch_name'], 'Mombasa')
+
+    def test_rejects_bad_parameters(self):
+        self.assertEqual(self.client.get('/users/completed-sales/export/?output=xml').status_code, 400)
+        self.assertEqual(
+            self.client.get('/users/completed-sales/export/?start=2024-02-01&end=2024-01-01').status_code, 400)
+
+
+class SalesAnalyticsTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        manager_user = User.objects.create_user(username='manager', password='secret', role='manager')
+        Manager.objects.create(user=manager_user, phone_number='0744444444')
+        self.client = APIClient()
+        self.client.force_authenticate(manager_user)
+
+        self.other_branch = Branch.objects.create(
+            branch_name='Mombasa', phone_number='0733333333', email='mombasa@cowtrack.com')
+        self.mpesa = PaymentMethod.objects.create(method_name='M-PESA')
+        self.today = timezone.localdate()
+        self.complete(0, self.branch, self.payment_method, '100')
+        self.complete(3, self.branch, self.mpesa, '20')
+        self.complete(3, self.other_branch, self.payment_method, '5')
+        self.complete(40, self.other_branch, self.payment_method, '1')
+
+    def complete(self, days_ago, branch, payment_method, amount):
+        completed_sale = CompletedSale.objects.create(
+            salesperson=self.salesperson, branch=branch, payment_method=payment_method, total_amount=Decimal(amount))
+        CompletedSale.objects.filter(pk=completed_sale.pk).update(
+            completed_at=timezone.now() - timedelta(days=days_ago))
+        return completed_sale
+
+    def analytics(self, query, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(f'/users/analytics/?{query}')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['results']
+
+    def days_ago(self, days):
+        return self.today - timedelta(days=days)
+
+    def test_daily_sales_by_branch(self):
+        rows = self.analytics(f'dimensions=branch&start={self.days_ago(7)}', queries=1)
+
+        self.assertEqual([(row['period'], row['branch_name'], row['number_of_sales'], row['total_amount']) for row in rows], [
+            (self.days_ago(3), 'Nairobi', 1, '20.0000'),
+            (self.days_ago(3), 'Mombasa', 1, '5.0000'),
+            (self.today, 'Nairobi', 1, '100.0000'),
+        ])
+
+    def test_monthly_sales_by_payment_method(self):
+        rows = self.analytics(f'granularity=month&dimensions=payment_method&start={self.days_ago(60)}', queries=1)
+
+        totals = {}
+        for row in rows:
+            totals[row['payment_method_name']] = totals.get(row['payment_method_name'], 0) + row['number_of_sales']
+        self.assertEqual(totals, {'Cash': 3, 'M-PESA': 1})
+        self.assertTrue(all(row['period'].day == 1 for row in rows))
+
+    def test_closed_periods_are_cached(self):
+        query = f'dimensions=branch&start={self.days_ago(7)}'
+        self.analytics(query, queries=1)
+
+        # a sale in the open period is counted, one backdated without invalidation is not
+        self.complete(0, self.branch, self.payment_method, '100')
+        self.complete(3, self.branch, self.payment_method, '1000')
+        rows = self.analytics(query, queries=1)
+        self.assertEqual([row['number_of_sales'] for row in rows], [1, 1, 2])
+
+        # the same range without the open period needs no query at all
+        self.analytics(f'dimensions=branch&start={self.days_ago(7)}&end={self.days_ago(1)}', queries=0)
+
+        invalidate_closed_periods()
+        rows = self.analytics(query, queries=1)
+        self.assertEqual([row['number_of_sales'] for row in rows], [2, 1, 2])
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'analytics': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'analytics'},
+    }, ANALYTICS_CACHE='analytics')
+    def test_closed_periods_live_in_the_shared_cache(self):
+        shared = caches['analytics']
+        shared.clear()
+        self.addCleanup(shared.clear)
+        query = f'dimensions=branch&start={self.days_ago(7)}&end={self.days_ago(1)}'
+        self.analytics(query, queries=1)
+
+        version = shared.get(analytics.VERSION_KEY)
+        self.assertIsNotNone(version)
+        self.assertIsNone(caches['default'].get(analytics.VERSION_KEY))
+
+        # another worker invalidating through the shared cache
+        shared.incr(analytics.VERSION_KEY)
+        self.analytics(query, queries=1)
+        self.analytics(query, queries=0)
+
+    def test_editing_a_past_sale_invalidates_the_cache(self):
+        old_sale = CompletedSale.objects.get(branch=self.other_branch, total_amount=Decimal('5'))
+        query = f'dimensions=branch&start={self.days_ago(7)}'
+        self.analytics(query, queries=1)
+
+        admin = APIClient()
+        admin.force_authenticate(User.objects.create_superuser(username='admin', password='secret'))
+        self.assertEqual(admin.delete(f'/users/completed-sales/{old_sale.pk}/').status_code, 204)
+
+        rows = self.analytics(query, queries=1)
+        self.assertNotIn('Mombasa', [row['branch_name'] for row in rows])
+
+    def test_renaming_a_branch_invalidates_the_cache(self):
+        query = f'dimensions=branch&start={self.days_ago(7)}&end={self.days_ago(1)}'
+        self.analytics(query, queries=1)
+
+        admin = APIClient()
+        admin.force_authenticate(User.objects.create_superuser(username='admin', password='secret'))
+        response = admin.patch(f'/users/branches/{self.other_branch.pk}/', {'branch_name': 'Kisumu'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+
+        rows = self.analytics(query, queries=1)
+        self.assertEqual([row['branch_name'] for row in rows], ['Nairobi', 'Kisumu'])
+
+    def test_renaming_a_payment_method_in_the_admin_invalidates_the_cache(self):
+        query = f'dimensions=payment_method&start={self.days_ago(7)}&end={self.days_ago(1)}'
+        self.analytics(query, queries=1)
+
+        self.mpesa.method_name = 'Airtel Money'
+        PaymentMethodAdmin(PaymentMethod, site).save_model(RequestFactory().post('/'), self.mpesa, None, True)
+
+        rows = self.analytics(query, queries=1)
+        self.assertIn('Airtel Money', [row['payment_method_name'] for row in rows])
+        self.assertNotIn('M-PESA', [row['payment_method_name'] for row in rows])
+
+    def test_access_and_validation(self):
+        salesperson = APIClient()
+        salesperson.force_authenticate(self.user)
+        self.assertEqual(salesperson.get('/users/analytics/').status_code, 403)
+
+        self.assertEqual(self.client.get('/users/analytics/?dimensions=colour').status_code, 400)
+        self.assertEqual(self.client.get('/users/analytics/?granularity=year').status_code, 400)
+        response = self.client.get('/users/analytics/?granularity=week')
+        self.assertEqual(response.data['start'], self.today - timedelta(days=self.today.weekday() + 77))
+
+
+SEED_FIXTURE = """
+insert into core_user (id, password, last_login, is_superuser, username, first_name, last_name, email, is_staff, is_active, date_joined, role) values (901, 'c4ca4238a0b923820dcc509a6f75849b', '2023/07/28', 0, 'seeded', 'O''Brien', 'Seed', 'seed@cowtrack.com', 0, 1, '2022-06-22', 'salesperson');
+insert into sales_analytics_salesperson (sales_person_id, phone_number, user_id) values (901, '(561) 5176116', 901);
+insert into sales_analytics_branch (branch_id, branch_name, phone_number, email, opening_date) values (901, 'Seed; Branch', '(429) 6135131', 'seed@branch.io', '2010-12-24');
+insert into sales_analytics_salespersonbranch (salesperson_branch_id, salesperson_id, branch_id, assignment_date) values (901, 901, 901, '5/29/2022');
+insert into sales_analytics_product (product_id, product_name, cost_price_currency, cost_price, selling_price_currency, selling_price, is_serialized, serial_number, branch_id, category_id) values (901, 'Kiwi', 'KSH', 8401.4346, 'KSH', 7053.7715, 1, 'O37IGUA6', 901, 999);
+insert into sales_analytics_cart (cart_id, number_of_items, product_id) values (901, 2, 901), (902, 1, 901);
+insert into sales_analytics_sale (sale_id, amount_currency, amount, transaction_date, awarded_points, cart_id, payment_method_id, sales_person_id, transaction_id) values (901, 'KES', 8602.4621, '2022-12-26', 71, 901, 2, 901, '471205440-9');
+insert into sales_analytics_sale (sale_id, amount_currency, amount, transaction_date, awarded_points, cart_id, payment_method_id, sales_person_id, transaction_id) values (902, 'KES', 7.4826, '2022-07-03', 146, 999, 1, 901, '471205440-9');
+"""
+
+
+class LoadSeedTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.data = Path(directory.name)
+        (self.data / 'seed.sql').write_text(SEED_FIXTURE)
+
+    def test_maps_legacy_columns(self):
+        call_command('load_seed', str(self.data), stdout=StringIO())
+
+        sale = Sale.objects.get(pk=902)
+        self.assertEqual(sale.salesperson_id, 901)
+        self.assertIsNone(sale.cart_id)
+        self.assertTrue(sale.is_completed)
+        self.assertNotEqual(sale.transaction_id, Sale.objects.get(pk=901).transaction_id)
+
+        product = Product.objects.get(pk=901)
+        self.assertEqual(product.selling_price.currency.code, 'KES')
+        self.assertIsNone(product.category_id)
+        self.assertEqual(Branch.objects.get(pk=901).branch_name, 'Seed; Branch')
+        self.assertEqual(User.objects.get(pk=901).first_name, "O'Brien")
+        self.assertEqual(SalesPersonBranch.objects.get(pk=901).assignment_date.isoformat(), '2022-05-29T00:00:00+00:00')
+
+    def test_scale_creates_disjoint_copies(self):
+        call_command('load_seed', str(self.data), scale=3, stdout=StringIO())
+
+        self.assertEqual(Sale.objects.count(), 6)
+        self.assertEqual(User.objects.filter(username__endswith='seeded').count(), 3)
+        # keys of each copy are shifted by the largest key of the table
+        copy = Cart.objects.get(pk=902 + 902)
+        self.assertEqual(copy.product_id, 901 + 901)
+        self.assertEqual(SalesPerson.objects.get(pk=901 + 2 * 901).user.username, 's2-seeded')
+
+    def test_refuses_to_load_over_existing_rows(self):
+        call_command('load_seed', str(self.data), stdout=StringIO())
+
+        with self.assertRaises(CommandError):
+            call_command('load_seed', str(self.data), stdout=StringIO())
+        call_command('load_seed', str(self.data), flush=True, stdout=StringIO())
+
+    def test_flush_keeps_other_accounts_and_cascades(self):
+        call_command('load_seed', str(self.data), stdout=StringIO())
+        admin = User.objects.create_superuser(username='admin', password='secret')
+        completed_sale = CompletedSale.objects.create(salesperson_id=901, branch_id=901, total_amount=Decimal('10'))
+
+        call_command('load_seed', str(self.data), flush=True, stdout=StringIO())
+
+        self.assertTrue(User.objects.filter(pk=admin.pk).exists())
+        self.assertEqual(User.objects.get(pk=901).username, 'seeded')
+        # the replaced salesperson and branch are new rows, not the ones the sale was made by
+        completed_sale.refresh_from_db()
+        self.assertIsNone(completed_sale.salesperson_id)
+        self.assertIsNone(completed_sale.branch_id)
+
+    def test_flush_never_replaces_staff_accounts(self):
+        call_command('load_seed', str(self.data), stdout=StringIO())
+        User.objects.filter(pk=901).update(is_staff=True)
+
+        with self.assertRaisesMessage(CommandError, 'staff accounts seeded'):
+            call_command('load_seed', str(self.data), flush=True, stdout=StringIO())
+        self.assertTrue(User.objects.filter(pk=901, is_staff=True).exists())
+        self.assertEqual(Sale.objects.count(), 2)
+
+
+class InstrumentationTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        view_stats.reset()
+        self.addCleanup(view_stats.reset)
+        self.staff = User.objects.create_user(username='staff', password='secret', is_staff=True)
+
+    def staff_request(self, path):
+        request = RequestFactory().get(path)
+        request.user = self.staff
+        return request
+
+    def test_fingerprint_ignores_parameters(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM "product" WHERE "id" IN (%s, %s, %s) AND "name" = \'Milk\' LIMIT 21'),
+            fingerprint('SELECT * FROM "product" WHERE "id" IN (%s) AND "name" = \'Bread\' LIMIT 21'),
+        )
+
+    def test_middleware_reports_repeated_queries(self):
+        def view(request):
+            for product_id in range(3):
+                list(Product.objects.filter(pk=product_id))
+            return HttpResponse()
+
+        with self.assertLogs('sales_analytics.instrumentation', 'INFO') as logs:
+            response = QueryInstrumentationMiddleware(view)(self.staff_request('/n-plus-one/'))
+
+        self.assertIn('desc="3 queries"', response['Server-Timing'])
+        self.assertIn('dup;desc="3 repeated queries"', response['Server-Timing'])
+        self.assertEqual(logs.records[0].queries, 3)
+        self.assertIn('ran 3 times', logs.output[1])
+
+        [stats] = view_stats.snapshot()
+        self.assertEqual((stats['view'], stats['requests'], stats['max_queries']), ('unresolved', 1, 3))
+        self.assertEqual(stats['duplicate_requests'], 1)
+
+    def test_streamed_bodies_are_measured(self):
+        def rows():
+            for product_id in range(3):
+                yield str(list(Product.objects.filter(pk=product_id)))
+
+        def view(request):
+            list(Product.objects.all())
+            return StreamingHttpResponse(rows())
+
+        with self.assertLogs('sales_analytics.instrumentation', 'INFO') as logs:
+            response = QueryInstrumentationMiddleware(view)(self.staff_request('/export/'))
+            self.assertIn('desc="1 queries"', response['Server-Timing'])
+            self.assertEqual(view_stats.snapshot(), [])
+            b''.join(response.streaming_content)
+
+        self.assertEqual(logs.records[0].queries, 4)
+        [stats] = view_stats.snapshot()
+        self.assertEqual((stats['requests'], stats['max_queries'], stats['duplicate_requests']), (1, 4, 1))
+
+    def test_server_timing_is_for_staff_only(self):
+        client = APIClient()
+        self.assertNotIn('Server-Timing', client.get('/users/products/'))
+        client.force_authenticate(self.user)
+        self.assertNotIn('Server-Timing', client.get('/users/products/'))
+        client.force_authenticate(self.staff)
+        self.assertIn('Server-Timing', client.get('/users/products/'))
+
+        with override_settings(DEBUG=True):
+            self.assertIn('Server-Timing', APIClient().get('/users/products/'))
+
+    def test_stats_endpoint_is_admin_only(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/users/query-stats/').status_code, 403)
+
+        client.force_authenticate(User.objects.create_superuser(username='admin', password='secret'))
+        client.get('/users/products/')
+        response = client.get('/users/query-stats/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('products-list-list', [row['view'] for row in response.data])
+        self.assertIn('Server-Timing', response)
+
+        self.assertEqual(client.post('/users/query-stats/reset/').status_code, 204)
+        # only the reset request itself is left
+        self.assertEqual([row['view'] for row in view_stats.snapshot()], ['query-stats-reset'])
+
+
+class FlatReadSerializerTests(SalesTestCase):
+    def test_render_the_same_json_as_the_nested_serializers(self):
+        results = benchmark.compare_serializers(count=50, repeat=1)
+        self.assertEqual(set(results), {'salesperson', 'customer', 'manager', 'supplier', 'cart', 'sale',
+                                        'completed sale', 'salesperson branch'})
+        for name, result in results.items():
+            self.assertTrue(result['identical'], name)
+
+    @override_settings(TIME_ZONE='Africa/Nairobi')
+    def test_render_datetimes_in_the_current_timezone(self):
+        for name, result in benchmark.compare_serializers(count=10, repeat=1).items():
+            self.assertTrue(result['identical'], name)
+
+    def test_completed_sales_endpoint(self):
+        self.add_lines(2)
+        checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser(username='admin', password='secret'))
+
+        with self.assertNumQueries(2):
+            response = client.get('/users/completed-sales/')
+
+        expected = benchmark.NestedCompletedSaleReadSerializer(
+            CompletedSale.objects.all(), many=True, context={'request': response.wsgi_request}).data
+        self.assertEqual(response.content, JSONRenderer().render({
+            'count': 1, 'next': None, 'previous': None, 'results': expected,
+        }))
+
+
+class OnboardingTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='secret'))
+
+    def salesperson_rows(self, number_of_rows):
+        return [
+            {'email': f'staff{i}@cowtrack.com', 'first_name': 'Staff', 'last_name': f'Member{i}',
+             'phone_number': '0700000000', 'password': f'Tr1cky-passw0rd-{i}'}
+            for i in range(number_of_rows)
+        ]
+
+    def test_bulk_creates_users_and_profiles(self):
+        # the username lookup and one insert each for the users and profiles, in a savepoint
+        with self.assertNumQueries(5):
+            response = self.client.post('/users/onboarding/?role=salesperson', self.salesperson_rows(30), format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['created'], 30)
+        salesperson = SalesPerson.objects.select_related('user').get(user__username='staff3@cowtrack.com')
+        self.assertEqual(salesperson.user.role, 'salesperson')
+        self.assertTrue(salesperson.user.check_password('Tr1cky-passw0rd-3'))
+
+    def test_rows_are_hashed_across_processes(self):
+        rows = self.salesperson_rows(passwords.MIN_POOL_PASSWORDS)
+        profiles, errors = onboarding.onboard(User.SALESPERSON, rows, hash_workers=2)
+
+        self.assertEqual(errors, [])
+        self.assertTrue(profiles[-1].user.check_password(rows[-1]['password']))
+
+    def test_per_row_errors(self):
+        rows = self.salesperson_rows(3)
+        rows[0]['email'] = 'jdoe@cowtrack.com'
+        rows[1]['password'] = '123'
+        rows[2]['email'] = rows[0]['email']
+
+        response = self.client.post('/users/onboarding/?role=salesperson', rows, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['row'] for error in response.data['errors']], [0, 1, 2])
+        self.assertIn('username', response.data['errors'][2]['errors'])
+        self.assertEqual(SalesPerson.objects.count(), 1)
+
+    def test_csv_customers_without_passwords(self):
+        body = (
+            'phone_number,first_name,last_name,kra_pin,contact_person,address,password_hash\n'
+            '0790000001,Ann,One,A100,Ann,Nairobi,\n'
+            '0790000002,Bob,Two,A101,Bob,Nakuru,md5$$5f4dcc3b5aa765d61d8327deb882cf99\n'
+        )
+        response = self.client.post('/users/onboarding/?role=customer', body, content_type='text/csv')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        ann, bob = User.objects.filter(role='customer', username__startswith='079').order_by('username')
+        self.assertFalse(ann.has_usable_password())
+        self.assertEqual(bob.password, 'md5$$5f4dcc3b5aa765d61d8327deb882cf99')
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as file:
+            json.dump(self.salesperson_rows(2), file)
+            file.flush()
+            call_command('onboard', 'manager', file.name, stdout=StringIO())
+
+        self.assertEqual(Manager.objects.count(), 2)
+
+
+class DirectoryTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='secret'))
+
+    def search(self, q, **params):
+        response = self.client.get('/users/directory/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [(row['role'], row['profile_id']) for row in response.data]
+
+    def test_prefix_search_across_roles(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.search('jo'), [('salesperson', self.salesperson.pk)])
+        self.assertEqual(self.search('jan ro'), [('customer', self.customer.pk)])
+        self.assertEqual(self.search('0722'), [('customer', self.customer.pk)])
+        self.assertEqual(self.search('jdoe@cowtrack'), [('salesperson', self.salesperson.pk)])
+        self.assertEqual(self.search('cowtrack', role='customer'), [])
+        self.assertEqual(self.search('"OR*'), [])
+
+    def test_kept_in_sync(self):
+        self.user.first_name = 'Jonathan'
+        self.user.save()
+        self.salesperson.phone_number = '0788888888'
+        self.salesperson.save()
+        self.assertEqual(self.search('jonath 07888'), [('salesperson', self.salesperson.pk)])
+
+        manager_user = User.objects.create_user(username='mary@cowtrack.com', first_name='Mary', role='manager')
+        manager = Manager.objects.create(user=manager_user, phone_number='0733333333')
+        self.assertEqual(self.search('mary'), [('manager', manager.pk)])
+
+        manager_user.delete()
+        self.assertEqual(self.search('mary'), [])
+
+    def test_bulk_onboarding_is_indexed(self):
+        onboarding.onboard(User.SUPPLIER, [{
+            'email': 'dairy@supplies.com', 'first_name': 'Dairy', 'last_name': 'Supplies',
+            'phone_number': '0766666666', 'kra_pin': 'P000000001X', 'contact_person': 'Dan',
+        }])
+        self.assertEqual(self.search('dairy')[0][0], 'supplier')
+
+    def test_search_without_fts(self):
+        rows = directory.search_profiles(['jan', 'ro'], None, 20)
+        self.assertEqual([(row['role'], row['profile_id']) for row in rows], [('customer', self.customer.pk)])
+
+    def test_salespersons_cannot_search(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/users/directory/', {'q': 'jo'}).status_code, 403)
+
+
+
+class SearchIndexRemakeTests(TransactionTestCase):
+    """
+    The SQLite schema editor remakes a table to alter a column, outside of any transaction.
+    """
+    def setUp(self):
+        user = User.objects.create_user(username='0722222222', first_name='Jane', last_name='Roe', role='customer')
+        Customer.objects.create(user=user, phone_number='0722222222', kra_pin='A000000001X',
+                                contact_person='Jane', address='Nairobi')
+
+    def remake(self, model, name):
+        """
+        Widen a column and narrow it back, remaking the table twice.
+        """
+        old_field = model._meta.get_field(name)
+        new_field = old_field.clone()
+        new_field.max_length = old_field.max_length + 5
+        new_field.set_attributes_from_name(name)
+        new_field.model = model
+        with connection.schema_editor() as editor:
+            editor.alter_field(model, old_field, new_field)
+        with connection.schema_editor() as editor:
+            editor.alter_field(model, new_field, old_field)
+
+    def assert_directory_in_sync(self):
+        User.objects.filter(username='0722222222').update(first_name='Janet')
+        user = User.objects.create_user(username='0733333333', first_name='Mary', role='customer')
+        Customer.objects.create(user=user, phone_number='0733333333', kra_pin='A000000002X',
+                                contact_person='Mary', address='Thika')
+        self.assertEqual([row['first_name'] for row in directory.search_people(['janet'])], ['Janet'])
+        self.assertEqual([row['first_name'] for row in directory.search_people(['mary'])], ['Mary'])
+
+    def test_triggers_suspended_around_a_remake(self):
+        with search_indexes.triggers_suspended(connection):
+            self.remake(Customer, 'phone_number')
+        self.assert_directory_in_sync()
+
+    def test_product_table_remake(self):
+        product = Product.objects.create(product_name='Milk', cost_price=Decimal('1'), selling_price=Decimal('2'))
+        with search_indexes.triggers_suspended(connection):
+            self.remake(Product, 'product_name')
+        product.product_name = 'Fresh Yoghurt'
+        product.save()
+        Product.objects.create(product_name='Fresh Cream', cost_price=Decimal('1'), selling_price=Decimal('2'))
+
+        names = lambda *terms: sorted(search_products(Product.objects.all(), search=list(terms)).values_list(
+            'product_name', flat=True))
+        self.assertEqual(names('fresh'), ['Fresh Cream', 'Fresh Yoghurt'])
+        self.assertEqual(names('milk'), [])
+
+    def test_migrate_suspends_the_triggers(self):
+        plan = [(None, False)]
+        search_indexes.suspend_before_migrate(sender=None, using='default', plan=plan)
+        self.remake(Customer, 'phone_number')
+        search_indexes.restore_after_migrate(sender=None, using='default', plan=plan)
+        self.assert_directory_in_sync()
+
+class ProductSearchTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dairy = ProductCategory.objects.create(category_name='Dairy')
+        self.thika = Branch.objects.create(branch_name='Thika', phone_number='0712121212', email='thika@cowtrack.com')
+        self.product.category = self.dairy
+        self.product.save()
+        self.yoghurt = Product.objects.create(
+            product_name='Strawberry Yoghurt', cost_price=Decimal('80'), selling_price=Decimal('120'),
+            serial_number='YG-2048', category=self.dairy, branch=self.thika)
+        self.feed = Product.objects.create(
+            product_name='Dairy Meal', cost_price=Decimal('2000'), selling_price=Decimal('2600'), branch=self.thika)
+
+    def search(self, **params):
+        response = self.client.get('/users/products/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response
+
+    def names(self, **params):
+        return [row['product_name'] for row in self.search(**params).data['results']]
+
+    def test_text_search(self):
+        self.assertEqual(self.names(search='yog'), ['Strawberry Yoghurt'])
+        self.assertEqual(self.names(search='straw yog'), ['Strawberry Yoghurt'])
+        self.assertEqual(self.names(search='yg-20'), ['Strawberry Yoghurt'])
+        self.assertEqual(self.names(search='milk OR'), [])
+
+        self.product.product_name = 'Fresh Milk'
+        self.product.save()
+        self.assertEqual(self.names(search='fresh'), ['Fresh Milk'])
+
+    def test_filters(self):
+        self.assertEqual(self.names(category=self.dairy.pk), ['Strawberry Yoghurt', 'Milk'])
+        self.assertEqual(self.names(branch=self.thika.pk, min_price='1000'), ['Dairy Meal'])
+        self.assertEqual(self.names(min_price='50', max_price='120'), ['Strawberry Yoghurt', 'Milk'])
+        self.assertEqual(self.client.get('/users/products/', {'min_price': 10, 'max_price': 5}).status_code, 400)
+
+    def test_facets_in_one_query(self):
+        with self.assertNumQueries(3):
+            facets = self.search(facets='true', branch=self.thika.pk).data['facets']
+
+        self.assertEqual(facets['branch'], [{'id': self.thika.pk, 'name': 'Thika', 'count': 2}])
+        self.assertCountEqual([(facet['name'], facet['count']) for facet in facets['category']],
+                              [('Dairy', 1), (None, 1)])
+        self.assertEqual([(bucket['min'], bucket['count']) for bucket in facets['price'] if bucket['count']],
+                         [(100, 1), (1000, 1)])
+
+    def test_search_reads_the_index_in_page_order(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search(search='yog')
+        # keyset paged, so there is no COUNT of the matches
+        [sql] = [query['sql'] for query in queries]
+        plan = ' '.join(row[-1] for row in connection.cursor().execute('EXPLAIN QUERY PLAN ' + sql).fetchall())
+        self.assertNotIn('SCAN sales_analytics_product', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_search_pages_by_cursor(self):
+        for i in range(12):
+            Product.objects.create(product_name=f'Yoghurt {i}', cost_price=Decimal('1'), selling_price=Decimal('2'))
+
+        first = self.search(search='yog').data
+        self.assertNotIn('count', first)
+        self.assertEqual(len(first['results']), 10)
+        rest = self.client.get(first['next']).data
+        self.assertEqual([row['product_name'] for row in rest['results']], ['Yoghurt 1', 'Yoghurt 0',
+                                                                          'Strawberry Yoghurt'])
+
+    def test_facets_left_out_of_broad_matches(self):
+        with mock.patch('sales_analytics.catalog.FACETS_MAX_MATCHES', 1):
+            self.assertIsNone(self.search(facets='true', category=self.dairy.pk).data['facets'])
+            self.assertIsNotNone(self.search(facets='true', search='yog').data['facets'])
+            self.assertIsNone(self.search(facets='true', search='m').data['facets'])
+
+
+
+class SerialNumberTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product.serial_number, self.product.is_serialized = 'MLK-0001', True
+        self.product.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def scan(self, serial_number):
+        return self.client.get('/users/products/scan/', {'serial_number': serial_number})
+
+    def test_scan_reports_cart_and_sale_state(self):
+        with self.assertNumQueries(1):
+            response = self.scan('MLK-0001')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['product_id'], self.product.pk)
+        self.assertEqual(response.data['branch']['branch_name'], 'Nairobi')
+        self.assertEqual((response.data['in_open_cart'], response.data['sold']), (False, False))
+
+        self.add_lines(1)
+        self.assertTrue(self.scan('MLK-0001').data['in_open_cart'])
+
+        completed_sale = checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+        data = self.scan('MLK-0001').data
+        self.assertEqual((data['in_open_cart'], data['sold']), (False, True))
+        self.assertEqual(data['completed_sale'], completed_sale.pk)
+
+    def test_scan_only_finds_serialized_products(self):
+        Product.objects.create(product_name='Ghee', cost_price=Decimal('1'), selling_price=Decimal('2'),
+                               serial_number='GH-1')
+        self.assertEqual(self.scan('GH-1').status_code, 404)
+        self.assertEqual(self.scan('').status_code, 400)
+
+    def test_resolve_many_in_one_query(self):
+        ghee = Product.objects.create(product_name='Ghee', cost_price=Decimal('1'), selling_price=Decimal('2'),
+                                      serial_number='GH-1', is_serialized=True)
+        with self.assertNumQueries(1):
+            response = self.client.post('/users/products/resolve/', {
+                'serial_numbers': ['GH-1', 'NOPE', 'MLK-0001', 'GH-1']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['product_id'] for row in response.data['products']], [ghee.pk, self.product.pk])
+        self.assertEqual(response.data['missing'], ['NOPE'])
+
+    def test_serial_number_is_unique_among_serialized_products(self):
+        admin = APIClient()
+        admin.force_authenticate(User.objects.create_superuser(username='admin', password='secret'))
+        data = {'product_name': 'Milk', 'cost_price': '40', 'selling_price': '55.50', 'serial_number': 'MLK-0001'}
+        response = admin.post('/users/products/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('serial_number', response.data)
+
+        response = admin.post('/users/products/', dict(data, serial_number='MLK-0002'), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['is_serialized'])
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Product.objects.create(product_name='Milk', cost_price=Decimal('1'), selling_price=Decimal('2'),
+                                   serial_number='MLK-0001', is_serialized=True)
+        # products sold by quantity may repeat a number, it is not an item's serial
+        Product.objects.create(product_name='Milk', cost_price=Decimal('1'), selling_price=Decimal('2'),
+                               serial_number='MLK-0001')
+
+    def test_concurrent_serial_number_is_a_validation_error(self):
+        data = {'product_name': 'Ghee', 'cost_price': '40', 'selling_price': '55.50', 'serial_number': 'GHE-0001'}
+        serializer = ProductSerializer(data=data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+        # another request saves the same serial number between validate and save
+        Product.objects.create(product_name='Ghee', cost_price=Decimal('1'), selling_price=Decimal('2'),
+                               serial_number='GHE-0001', is_serialized=True)
+
+        with self.assertRaises(serializers.ValidationError) as raised:
+            serializer.save()
+        self.assertIn('serial_number', raised.exception.detail)
+
+    def test_other_integrity_errors_are_raised(self):
+        serializer = ProductSerializer(data={'product_name': 'Ghee', 'cost_price': '40', 'selling_price': '55.50'})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        error = IntegrityError('NOT NULL constraint failed: sales_analytics_product.product_name')
+
+        with mock.patch('drf_writable_nested.serializers.WritableNestedModelSerializer.save', side_effect=error):
+            with self.assertRaises(IntegrityError):
+                serializer.save()
+
+    def test_scan_uses_the_unique_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.scan('MLK-0001')
+        plan = ' '.join(row[-1] for row in connection.cursor().execute(
+            'EXPLAIN QUERY PLAN ' + queries[0]['sql']).fetchall())
+        self.assertIn('product_serial_number_uniq', plan)
+
+class AvatarTests(SalesTestCase):
+    def test_avatar_url_is_served_locally(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        image = client.get('/users/salespersons/me/').data['image']
+        self.assertEqual(image, 'http://testserver/users/avatars/JD/')
+
+        response = self.client.get(image)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn('>JD</text>', response.content.decode())
+        self.assertIn('immutable', response['Cache-Control'])
+
+    @override_settings(AVATAR_BASE_URL='https://api.cowtrack.com')
+    def test_url_follows_renames(self):
+        self.assertEqual(avatar_url(self.user), 'https://api.cowtrack.com/users/avatars/JD/')
+
+        self.user.first_name = 'Mary'
+        self.assertEqual(avatar_url(self.user), 'https://api.cowtrack.com/users/avatars/MD/')
+
+        self.user.first_name, self.user.last_name = '', ''
+        self.assertEqual(avatar_url(self.user), 'https://api.cowtrack.com/users/avatars/%3F/')
+
+    def test_missing_base_url_is_reported(self):
+        with override_settings(AVATAR_BASE_URL=''):
+            self.assertEqual([warning.id for warning in avatars.check_avatar_base_url(None)], ['sales_analytics.W002'])
+        with override_settings(AVATAR_BASE_URL='https://api.cowtrack.com'):
+            self.assertEqual(avatars.check_avatar_base_url(None), [])
+
+    def test_initials_are_escaped(self):
+        self.assertIn('&lt;', self.client.get('/users/avatars/%3C/').content.decode())
+        self.assertEqual(self.client.get('/users/avatars/ABC/').status_code, 404)
+
+    @override_settings(AVATAR_BASE_URL='https://api.cowtrack.com')
+    def test_emails_link_absolute_urls(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser(username='admin', password='secret'))
+        branch = Branch.objects.create(branch_name='Thika', phone_number='0712121212', email='thika@cowtrack.com')
+
+        client.post(f'/users/salespersons/{self.salesperson.pk}/branches/', {'branch': branch.pk})
+
+        contexts = [email.context for email in OutboundEmail.objects.all()]
+        self.assertTrue(contexts)
+        for context in contexts:
+            self.assertEqual(context['image'], 'https://api.cowtrack.com/users/avatars/JD/')
+
+
+class CatalogCacheTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = APIClient()
+        self.admin.force_authenticate(User.objects.create_superuser(username='admin', password='secret'))
+
+    def test_reads_are_served_from_the_cache(self):
+        with self.assertNumQueries(2):
+            first = self.client.get('/users/products/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/users/products/')
+
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    @override_settings(ALLOWED_HOSTS=['api.cowtrack.com', 'staging.cowtrack.com'])
+    def test_pages_are_cached_per_origin(self):
+        PaymentMethod.objects.bulk_create([PaymentMethod(method_name=f'Method {i}') for i in range(10)])
+
+        for host in ('api.cowtrack.com', 'staging.cowtrack.com'):
+            response = self.client.get('/users/payment-methods/', HTTP_HOST=host)
+            self.assertEqual(response.data['next'], f'http://{host}/users/payment-methods/?page=2')
+
+    @override_settings(CATALOG_CACHE_TIMEOUT=600)
+    def test_entries_and_versions_expire(self):
+        shared = catalog_cache.shared
+        with mock.patch.object(shared, 'add', wraps=shared.add) as add, \
+                mock.patch.object(shared, 'set', wraps=shared.set) as set_:
+            self.client.get('/users/payment-methods/')
+
+        # FileBasedCache.add stores through set, passing the timeout positionally
+        timeouts = {call.kwargs.get('timeout', call.args[2:3] and call.args[2])
+                    for call in add.call_args_list + set_.call_args_list}
+        self.assertEqual(timeouts, {600})
+
+    def test_process_local_caches_are_reported(self):
+        self.assertEqual(caching.check_shared_caches(None), [])
+        with override_settings(CATALOG_CACHE='default'):
+            warnings = caching.check_shared_caches(None)
+        self.assertEqual([warning.id for warning in warnings], ['sales_analytics.W001'])
+        self.assertIn('CATALOG_CACHE', warnings[0].msg)
+
+    def test_shared_cache_backs_the_lru(self):
+        first = self.client.get(f'/users/products/{self.product.pk}/')
+        catalog_cache.clear()
+
+        with self.assertNumQueries(0):
+            second = self.client.get(f'/users/products/{self.product.pk}/')
+        self.assertEqual(first.content, second.content)
+
+    def test_not_modified(self):
+        etag = self.client.get('/users/payment-methods/')['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/users/payment-methods/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_writes_bump_the_version(self):
+        etag = self.client.get('/users/payment-methods/')['ETag']
+
+        self.assertEqual(self.admin.post('/users/payment-methods/', {'method_name': 'Card'}).status_code, 201)
+
+        response = self.client.get('/users/payment-methods/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([row['method_name'] for row in response.data['results']], ['Cash', 'Card'])
+
+    def test_deleting_a_branch_refreshes_products(self):
+        self.assertEqual(self.client.get(f'/users/products/{self.product.pk}/').data['branch'], self.branch.pk)
+
+        self.assertEqual(self.admin.delete(f'/users/branches/{self.branch.pk}/').status_code, 204)
+
+        self.assertIsNone(self.client.get(f'/users/products/{self.product.pk}/').data['branch'])
+
+    def test_admin_writes_bump_the_version(self):
+        etag = self.client.get('/users/product-categories/')['ETag']
+        self.client.force_login(User.objects.get(username='admin'))
+
+        response = self.client.post('/admin/sales_analytics/productcategory/add/', {'category_name': 'Dairy'})
+        self.assertEqual(response.status_code, 302)
+
+        self.client.logout()
+        response = self.client.get('/users/product-categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['category_name'], 'Dairy')
+
+
+class ConditionalDashboardTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.admin = APIClient()
+        self.admin.force_authenticate(User.objects.create_superuser(username='admin', password='secret'))
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_not_modified_runs_one_query(self):
+        self.add_lines(1)
+        checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)
+        first = self.client.get('/users/salespersons/me/')
+        self.assertIn('Last-Modified', first)
+
+        with self.assertNumQueries(1):
+            response = self.revalidate('/users/salespersons/me/', first)
+        self.assertEqual(response.status_code, 304)
+
+        # Last-Modified misses edits of the user row, so it is not enough on its own
+        response = self.client.get('/users/salespersons/me/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_changes_invalidate_the_dashboard(self):
+        url = '/users/salespersons/me/'
+        changes = [
+            lambda: (self.add_lines(1), checkout.complete_sale(self.salesperson.pk, self.payment_method.pk)),
+            lambda: MonthlySales.objects.update(number_of_sales=0),
+            lambda: SalesPersonBranch.objects.create(salesperson=self.salesperson, branch=self.branch),
+            lambda: SalesPersonBranch.objects.update(termination_date=timezone.now()),
+            lambda: self.client.put(url, {'phone_number': '0799999999'}, format='json'),
+            lambda: self.admin.patch(
+                f'/users/all-users/{self.user.pk}/', {'first_name': 'Johnny', 'password': 'Tr1cky-passw0rd'}),
+            lambda: self.admin.patch(f'/users/branches/{self.branch.pk}/', {'branch_name': 'Thika'}),
+            # user edits outside of /users/all-users/ leave the profile's updated_at alone
+            lambda: self.client.patch('/auth/users/me/', {'email': 'johnny@cowtrack.com'}, format='json'),
+            lambda: self.client.post(
+                '/auth/users/set_username/', {'current_password': 'secret', 'new_username': 'johnd'}, format='json'),
+            lambda: User.objects.filter(pk=self.user.pk).update(email='john@cowtrack.com'),
+        ]
+        for change in changes:
+            previous = self.client.get(url)
+            change()
+            response = self.revalidate(url, previous)
+            self.assertEqual(response.status_code, 200, change)
+            self.assertNotEqual(response['ETag'], previous['ETag'])
+
+    def test_manager_profile(self):
+        manager_user = User.objects.create_user(username='manager', password='secret', role='manager')
+        Manager.objects.create(user=manager_user, phone_number='0733333333')
+        self.client.force_authenticate(manager_user)
+        first = self.client.get('/users/managers/me/')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate('/users/managers/me/', first).status_code, 304)
+
+        self.client.put('/users/managers/me/', {'phone_number': '0744444444'}, format='json')
+        self.assertEqual(self.revalidate('/users/managers/me/', first).status_code, 200)
+
+        second = self.client.get('/users/managers/me/')
+        self.client.patch('/auth/users/me/', {'email': 'mary@cowtrack.com'}, format='json')
+        self.assertEqual(self.revalidate('/users/managers/me/', second).status_code, 200)
+
+
+BUDGET_FILE = Path(__file__).resolve().parent.parent / 'benchmarks' / 'budget.json'
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        for shared in caches.all():
+            shared.clear()
+        catalog_cache.clear()
+
+    def test_run_covers_every_route(self):
+        # routes that are broken today answer 500, keep their tracebacks out of the test output
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+        results = benchmark.run(scale=1, iterations=1)
+
+        names = {pattern.name for pattern in urls.urlpatterns if 'format' not in pattern.pattern.regex.groupindex}
+        self.assertEqual(set(results['endpoints']), names)
+        checkout = results['endpoints']['salesperson-sales-complete-sale']
+        self.assertEqual((checkout['method'], checkout['status']), ('POST', 200))
+        self.assertEqual(results['endpoints']['carts-bulk']['status'], 201)
+        self.assertEqual(results['endpoints']['onboarding-list']['status'], 201)
+
+        # a single iteration only checks the statuses and query counts, which must hold on every machine
+        self.assertEqual(benchmark.check_budget(results, json.loads(BUDGET_FILE.read_text())), [])
+
+    def test_check_budget_reports_regressions(self):
+        results = {'iterations': 20, 'endpoints': {
+            'products-list-list': {'status': 200, 'queries': 5, 'p90_ms': 80.0},
+            'branches-list-list': {'status': 500, 'queries': 2, 'p90_ms': 10.0},
+        }}
+        budget = {
+            'products-list-list': {'status': 200, 'queries': 2, 'p90_ms': 50},
+            'branches-list-list': {'status': 200, 'queries': 2, 'p90_ms': 50},
+            'gone-list': {'status': 200},
+            'broken-list': {'status': 500, 'queries': 0},
+        }
+
+        self.assertEqual(benchmark.check_budget(results, budget), [
+            'products-list-list: 5 queries > 2',
+            'products-list-list: p90 80.0ms > 50ms',
+            'branches-list-list: status 500 != 200',
+            'gone-list: endpoint is no longer registered',
+            'broken-list: budgeted status 500 is an error',
+        ])
+        self.assertEqual(set(benchmark.budget_from(results)), {'products-list-list'})
+        self.assertEqual(benchmark.check_budget(results, benchmark.budget_from(results)), [])
+
+        # too few requests for a p90 to mean anything
+        self.assertNotIn('products-list-list: p90 80.0ms > 50ms',
+                         benchmark.check_budget({**results, 'iterations': 5}, budget))
@@ -16,6 +16,12 @@ router.register('payment-methods', views.PaymentMethodViewSet, basename='payment
 router.register('cart', views.CartViewSet, basename='cart-list')
 router.register('sales', views.SaleViewSet, basename='sales-list')
 router.register('completed-sales', views.CompletedSaleViewSet, basename='completedsales-list')
+router.register('transactions', views.TransactionViewSet, basename='transactions-list')
+router.register('analytics', views.SalesAnalyticsViewSet, basename='analytics')
+router.register('query-stats', views.QueryStatsViewSet, basename='query-stats')
+router.register('avatars', views.AvatarViewSet, basename='avatars')
+router.register('onboarding', views.OnboardingViewSet, basename='onboarding')
+router.register('directory', views.DirectoryViewSet, basename='directory')
 
 
 
@@ -1,24 +1,45 @@
+from copy import copy
+
 from django.contrib.auth import get_user_model
 from django.db import transaction
-from django.db.models import Count, Sum
-from django.db.models.functions import ExtractYear, ExtractMonth
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework.viewsets import ModelViewSet
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.viewsets import ModelViewSet, GenericViewSet, ViewSet
+from rest_framework.mixins import RetrieveModelMixin
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
 from .serializers import CustomerSerializer, UserSerializer, SalesPersonSerializer, BranchSerializer
 from .serializers import SupplierSerializer
 from .serializers import SalesPersonBranchSerializer, SimpleSalesPersonBranchSerializer, ManagerSerializer
 from .serializers import ProductCategorySerializer, ProductSerializer, PaymentMethodSerializer
-from .serializers import CartReadSerializer, CartWriteSerializer, CartUpdateSerializer
+from .serializers import CartReadSerializer, CartWriteSerializer, CartUpdateSerializer, CartLineSerializer
 from .serializers import SaleReadSerializer, SaleWriteSerializer, CompletedSaleWriteSerializer
-from .serializers import CompletedSaleReadSerializer, CompletedSalePaymentSerializer
+from .serializers import CompletedSaleReadSerializer, CompletedSalePaymentSerializer, ReceiptLineSerializer
 from .serializers import MonthlySalesSerializer
+from .serializers import CustomerReadSerializer, SalesPersonReadSerializer, ManagerReadSerializer, SupplierReadSerializer
 from .models import Customer, SalesPerson, Branch, SalesPersonBranch, Manager, Supplier, ProductCategory
-from .models import Product, PaymentMethod, Cart, Sale, CompletedSale
+from .models import Product, PaymentMethod, Cart, Sale, CompletedSale, MonthlySales
+from .pagination import KeysetPagination
+from .authentication import StatelessJWTAuthentication
+from .caching import CatalogCacheMixin
+from .conditional import with_dashboard_state, salesperson_dashboard_validators, manager_profile_validators
+from .conditional import not_modified, set_validators
+from .exports import CompletedSaleExportSerializer, completed_sales_for_export, export_rows, EXPORT_FORMATS
 from .permissions import IsSuperUser, IsSalesperson, IsManager, IsSuperUserOrReadOnly, CanCRUDCart
+from .permissions import IsManagerOrSuperUser
+from .instrumentation import view_stats
+from .idempotency import IDEMPOTENCY_KEY_HEADER, idempotent_response
+from .rollups import record_completed_sale, withdraw_completed_sale, branches_deleted
+from .analytics import SalesAnalyticsQuerySerializer, sales_analytics, representation, invalidate_closed_periods
+from .directory import DirectoryQuerySerializer, search_people
+from .catalog import ProductSearchSerializer, search_products, product_facets, products
+from .onboarding import CSVParser
+from . import avatars, checkout, onboarding, serials
 
 
 User = get_user_model()
@@ -29,28 +50,55 @@ class CustomerViewSet(ModelViewSet):
     queryset = Customer.objects.all().select_related(
         'user').order_by('-user__date_joined')
     permission_classes = (IsSuperUser,)
+    authentication_classes = (StatelessJWTAuthentication,)
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return CustomerReadSerializer
+        return CustomerSerializer
 
 
 class UserViewSet(ModelViewSet):
     serializer_class = UserSerializer
     queryset = User.objects.all().order_by('-date_joined')
     permission_classes = (IsSuperUser,)
+    authentication_classes = (StatelessJWTAuthentication,)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        # the profiles' dashboards show the user, and are revalidated on updated_at
+        SalesPerson.objects.filter(user=serializer.instance).update(updated_at=timezone.now())
+        Manager.objects.filter(user=serializer.instance).update(updated_at=timezone.now())
 
 
 class SalesPersonViewSet(ModelViewSet):
     serializer_class = SalesPersonSerializer
     queryset = SalesPerson.objects.all().select_related('user').order_by('-user__date_joined')
     permission_classes = (IsSuperUser,)
+    authentication_classes = (StatelessJWTAuthentication,)
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return SalesPersonReadSerializer
+        return SalesPersonSerializer
 
     @action(detail=False, methods=['get', 'put'], permission_classes=[IsAuthenticated, IsSalesperson])
     def me(self, request):
-        salesperson = get_object_or_404(SalesPerson.objects.select_related('user'), user=request.user)
+        salespersons = SalesPerson.objects.select_related('user')
+        if request.method == 'GET':
+           salespersons = with_dashboard_state(salespersons)
+        salesperson = get_object_or_404(salespersons, user_id=request.user.pk)
 
         if request.method == 'PUT':
            serializer = SalesPersonSerializer(salesperson, data=request.data, partial=True)
            serializer.is_valid(raise_exception=True)
            serializer.save()
            return Response(serializer.data)
+
+        validators = salesperson_dashboard_validators(salesperson)
+        response = not_modified(request, *validators)
+        if response is not None:
+            return response
        
         serializer = self.get_serializer(salesperson)
         response_data = serializer.data
@@ -58,55 +106,65 @@ class SalesPersonViewSet(ModelViewSet):
         branches = SalesPersonBranch.objects.filter(salesperson=salesperson).select_related("salesperson").select_related("branch").order_by('-assignment_date')
         branch_serializer = SimpleSalesPersonBranchSerializer(branches, many=True)
 
-        sales = CompletedSale.objects.filter(salesperson=salesperson).annotate(
-            year=ExtractYear('completed_at'),
-            month=ExtractMonth('completed_at')
-            ).values(
-            'year', 'month', 'branch__branch_name'
-            ).annotate(
-            number_of_sales=Count('sale_id'),
-            total_amount=Sum('total_amount')
-            ).order_by('year', 'month')
+        sales = MonthlySales.objects.filter(salesperson=salesperson).order_by('year', 'month', 'branch_id')
 
         monthly_sales_serializer = MonthlySalesSerializer(sales, many=True)
 
         response_data['branches'] = branch_serializer.data
         response_data['monthly_sales'] = monthly_sales_serializer.data
 
-        return Response(response_data)
+        return set_validators(Response(response_data), *validators)
 
 
 class ManagerViewSet(ModelViewSet):
     serializer_class = ManagerSerializer
     queryset = Manager.objects.all().select_related('user').order_by('-user__date_joined')
     permission_classes = (IsSuperUser,)
+    authentication_classes = (StatelessJWTAuthentication,)
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return ManagerReadSerializer
+        return ManagerSerializer
 
     @action(detail=False, methods=['get', 'put'], permission_classes=[IsAuthenticated, IsManager])
     def me(self, request):
-        manager = get_object_or_404(Manager.objects.select_related('user'), user=request.user)
+        manager = get_object_or_404(Manager.objects.select_related('user'), user_id=request.user.pk)
 
         if request.method == 'PUT':
            serializer = ManagerSerializer(manager, data=request.data, partial=True)
            serializer.is_valid(raise_exception=True)
            serializer.save()
            return Response(serializer.data)
+
+        validators = manager_profile_validators(manager)
+        response = not_modified(request, *validators)
+        if response is not None:
+            return response
        
         serializer = self.get_serializer(manager)
         response_data = serializer.data
 
-        return Response(response_data)
+        return set_validators(Response(response_data), *validators)
 
 
-class BranchViewSet(ModelViewSet):
+class BranchViewSet(CatalogCacheMixin, ModelViewSet):
     serializer_class = BranchSerializer
     queryset = Branch.objects.all().order_by('-opening_date')
     permission_classes = (IsSuperUser,)
+    authentication_classes = (StatelessJWTAuthentication,)
+    cache_models = (Branch,)
+
+    def perform_destroy(self, instance):
+        with branches_deleted([instance.pk]):
+            super().perform_destroy(instance)
 
 
 
 class SalesPersonBranchViewSet(ModelViewSet):
     serializer_class = SalesPersonBranchSerializer
     permission_classes = (IsSuperUser,)
+    authentication_classes = (StatelessJWTAuthentication,)
 
     def get_queryset(self):
        salesperson_id = self.kwargs['salesperson_pk']
@@ -122,33 +180,98 @@ class SupplierViewSet(ModelViewSet):
     serializer_class = SupplierSerializer
     queryset = Supplier.objects.all().select_related('user').order_by('-user__date_joined')
     permission_classes = (IsSuperUser,)
+    authentication_classes = (StatelessJWTAuthentication,)
 
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return SupplierReadSerializer
+        return SupplierSerializer
 
-class ProductCategoryViewSet(ModelViewSet):
+
+class ProductCategoryViewSet(CatalogCacheMixin, ModelViewSet):
     serializer_class = ProductCategorySerializer
     queryset = ProductCategory.objects.all()
     permission_classes = (IsSuperUserOrReadOnly,)
+    authentication_classes = (StatelessJWTAuthentication,)
+    cache_models = (ProductCategory,)
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(CatalogCacheMixin, ModelViewSet):
     serializer_class = ProductSerializer
     queryset = Product.objects.all().select_related('branch').select_related('category').order_by('-product_id')
     permission_classes = (IsSuperUserOrReadOnly,)
+    authentication_classes = (StatelessJWTAuthentication,)
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-product_id',)
+    # deleting a branch or category nulls the product's foreign key
+    cache_models = (Product, Branch, ProductCategory)
 
-
-class PaymentMethodViewSet(ModelViewSet):
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, self.search, *args, **kwargs)
+
+    def search(self, request, *args, **kwargs):
+        """
+        Products filtered by text search, category, branch and price range, with
+        their facet counts when facets=true. Text searches are paged by keyset
+        only, counting every match of a broad search costs more than the page.
+        """
+        params = ProductSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        queryset = search_products(self.filter_queryset(self.get_queryset()), **params.validated_data)
+
+        self.keyset_only = bool(params.validated_data.get('search'))
+        page = self.paginate_queryset(queryset)
+        response = self.get_paginated_response(self.get_serializer(products(page), many=True).data)
+        if params.validated_data['facets']:
+            response.data['facets'] = product_facets(queryset, response.data.get('count'))
+        return response
+
+    @action(detail=False, permission_classes=(CanCRUDCart,))
+    def scan(self, request):
+        """
+        The serialized product carrying ?serial_number=, with its branch and
+        whether it is in an open cart or was already sold. Not cached, as
+        the cart state changes with every sale.
+        """
+        params = serials.ScanQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        product = serials.scan(params.validated_data['serial_number'])
+        if product is None:
+            return Response({'message': 'No serialized product carries this serial number'},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response(serials.ScannedProductSerializer(product).data)
+
+    @action(detail=False, methods=['post'], permission_classes=(CanCRUDCart,))
+    def resolve(self, request):
+        """
+        Resolve up to serials.MAX_SERIALS serial numbers at once, for receiving stock.
+        """
+        params = serials.ResolveSerialsSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        products, missing = serials.resolve(params.validated_data['serial_numbers'])
+        return Response({
+            'products': serials.ScannedProductSerializer(products, many=True).data,
+            'missing': missing,
+        })
+
+
+class PaymentMethodViewSet(CatalogCacheMixin, ModelViewSet):
     serializer_class = PaymentMethodSerializer
     queryset = PaymentMethod.objects.all()
     permission_classes = (IsSuperUserOrReadOnly,)
+    authentication_classes = (StatelessJWTAuthentication,)
+    cache_models = (PaymentMethod,)
 
 
 class CartViewSet(ModelViewSet):
     queryset = Cart.objects.all().select_related('product').order_by('-product_id')
     permission_classes = (CanCRUDCart,)
+    authentication_classes = (StatelessJWTAuthentication,)
 
     def get_queryset(self):
        customer_id = self.kwargs['customer_pk']
-       return Cart.objects.filter(customer_id=customer_id).order_by('-cart_id')
+       return Cart.objects.filter(customer_id=customer_id).select_related('product') \
+            .with_total_price().order_by('-cart_id')
     
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -159,12 +282,49 @@ class CartViewSet(ModelViewSet):
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
+        price = queryset.total_price()
+
+        # the cart is only paginated when a page is asked for
+        if self.paginator.page_query_param in request.query_params:
+            page = self.paginate_queryset(queryset)
+            response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+            response.data['price'] = price
+            return response
+
         serializer = self.get_serializer(queryset, many=True)
-        price = sum(cart['total_price'] for cart in serializer.data)
         return Response({'results': serializer.data, 'price': price})
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, customer_pk=None):
+        customer = get_object_or_404(Customer.objects.only('customer_id'), pk=customer_pk)
+
+        serializer = CartLineSerializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        lines = serializer.validated_data
+
+        products = Product.objects.in_bulk({line['product'] for line in lines})
+        errors = [
+            {} if line['product'] in products else {'product': [f'Invalid pk "{line["product"]}" - object does not exist.']}
+            for line in lines
+        ]
+        if any(errors):
+            raise ValidationError(errors)
+
+        with transaction.atomic():
+            carts = Cart.objects.bulk_create([
+                Cart(customer=customer, product=products[line['product']], number_of_items=line['number_of_items'])
+                for line in lines
+            ])
+            price = Cart.objects.filter(customer=customer).total_price()
+
+        return Response({'results': CartReadSerializer(carts, many=True).data, 'price': price}, status=status.HTTP_201_CREATED)
+
 
 class SaleViewSet(ModelViewSet):
+    authentication_classes = (StatelessJWTAuthentication,)
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-transaction_date', '-sale_id')
+
     def get_serializer_class(self):
         if self.action == 'complete_sale':
             return CompletedSaleReadSerializer
@@ -173,26 +333,28 @@ class SaleViewSet(ModelViewSet):
         return SaleWriteSerializer
 
     def get_permissions(self):
-       if self.request.user.role == 'superuser':
+       if self.request.user.is_superuser:
            return [IsSuperUser()]
-       elif self.request.user.role == 'salesperson':
-           return [IsAuthenticated(), IsSalesperson()]
+       return [IsAuthenticated(), IsSalesperson()]
 
 
     def get_queryset(self):
        salesperson_id = self.kwargs['salesperson_pk']
-       return Sale.objects.filter(salesperson_id=salesperson_id).select_related('salesperson') \
-            .select_related('cart').order_by('-transaction_date')
+       return Sale.objects.filter(salesperson_id=salesperson_id).select_related('salesperson__user') \
+            .select_related('cart__product').order_by('-transaction_date')
 
 
     @action(detail=False, methods=['post', 'get'])
     def complete_sale(self, request, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if request.method == 'POST' and key:
+            return idempotent_response(request, key, lambda: self.checkout(request))
+        return self.checkout(request)
+
+    def checkout(self, request):
         salesperson_id = self.kwargs['salesperson_pk']
         
-        sales = Sale.objects.filter(salesperson_id=salesperson_id, is_completed=0).select_related('salesperson') \
-            .select_related('cart').order_by('-transaction_date')
-        
-        if not sales:
+        if not checkout.open_sales(salesperson_id).exists():
             raise ValidationError({"message": "Can't complete sale cart is empty"})
 
         payment_method = request.data.get('payment_method')
@@ -203,35 +365,167 @@ class SaleViewSet(ModelViewSet):
         if self.request.method == "GET":
             completed_sales = CompletedSale.objects.filter(salesperson_id=salesperson_id)
             return Response(CompletedSaleReadSerializer(completed_sales).data)
-        
-        with transaction.atomic():
-            latest_branch = SalesPersonBranch.objects.filter(salesperson_id=salesperson_id) \
-                .select_related('salesperson').select_related('branch').order_by('-salesperson_branch_id').first()
-            total_price = 0
 
-            for sale in sales:
-                sale.is_completed = 1
-                sale.save()
+        completed_sale = checkout.complete_sale(salesperson_id, payment_method)
 
-                cart = Cart.objects.get(cart_id=sale.cart_id)
+        return Response(CompletedSaleReadSerializer(completed_sale).data)
 
-                total_price += cart.number_of_items * cart.product.selling_price
 
-            completed_sale = CompletedSale.objects.create(
-                salesperson_id=int(salesperson_id), 
-                branch_id=latest_branch.branch_id, 
-                total_amount=total_price,
-                payment_method_id=int(payment_method)
-            )
-            
-            return Response(CompletedSaleReadSerializer(completed_sale).data)
+class TransactionViewSet(RetrieveModelMixin, GenericViewSet):
+    serializer_class = SaleReadSerializer
+    queryset = Sale.objects.all().select_related('salesperson__user').select_related('cart__product')
+    permission_classes = (IsSuperUser,)
+    authentication_classes = (StatelessJWTAuthentication,)
+    lookup_field = 'transaction_id'
 
 
 class CompletedSaleViewSet(ModelViewSet):
-    queryset = CompletedSale.objects.all().select_related('branch').select_related('salesperson')
+    queryset = CompletedSale.objects.all().select_related('branch').select_related('salesperson__user')
     permission_classes = (IsSuperUser,)
+    authentication_classes = (StatelessJWTAuthentication,)
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-completed_at', '-sale_id')
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return CompletedSaleReadSerializer
-        return CompletedSaleWriteSerializer
\ No newline at end of file
+        return CompletedSaleWriteSerializer
+
+    # the monthly rollup follows every change, as it does for checkouts
+    @transaction.atomic
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        record_completed_sale(serializer.instance)
+        invalidate_closed_periods()
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        withdraw_completed_sale(copy(serializer.instance))
+        super().perform_update(serializer)
+        record_completed_sale(serializer.instance)
+        invalidate_closed_periods()
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        withdraw_completed_sale(instance)
+        super().perform_destroy(instance)
+        invalidate_closed_periods()
+
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated, IsSuperUser | IsSalesperson])
+    def receipt(self, request, pk=None):
+        """
+        The completed sale with the sales it closed, in two queries. Salespersons only get their own receipts.
+        """
+        completed_sales = self.get_queryset()
+        if not request.user.is_superuser:
+            completed_sales = completed_sales.filter(salesperson__user_id=request.user.pk)
+        completed_sale = get_object_or_404(completed_sales, pk=pk)
+
+        lines = completed_sale.lines.select_related('cart__product') \
+            .annotate(line_total=checkout.LINE_TOTAL).order_by('sale_id')
+
+        response_data = CompletedSaleReadSerializer(completed_sale).data
+        response_data['lines'] = ReceiptLineSerializer(lines, many=True).data
+        return Response(response_data)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream the completed sales, optionally filtered by day range, branch and salesperson, as CSV or NDJSON.
+        """
+        params = CompletedSaleExportSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        filters = dict(params.validated_data)
+        output = filters.pop('output')
+        stream, content_type = EXPORT_FORMATS[output]
+
+        rows = export_rows(completed_sales_for_export(**filters))
+        response = StreamingHttpResponse(stream(rows), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="completed-sales.{output}"'
+        return response
+
+
+class DirectoryViewSet(ViewSet):
+    """
+    Search of customers, salespersons, supervisors, managers and suppliers
+    by the start of any word of their name, username, email or phone number.
+    """
+    permission_classes = (IsManagerOrSuperUser,)
+    authentication_classes = (StatelessJWTAuthentication,)
+
+    def list(self, request):
+        params = DirectoryQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        query = params.validated_data
+        return Response(search_people(query['q'], role=query.get('role'), limit=query['limit']))
+
+
+class OnboardingViewSet(ViewSet):
+    """
+    Bulk creation of the users and profiles of one role, from a JSON list or
+    a CSV file of rows: POST /users/onboarding/?role=salesperson.
+    """
+    permission_classes = (IsSuperUser,)
+    parser_classes = (JSONParser, CSVParser)
+
+    def create(self, request):
+        role = request.query_params.get('role')
+        if role not in onboarding.ROLES:
+            raise ValidationError({'message': f'role must be one of {", ".join(onboarding.ROLES)}'})
+        if not isinstance(request.data, list):
+            raise ValidationError({'message': 'Expected a list of rows'})
+
+        profiles, errors = onboarding.onboard(role, request.data)
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'created': len(profiles), 'ids': [profile.pk for profile in profiles]},
+                        status=status.HTTP_201_CREATED)
+
+
+class AvatarViewSet(ViewSet):
+    """
+    Initials avatars of the users, rendered locally. The image only depends on
+    the initials in the URL, so clients may cache it for good.
+    """
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+    lookup_field = 'initials'
+    lookup_value_regex = f'[^/.]{{1,{avatars.MAX_INITIALS}}}'
+
+    def retrieve(self, request, initials=None):
+        response = HttpResponse(avatars.render_avatar(initials), content_type='image/svg+xml')
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+
+class QueryStatsViewSet(ViewSet):
+    """
+    Per-view query counts and timings collected by the instrumentation
+    middleware since this worker started or was last reset.
+    """
+    permission_classes = (IsSuperUser,)
+    authentication_classes = (StatelessJWTAuthentication,)
+
+    def list(self, request):
+        return Response(view_stats.snapshot())
+
+    @action(detail=False, methods=['post'])
+    def reset(self, request):
+        view_stats.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class SalesAnalyticsViewSet(ViewSet):
+    """
+    Number and total of completed sales per day, week or month, optionally
+    broken down by branch, payment method and salesperson.
+    """
+    permission_classes = (IsAuthenticated, IsManagerOrSuperUser)
+    authentication_classes = (StatelessJWTAuthentication,)
+
+    def list(self, request):
+        params = SalesAnalyticsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        rows = sales_analytics(**params.validated_data)
+
+        return Response({**params.validated_data, 'results': representation(rows)})